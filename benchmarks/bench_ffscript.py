@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# vim: se fenc=utf8 :
+'''End-to-end benchmarks of ffscript's own overhead.
+
+Creates synthetic local git, svn and hg repositories (for whichever of the
+tools are installed) holding tiny autoconf-style libraries, then times
+download_repos(), update_repos(), compile_libs() and RepoBase.get_config() at
+increasing library counts and repository sizes.  Nothing touches the network.
+
+Results are written as JSON so runs on different commits can be compared:
+
+    python3 benchmarks/bench_ffscript.py -o before.json
+    git checkout other-commit
+    python3 benchmarks/bench_ffscript.py -o after.json --compare before.json
+'''
+
+__author__ = "Francesco Magliocco (aka Cmptr)"
+__license__ = "GPLv3"
+__version__ = "0.0.1"
+__maintainer__ = "Francesco Magliocco (aka Cmptr)"
+__status__ = "Development"
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _ROOT)
+sys.path.insert(0, os.path.join(_ROOT, 'scripts'))
+
+import ffscript
+import registry
+
+_CONFIGURE = r'''#!/bin/sh
+prefix=/usr/local
+for arg in "$@"; do
+    case $arg in
+        --prefix=*) prefix=${arg#--prefix=} ;;
+    esac
+done
+objs=
+for src in src/*.c; do
+    objs="$objs ${src%.c}.o"
+done
+cat > Makefile <<EOF
+all: lib{name}.a
+lib{name}.a:$objs
+	ar rcs \$@ $objs
+install: all
+	mkdir -p \$(DESTDIR)$prefix/lib
+	cp lib{name}.a \$(DESTDIR)$prefix/lib/
+EOF
+echo "prefix=$prefix" > config.mak
+'''
+
+_LIB_MODULE = '''
+from repobase import RepoBase, RepoTool
+
+LIBRARY = {{
+    'name': {name!r},
+    'class': 'BenchLib',
+    'switch': '--enable-{name}',
+    'depends': ()
+}}
+
+class BenchLib(RepoBase):
+
+    def __init__(self):
+        super().__init__(LIBRARY['name'],
+                         'configure ',
+                         RepoTool.{tool},
+                         {url!r},
+                         LIBRARY['switch'],
+                         LIBRARY['depends'])
+        self.options.add_option('prefix', kwarg=True)
+        for i in range({options:d}):
+            self.options.add_option(f'enable-feature{{i}}')
+            self.options.add_option(f'with-value{{i}}', kwarg=True)
+
+    def get_repo_download(self):
+        pass
+'''
+
+# git refuses to commit without an identity.
+_GIT_ENV = ('GIT_AUTHOR_NAME=bench GIT_AUTHOR_EMAIL=bench@localhost '
+            'GIT_COMMITTER_NAME=bench GIT_COMMITTER_EMAIL=bench@localhost')
+
+def _run(command, cwd=None):
+    subprocess.run(command, shell=True, cwd=cwd, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def available_tools():
+    """Returns the RepoTool names that can be benchmarked here."""
+    tools = []
+    if shutil.which('git'):
+        tools.append('GIT_TOOL')
+    if shutil.which('svn') and shutil.which('svnadmin'):
+        tools.append('SVN_TOOL')
+    if shutil.which('hg'):
+        tools.append('HG_TOOL')
+
+    return tools
+
+def _write_source(work_dir, name, files):
+    os.makedirs(os.path.join(work_dir, 'src'))
+    with open(os.path.join(work_dir, 'configure'), 'w') as configure:
+        configure.write(_CONFIGURE.replace('{name}', name))
+
+    os.chmod(os.path.join(work_dir, 'configure'), 0o755)
+    for i in range(files):
+        with open(os.path.join(work_dir, 'src', f'f{i:d}.c'), 'w') as src:
+            src.write(f'int {name:s}_f{i:d}(int x) {{ return x * {i:d}; }}\n')
+
+def make_repo(root, name, tool, files):
+    """Creates a repository of tool holding a tiny library, returning its
+        URL.
+    """
+    work_dir = os.path.join(root, 'work', name)
+    _write_source(work_dir, name, files)
+    if tool == 'GIT_TOOL':
+        _run(f'git init -q && git add -A && {_GIT_ENV:s} git commit -qm init',
+             work_dir)
+        return f'file://{work_dir:s}'
+
+    if tool == 'SVN_TOOL':
+        repo_dir = os.path.join(root, 'svn', name)
+        _run(f'svnadmin create {repo_dir:s}')
+        _run(f'svn import -q -m init {work_dir:s} file://{repo_dir:s}')
+        return f'file://{repo_dir:s}'
+
+    _run('hg init && hg add -q && hg commit -q -u bench -m init', work_dir)
+    return work_dir
+
+def commit_change(root, name, tool, url):
+    """Adds a commit to the repository of name so updates have work to do."""
+    work_dir = os.path.join(root, 'work', name)
+    with open(os.path.join(work_dir, 'src', 'f0.c'), 'a') as src:
+        src.write('/* changed */\n')
+
+    if tool == 'GIT_TOOL':
+        _run(f'{_GIT_ENV:s} git commit -qam change', work_dir)
+    elif tool == 'SVN_TOOL':
+        checkout = os.path.join(root, 'svnwc', name)
+        if not os.path.isdir(checkout):
+            _run(f'svn co -q {url:s} {checkout:s}')
+
+        shutil.copy(os.path.join(work_dir, 'src', 'f0.c'),
+                    os.path.join(checkout, 'src', 'f0.c'))
+        _run('svn commit -q -m change', checkout)
+    else:
+        _run('hg commit -q -u bench -m change', work_dir)
+
+class BenchmarkFailed(Exception):
+    """A timed step failed, so its time says nothing about ffscript."""
+
+def _repos_ok(results):
+    return bool(results) and all(res.success for res in results)
+
+class Scenario:
+    """libs synthetic libraries of files source files each."""
+
+    def __init__(self, root, libs, files, options, tools):
+        self.root = root
+        self.libs = libs
+        self.files = files
+        self.lib_dir = os.path.join(root, 'libs')
+        self.repo_prefix = os.path.join(root, 'repos')
+        self.prefix = os.path.join(root, 'prefix')
+        self.names = []
+        self.tools = {}
+        self.urls = {}
+        os.makedirs(self.lib_dir)
+        tag = os.path.basename(root)
+        for i in range(libs):
+            name = f'bench{tag:s}x{i:d}'
+            tool = tools[i % len(tools)]
+            url = make_repo(root, name, tool, files)
+            with open(os.path.join(self.lib_dir, f'{name:s}.py'), 'w') as mod:
+                mod.write(_LIB_MODULE.format(name=name,
+                                             tool=tool,
+                                             url=url,
+                                             options=options))
+
+            self.names.append(name)
+            self.tools[name] = tool
+            self.urls[name] = url
+
+        sys.path.insert(0, self.lib_dir)
+        ffscript._ALL_REPOS = registry.LibraryRegistry(self.lib_dir)
+
+    def time(self, name, func, check):
+        """Returns how long func took, raising BenchmarkFailed if check
+            doesn't accept what it returned.
+        """
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        if not check(result):
+            raise BenchmarkFailed(f"{name:s} failed in '{self.root:s}'")
+
+        return seconds
+
+    def run(self, jobs, config_iterations):
+        results = {}
+        results['download_repos'] = self.time(
+            'download_repos',
+            lambda: ffscript.download_repos(
+                self.names, self.repo_prefix, False, jobs),
+            _repos_ok)
+
+        for name in self.names:
+            commit_change(self.root, name, self.tools[name], self.urls[name])
+
+        results['update_repos'] = self.time(
+            'update_repos',
+            lambda: ffscript.update_repos(self.repo_prefix, self.names, jobs),
+            _repos_ok)
+
+        results['compile_libs'] = self.time(
+            'compile_libs',
+            lambda: ffscript.compile_libs(
+                self.names, self.repo_prefix, self.prefix, None, jobs),
+            bool)
+
+        libs = [ffscript._ALL_REPOS[name] for name in self.names]
+        kwargs = {f'with_value{i:d}': str(i) for i in range(8)}
+        kwargs['prefix'] = self.prefix
+        args = [f'enable-feature{i:d}' for i in range(8)]
+        results['get_config'] = timeit.timeit(
+            lambda: [lib.get_config(*args, **kwargs) for lib in libs],
+            number=config_iterations) / config_iterations
+
+        return results
+
+def _git_revision():
+    try:
+        return subprocess.run('git rev-parse HEAD', shell=True, cwd=_ROOT,
+                              check=True, stdout=subprocess.PIPE,
+                              universal_newlines=True).stdout.strip()
+    except subprocess.CalledProcessError:
+        return None
+
+def compare(old, new):
+    """Prints how every benchmark of new changed relative to old."""
+    old_results = {(r['libs'], r['files'], r['benchmark']): r['seconds']
+                   for r in old['results']}
+    print(f"{'benchmark':<16s} {'libs':>5s} {'files':>6s} {'old':>9s} "
+          f"{'new':>9s} {'change':>8s}")
+    for res in new['results']:
+        key = (res['libs'], res['files'], res['benchmark'])
+        if key not in old_results:
+            continue
+
+        before = old_results[key]
+        change = (res['seconds'] - before) / before if before else 0.0
+        print(f"{res['benchmark']:<16s} {res['libs']:5d} {res['files']:6d} "
+              f"{before:9.4f} {res['seconds']:9.4f} {change:+8.1%}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=__doc__.splitlines()[0])
+    parser.add_argument('--libs', type=int, nargs='+', default=[1, 4, 16],
+                        help='Library counts to benchmark.')
+    parser.add_argument('--files', type=int, nargs='+', default=[10, 100],
+                        help='Source files per library to benchmark.')
+    parser.add_argument('--options', type=int, default=200,
+                        help='Options registered by each library.')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=os.cpu_count() or 1,
+                        help='Concurrency given to ffscript.')
+    parser.add_argument('--config-iterations', type=int, default=200,
+                        help='Times get_config() is timed for every lib.')
+    parser.add_argument('-o', '--output',
+                        help='File to write the JSON results to.  stdout if '
+                             'not given.')
+    parser.add_argument('--compare', metavar='json',
+                        help='Earlier results to compare against.')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the temporary directories.')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    tools = available_tools()
+    if not tools:
+        logging.error('None of git, svn or hg are installed')
+        sys.exit(1)
+
+    report = {'revision': _git_revision(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'cpus': os.cpu_count(),
+              'jobs': args.jobs,
+              'tools': tools,
+              'results': []}
+    tmp_root = tempfile.mkdtemp(prefix='ffscript-bench-')
+    try:
+        for libs in args.libs:
+            for files in args.files:
+                root = os.path.join(tmp_root, f'{libs:d}l{files:d}f')
+                os.makedirs(root)
+                scenario = Scenario(root, libs, files, args.options, tools)
+                for name, seconds in scenario.run(
+                        args.jobs, args.config_iterations).items():
+                    report['results'].append({'benchmark': name,
+                                              'libs': libs,
+                                              'files': files,
+                                              'seconds': seconds})
+                    print(f'{name:<16s} libs={libs:<4d} files={files:<5d} '
+                          f'{seconds:9.4f}s', file=sys.stderr)
+    except BenchmarkFailed as emsg:
+        logging.error('%s, aborting', emsg)
+        sys.exit(1)
+    finally:
+        if args.keep:
+            print(f'Kept {tmp_root:s}', file=sys.stderr)
+        else:
+            shutil.rmtree(tmp_root, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as out_file:
+            json.dump(report, out_file, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+    if args.compare:
+        with open(args.compare) as old_file:
+            compare(json.load(old_file), report)
+
+if __name__ == '__main__':
+    main()
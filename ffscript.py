@@ -9,43 +9,84 @@ __maintainer__ = "Francesco Magliocco (aka Cmptr)"
 __status__ = "Development"
 
 import argparse
+import json
 import logging
 import os.path
+import signal
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 from utils_ import vlogger
 def _setup_logger(level):
-    hndlr = logging.StreamHandler(sys.stdout)
     fmt = f'%(levelname)s%(module)s%(message)s{vlogger.VColors.NORMAL.value:s}'
-    hndlr.setFormatter(vlogger.VFormatter(fmt))
+    return vlogger.LogPipeline(
+        level,
+        vlogger.VFormatter(fmt, vlogger.use_color(sys.stdout)),
+        sys.stdout)
 
-    logging.basicConfig(level=level, format=fmt, handlers=[hndlr])
-
-_setup_logger(logging.DEBUG
-              if __status__.lower().startswith('dev')
-              else logging.WARNING)
+# Records are written by a thread of their own, see vlogger.LogPipeline.
+#   Anything printed to stdout has to flush() it first.
+_LOG_PIPELINE = _setup_logger(logging.WARNING)
 
 sys.path.append(os.path.join(os.path.dirname(__file__), 'scripts'))
 
 from pathlib import Path
-from scripts import libmp3lame, libx264
-from scripts.repobase import RepoTool
+
+# The modules in scripts/ import each other by these names, importing them
+#   as 'scripts.<name>' too would load a second copy of each.
+import builder
+import compilercache
+import configcache
+import jobserver
+import lockfile
+import planner
+import registry
+import remotecheck
+import repoengine
+import resolver
+import runner
+import scheduler
+import variants
+from repobase import FetchMode, RepoTool
+
+# artifactcache, benchmark, buildhistory, distbuild, mirror, pgo, tarball and
+#   watcher are only imported by the commands using them, as most don't and
+#   importing them all slows every command down.
 
 NA = -1
 UND = NA
 UNKNOWN = 'unknown'
 NOT_DEFINED = 'not defined'
 
-_need_gpl = False
-
-_ALL_REPOS = {
-    'libmp3lame': libmp3lame.LibMP3Lame(),
-    'libx264': libx264.Libx264()
-    }
+# Library modules are only imported once a repo is actually used.
+_ALL_REPOS = registry.LibraryRegistry(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
 
 def list_repos():
+    _LOG_PIPELINE.flush()
     for k in _ALL_REPOS:
-        print(k)
+        lib_meta = _ALL_REPOS.metadata(k)
+        print(f"{k:<12s} {lib_meta.get('description', ''):<16s} "
+              f"{lib_meta.get('license', 'lgpl'):<8s} "
+              f"{', '.join(lib_meta.get('provides', ())):s}")
+
+def resolve_features(features, allow=()):
+    """Returns the resolver.Resolution with the fewest libs providing every
+        one of features, exiting if there is none.
+    """
+    try:
+        resolution = resolver.FeatureResolver(_ALL_REPOS).resolve(features,
+                                                                  allow)
+    except ValueError as emsg:
+        logging.error('%s', emsg)
+        sys.exit(1)
+
+    logging.info('Libs needed: %s', ', '.join(resolution.libs) or 'none')
+    if resolution.switches:
+        logging.info('FFmpeg will be configured with: %s',
+                     ' '.join(resolution.switches))
+
+    return resolution
 
 def is_repo(repo_str):
     repo_str = repo_str.lower()
@@ -55,22 +96,111 @@ def is_repo(repo_str):
 
     return True
 
-def update_repos(repo_prefix, repo_list):
+def _print_repo_results(results):
+    _LOG_PIPELINE.flush()
+    for res in results:
+        print(f"{res.name:<12s} {res.action:<8s} "
+              f"{'ok' if res.success else 'FAILED':<6s} "
+              f"{res.duration:7.1f}s {res.revision or '-':s}")
+
+def _get_mirrors(cache_dir, use_mirrors, timeout=None):
+    if not use_mirrors:
+        return None
+
+    import mirror
+    return mirror.MirrorStore(os.path.join(cache_dir, 'mirrors'), timeout)
+
+def update_repos(repo_prefix, repo_list, max_workers=8, timeout=None,
+                 mirrors=None, history=None, tarballs=None, remote_check=None,
+                 changed_path=None, plan=None, lock=None):
+    """Updates every repo in repo_list concurrently.
+
+        Tarball repos are only downloaded again if they changed, using
+            tarballs (A TarballFetcher).
+
+        If remote_check (A remotecheck.RemoteCheck) is given, repos already
+            at the revision upstream is at aren't updated at all.
+
+        If changed_path is given, the names of the repos that moved to
+            another revision are written to it as a JSON list.
+
+        If plan (A planner.BuildPlan) is given, nothing is updated, what
+            would be is added to it instead.
+
+        If lock (A lockfile.Lockfile) is given, the repos pinned in it are
+            moved to their pinned revision instead.
+
+        Returns a list of repoengine.RepoResult.
+    """
+    repos = []
     for repo_str in repo_list:
         repo_str = repo_str.lower()
         if not is_repo(repo_str):
             continue
 
-        repo = _ALL_REPOS[repo_str]
-        for i in repo.get_update_commands():
-            command_str = f"{i:s} {repo_prefix.rstrip('/'):s}/{repo.name:s}"
-            logging.debug('Running: %s', command_str)
-            os.system(command_str)
+        repos.append(_ALL_REPOS[repo_str])
+
+    pinned = _get_pinned(lock, repos)
+
+    if plan is not None:
+        planned = []
+        for repo in repos:
+            repo_path = os.path.join(repo_prefix, repo.name)
+            if not os.path.isdir(repo_path):
+                planned.append((repo.name, [], 'not downloaded'))
+            elif repo.repo_tool == RepoTool.CURL_TOOL:
+                planned.append((repo.name, [repo.repo_url], 'tarball'))
+            elif repo.name in pinned:
+                planned.append((repo.name,
+                                repo.get_checkout_commands(pinned[repo.name]),
+                                'pinned'))
+            elif (remote_check
+                    and remote_check.is_current(repo, repo_path)):
+                planned.append((repo.name, [], 'up to date'))
+            else:
+                planned.append((repo.name, repo.get_update_commands(), ''))
+
+        plan.add_repos('update', planned, max_workers)
+        return []
 
-        logging.info("Finished updating repository '%s'!", repo.name)
+    engine = repoengine.RepoEngine(repo_prefix,
+                                   max_workers,
+                                   timeout,
+                                   mirrors=mirrors,
+                                   history=history,
+                                   tarballs=tarballs,
+                                   remote_check=remote_check)
+    results = engine.update([r for r in repos if r.name not in pinned])
+    results += engine.checkout([r for r in repos if r.name in pinned],
+                               pinned)
+    _print_repo_results(results)
+    changed = [res.name for res in results if res.changed]
+    logging.info('Changed: %s', ', '.join(changed) or 'nothing')
+    if changed_path:
+        os.makedirs(os.path.dirname(changed_path), exist_ok=True)
+        with open(changed_path, 'w') as changed_file:
+            json.dump(changed, changed_file)
 
+    return results
 
-def download_repos(repo_list, repo_prefix, no_download):
+
+def download_repos(repo_list, repo_prefix, no_download, max_workers=8,
+                   timeout=None, fetch_mode=FetchMode.FULL, mirrors=None,
+                   history=None, tarballs=None, plan=None, lock=None):
+    """Downloads every repo in repo_list concurrently.
+
+        Tarball repos are downloaded with tarballs (A TarballFetcher).
+
+        If lock (A lockfile.Lockfile) is given, the repos pinned in it are
+            checked out at their pinned revision, as worktrees of mirrors if
+            mirrors (A mirror.MirrorStore) is given.
+
+        If plan (A planner.BuildPlan) is given, nothing is downloaded, what
+            would be is added to it instead.
+
+        Returns a list of repoengine.RepoResult.
+    """
+    repos = []
     for repo_str in repo_list:
         repo_str = repo_str.lower()
         if not is_repo(repo_str):
@@ -86,37 +216,522 @@ def download_repos(repo_list, repo_prefix, no_download):
             logging.warning(f'{repo_str!r} is not a complete/usable repo!')
             continue
 
-        command_str = ('{0.repo_tool.value:s} {0.repo_url:s} {1}/{0.name:s}'
-                       .format(repo, repo_prefix))
-
-        logging.debug(f'Running: {command_str:s}')
-        if not no_download:
-            print(f'Downloading repo {repo_str!r}...')
-            os.system(command_str)
-            print(f'Finished download repo {repo_str!r}')
-        else:
+        if no_download:
+            _LOG_PIPELINE.flush()
             print(f'Repo {repo_str!r} was not actually downloaded because '
                   '-no/--no-downloaded was specified.')
+            continue
+
+        repos.append(repo)
+
+    pinned = _get_pinned(lock, repos)
+    if plan is not None:
+        planned = []
+        for repo in repos:
+            dest = os.path.join(repo_prefix, repo.name)
+            if repo.repo_tool == RepoTool.CURL_TOOL:
+                planned.append((repo.name, [repo.repo_url], 'tarball'))
+            elif repo.name in pinned:
+                planned.append((repo.name,
+                                repo.get_pinned_download_commands(
+                                    dest, pinned[repo.name]),
+                                'pinned'))
+            else:
+                planned.append((repo.name,
+                                repo.get_download_commands(dest, fetch_mode),
+                                ''))
+
+        plan.add_repos('download', planned, max_workers)
+        return []
+
+    engine = repoengine.RepoEngine(
+        repo_prefix, max_workers, timeout, fetch_mode, mirrors, history,
+        tarballs)
+    results = engine.download([r for r in repos if r.name not in pinned])
+    results += engine.checkout([r for r in repos if r.name in pinned],
+                               pinned)
+    _print_repo_results(results)
+    return results
+
+def _get_pinned(lock, repos):
+    """Returns {name: revision} of the repos pinned in lock."""
+    if lock is None:
+        return {}
+
+    pinned = {repo.name: lock.revision(repo) for repo in repos}
+    return {name: rev for name, rev in pinned.items() if rev}
+
+def refresh_lock(lock, repo_list, max_workers=8, timeout=None):
+    """Pins every repo in repo_list to the revision upstream is at, and
+        saves lock.
+
+        Returns True if every repo could be pinned.
+    """
+    repos = [_ALL_REPOS[r.lower()] for r in repo_list if is_repo(r)]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        heads = list(pool.map(lambda repo: repo.get_url_head(timeout), repos))
+
+    return _pin_all(lock, repos, heads)
+
+def lock_current(lock, repo_list, repo_prefix):
+    """Pins every repo in repo_list to the revision checked out in
+        repo_prefix, and saves lock.
+
+        Returns True if every repo could be pinned.
+    """
+    repos = [_ALL_REPOS[r.lower()] for r in repo_list if is_repo(r)]
+    return _pin_all(lock, repos,
+                    [repo.get_revision(os.path.join(repo_prefix, repo.name))
+                     for repo in repos])
+
+def _pin_all(lock, repos, revisions):
+    success = True
+    for repo, revision in zip(repos, revisions):
+        if revision is None:
+            logging.error("Couldn't get the revision to pin '%s' to",
+                          repo.name)
+            success = False
+            continue
+
+        old = lock.pin(repo, revision)
+        _LOG_PIPELINE.flush()
+        print(f'{repo.name:<12s} {old or "-":s} -> {revision:s}'
+              if old != revision
+              else f'{repo.name:<12s} {revision:s} (unchanged)')
+
+    lock.save()
+    return success
+
+def _get_tarballs(cache_dir, connections):
+    from tarball import TarballFetcher
+    return TarballFetcher(os.path.join(cache_dir, 'tarballs'), connections)
+
+def _get_artifacts(cache_dir, use_cache, cache_size):
+    if not use_cache:
+        return None
+
+    import artifactcache
+    return artifactcache.ArtifactCache(os.path.join(cache_dir, 'artifacts'),
+                                       cache_size * 1024**2)
+
+def _get_ffmpeg_configs(cache_dir, use_cache):
+    if not use_cache:
+        return None
+
+    import artifactcache
+    return artifactcache.ArtifactCache(os.path.join(cache_dir,
+                                                    'ffmpeg-configure'),
+                                       256 * 1024**2)
+
+def _get_transport(addresses):
+    import distbuild
+    return distbuild.get_transport(addresses)
+
+def _get_build_root(cache_dir, build_dir, in_ram, ram_size):
+    """Returns where libs are built out of tree, None to build them in
+        their checkouts.  With in_ram, that's in RAM if ram_size bytes fit.
+    """
+    if in_ram:
+        ram_str = builder.find_ram_dir(ram_size)
+        if ram_str:
+            return os.path.join(ram_str, f'ffscript-{os.getuid():d}')
+
+        logging.warning('Not enough memory free to build in RAM')
+        return build_dir or os.path.join(cache_dir, 'build')
+
+    return build_dir
+
+def _get_history(cache_dir, use_history):
+    if not use_history:
+        return None
+
+    import buildhistory
+    return buildhistory.BuildHistory(os.path.join(cache_dir, 'history.db'),
+                                     ' '.join(sys.argv[1:]))
 
-def compile_libs(lib_list, repo_prefix, ff_prefix):
-    cd_path = Path.cwd()
-    logging.debug(f'Current directory is {cd_path}.')
+def print_cache_stats(artifacts):
+    stats = artifacts.stats()
+    fmt = '%-10s: %s'
+    _LOG_PIPELINE.flush()
+    print(fmt % ('entries', stats['entries']))
+    print(fmt % ('size', f"{stats['size'] / 1024**2:.1f} MiB of "
+                         f"{stats['max_size'] / 1024**2:.0f} MiB"))
+    print(fmt % ('hits', stats['hits']))
+    print(fmt % ('misses', stats['misses']))
+    print(fmt % ('hit rate', f"{stats['hit_rate']:.1%}"))
+    print(fmt % ('libraries', ', '.join(stats['libraries']) or '-'))
+
+def _get_lib_builder(repo_prefix, ff_prefix, artifacts=None, state_dir=None,
+                     config_cache=None, compiler_cache=None, history=None,
+                     log_dir=None, log_tail=50, make_jobs=None,
+                     job_memory=1 << 30, ffmpeg_configs=None,
+                     build_root=None):
+    """Returns the builder.LibBuilder the arguments, as for compile_libs(),
+        describe.  Unless make_jobs is 0, it's given a started
+        jobserver.JobServer, which has to be closed once done.
+    """
+    lib_builder = builder.LibBuilder(repo_prefix,
+                                     ff_prefix,
+                                     artifacts,
+                                     state_dir,
+                                     config_cache,
+                                     compiler_cache,
+                                     history,
+                                     log_dir,
+                                     log_tail,
+                                     ffmpeg_configs=ffmpeg_configs,
+                                     build_root=build_root)
+    if make_jobs != 0:
+        make_jobs = make_jobs or jobserver.allocate_jobs(None, job_memory)
+        logging.info('Sharing %d make job slots between all builds',
+                     make_jobs)
+        lib_builder.jobserver = jobserver.JobServer(make_jobs,
+                                                    job_memory).start()
+
+    return lib_builder
+
+def _get_variants(lib_list, ff_prefix):
+    """Returns ({name: first variant of lib name}, {variant name: variant})
+        of the libs in lib_list, see compile_libs().
+    """
+    # The first variant of every lib, the one FFmpeg is built with.
+    primaries = {}
+    # Every variant to build, by name.
+    to_build = {}
     for lib_str in lib_list:
-        lib_str = lib_str.lower()
-        if not is_repo(lib_str):
+        name_str, _, options_str = lib_str.lower().partition(':')
+        if not is_repo(name_str):
+            continue
+
+        lib = _ALL_REPOS[name_str]
+        try:
+            options = variants.parse_options(lib, options_str)
+        except ValueError as emsg:
+            logging.error('%s', emsg)
+            continue
+
+        name = variants.variant_name(lib.name, options)
+        if name in to_build:
+            logging.info("'%s' is listed more than once, building it once",
+                         name)
             continue
 
-        lib = _ALL_REPOS[lib_str]
-        logging.debug(f'Configuring {lib.name}')
-        tmp_path = Path(os.path.join(os.path.dirname(__file__),
-                                     repo_prefix,
-                                     lib.name))
+        if name_str in primaries:
+            lib = variants.LibVariant(
+                lib, options, os.path.join(ff_prefix, 'variants', name))
+        elif options:
+            lib = variants.LibVariant(lib, options)
+
+        primaries.setdefault(name_str, lib)
+        to_build[name] = lib
+
+    return primaries, to_build
+
+def compile_libs(lib_list, repo_prefix, ff_prefix, ffmpeg_src=None,
+                 max_parallel=None, artifacts=None, state_dir=None,
+                 config_cache=None, compiler_cache=None, history=None,
+                 log_dir=None, log_tail=50, make_jobs=None,
+                 job_memory=1 << 30, workers=None, ffmpeg_configs=None,
+                 plan=None, build_root=None):
+    """Builds every lib in lib_list, running independent libs concurrently.
+
+        A lib may be given as a variant, e.g. 'libx264:bit-depth=10' (See
+            variants.parse_options()), and as many variants of a lib as
+            wanted may be built.  The first of a lib is installed into
+            ff_prefix, the others into ff_prefix/variants/<variant>.  Variants
+            listed more than once are built once.
+
+        If ffmpeg_src is given, FFmpeg is configured and built from it once
+            all of the libs have been installed into ff_prefix.
+
+        If build_root is given, libs are built out of tree in it (See
+            builder.LibBuilder), so the variants of a lib build at the same
+            time from one checkout.  Otherwise they're built one after the
+            other, in the order listed, as they share the checkout.
+
+        If artifacts (An artifactcache.ArtifactCache) is given, libs that
+            were built before with the same inputs are restored from it.
+
+        If state_dir is given, libs are built incrementally: configure is only
+            rerun when its arguments change, and make only when the sources
+            did.
+
+        If config_cache (A configcache.ConfigCache) is given, autoconf libs
+            share their configure results through it.
+
+        If compiler_cache (A compilercache.CompilerCache) is given, every
+            compiler is wrapped by it and its hit rate is reported per lib.
+
+        If history (A buildhistory.BuildHistory) is given, the resources used
+            by every phase are recorded in it.
+
+        If log_dir is given, the output of every phase is kept in it,
+            compressed.  Only the last log_tail lines are shown when a phase
+            fails.
+
+        Every make shares a pool of make_jobs job slots (0 to not pass -j,
+            None to fit the CPUs, load and memory), and gets fewer of them
+            while less than job_memory bytes per job are available.
+
+        If workers (A distbuild.Transport) is given, the libs are built by
+            the workers it reaches instead, and installed from the archives
+            they send back.  FFmpeg is still built here.
+
+        If ffmpeg_configs (An artifactcache.ArtifactCache) is given, the files
+            FFmpeg's configure generates are kept in it, and restored instead
+            of running configure when nothing it depends on changed.
+
+        If plan (A planner.BuildPlan) is given, nothing is built, what would
+            be, whether it's cached, and the commands run are added to it
+            instead.
+
+        Returns True if everything was built successfully.
+    """
+    lib_builder = _get_lib_builder(repo_prefix,
+                                   ff_prefix,
+                                   artifacts,
+                                   state_dir,
+                                   config_cache,
+                                   compiler_cache,
+                                   history,
+                                   log_dir,
+                                   log_tail,
+                                   0 if plan is not None else make_jobs,
+                                   job_memory,
+                                   ffmpeg_configs,
+                                   build_root)
+
+    remote_build = None
+    if workers is not None:
+        import distbuild
+        remote_build = distbuild.RemoteBuilder(lib_builder, workers,
+                                               _ALL_REPOS).build
+
+    primaries, to_build = _get_variants(lib_list, ff_prefix)
+    libs = list(primaries.values())
+    build_graph = scheduler.BuildScheduler(max_parallel)
+    plans = {}
+    # The variant last added of every checkout, see the docstring.
+    last_variant = {}
+    for lib in to_build.values():
+        logging.debug('%-10s: %s', lib.name, lib.depends)
+        build_lib = lib_builder.build
+        if remote_build and not lib.variant:
+            build_lib = remote_build
+        elif remote_build:
+            logging.warning("Variants can't be built by workers, building "
+                            "'%s' here", lib.name)
+
+        depends = [primaries[d].name if d in primaries else d
+                   for d in lib.depends]
+        if build_root is None and lib.source_name in last_variant:
+            depends.append(last_variant[lib.source_name])
 
-        command_str = lib.get_config(prefix=ff_prefix)
-        logging.debug(command_str)
-        os.system(f'./{command_str:s}')
-        os.chdir(cd_path)
+        last_variant[lib.source_name] = lib.name
+        build_graph.add(lib.name,
+                        lambda lib=lib, build_lib=build_lib: build_lib(lib),
+                        depends)
+        if plan is not None:
+            plans[lib.name] = lib_builder.plan(lib)
 
+    if ffmpeg_src is not None:
+        build_graph.add('ffmpeg',
+                        lambda: lib_builder.build_ffmpeg(ffmpeg_src, libs),
+                        [lib.name for lib in libs])
+        if plan is not None:
+            plans['ffmpeg'] = lib_builder.plan_ffmpeg(ffmpeg_src, libs)
+
+    if plan is not None:
+        plan.add_builds(build_graph, plans)
+        return True
+
+    try:
+        results = build_graph.run()
+    finally:
+        if lib_builder.jobserver:
+            lib_builder.jobserver.close()
+
+    _LOG_PIPELINE.flush()
+    build_graph.report()
+    lib_builder.report()
+    return all(res.success for res in results.values())
+
+def pgo_build(lib_list, repo_prefix, ff_prefix, ffmpeg_src, work_dir,
+              workload_path=None, clip_size='1280x720',
+              clip_seconds=3, repeat=3, state_dir=None, config_cache=None,
+              compiler_cache=None, history=None, log_dir=None, log_tail=50,
+              make_jobs=None, job_memory=1 << 30, ffmpeg_configs=None,
+              build_root=None):
+    """Rebuilds the libs in lib_list that can be, and FFmpeg from
+        ffmpeg_src, with profile guided optimization, after compile_libs()
+        built them as usual (See pgo.PgoBuild).  Prints how much faster the
+        workload got.
+
+        The workload is read from workload_path (See pgo.read_workload()),
+            pgo.DEFAULT_WORKLOAD if not given.
+
+        The profiles, and the ffmpeg they are compared against, are kept in
+            work_dir.  The artifact cache is never used, as it couldn't tell
+            the profiles apart.  The other arguments are as for
+            compile_libs().
+
+        Returns True if everything was built successfully.
+    """
+    import pgo
+    workload = pgo.DEFAULT_WORKLOAD
+    if workload_path is not None:
+        workload = pgo.read_workload(workload_path)
+
+    lib_builder = _get_lib_builder(repo_prefix,
+                                   ff_prefix,
+                                   None,
+                                   state_dir,
+                                   config_cache,
+                                   compiler_cache,
+                                   history,
+                                   log_dir,
+                                   log_tail,
+                                   make_jobs,
+                                   job_memory,
+                                   ffmpeg_configs,
+                                   build_root)
+
+    primaries, _ = _get_variants(lib_list, ff_prefix)
+    try:
+        speedups = pgo.PgoBuild(lib_builder,
+                                primaries.values(),
+                                ffmpeg_src,
+                                work_dir,
+                                workload,
+                                clip_size,
+                                clip_seconds,
+                                repeat).run()
+    finally:
+        if lib_builder.jobserver:
+            lib_builder.jobserver.close()
+
+    if speedups is None:
+        return False
+
+    _LOG_PIPELINE.flush()
+    pgo.PgoBuild.print(speedups)
+    return True
+
+def benchmark_build(ff_prefix, work_dir, db_path,
+                    presets=('ultrafast', 'medium', 'slow'),
+                    bit_depths=(8, 10), clip_size='1280x720',
+                    clip_seconds=5, repeat=3, threshold=0.05):
+    """Benchmarks the ffmpeg installed in ff_prefix (See
+        benchmark.EncodeBenchmark), records the results in the
+        benchmark.BenchmarkStore at db_path along with the revision and
+        configure command of FFmpeg and every lib it was built with, as
+        recorded when they were installed (See builder.read_provenance()),
+        and prints them.
+
+        The inputs are kept in work_dir.
+
+        Returns False if a case failed, or got more than threshold slower
+            than it usually is.
+    """
+    import benchmark
+    bench = benchmark.EncodeBenchmark(os.path.join(ff_prefix, 'bin', 'ffmpeg'),
+                                      work_dir,
+                                      presets,
+                                      bit_depths,
+                                      clip_size,
+                                      clip_seconds,
+                                      repeat)
+    info = bench.build_info()
+    if info is None:
+        return False
+
+    version_str, configure_str = info
+    provenance = builder.read_provenance(ff_prefix)
+    if 'ffmpeg' not in provenance:
+        logging.warning("There's no record of how '%s' was built, only its "
+                        'version and configuration are kept', ff_prefix)
+        provenance['ffmpeg'] = {'revision': None,
+                                'configure': f'./configure {configure_str:s}'}
+
+    names = ['ffmpeg', *provenance['ffmpeg'].get('libs', ())]
+    revisions = {n: provenance[n]['revision']
+                 for n in names if n in provenance}
+    configure = {n: provenance[n]['configure']
+                 for n in names if n in provenance}
+
+    results = bench.run()
+    store = benchmark.BenchmarkStore(db_path)
+    build_id = store.add_build(version_str, revisions, configure)
+    for res in results:
+        store.record(build_id, res)
+
+    _LOG_PIPELINE.flush()
+    regressions = store.report(build_id, threshold=threshold)
+    return not regressions and all(res.success for res in results)
+
+def watch_libs(lib_list, repo_prefix, ff_prefix, socket_path,
+               ffmpeg_src=None, max_parallel=None, state_dir=None,
+               config_cache=None, compiler_cache=None, history=None,
+               log_dir=None, log_tail=50, make_jobs=None, job_memory=1 << 30,
+               ffmpeg_configs=None, debounce=1.0, poll=False):
+    """Rebuilds the libs in lib_list as their sources change, along with
+        the libs depending on them, then relinks FFmpeg from ffmpeg_src (if
+        given), until interrupted.
+
+        The status is served on the Unix socket socket_path (See
+            --watch-status).  Builds are always incremental, with their state
+            kept in state_dir.  The other arguments are as for compile_libs().
+    """
+    lib_builder = _get_lib_builder(repo_prefix,
+                                   ff_prefix,
+                                   None,
+                                   state_dir,
+                                   config_cache,
+                                   compiler_cache,
+                                   history,
+                                   log_dir,
+                                   log_tail,
+                                   make_jobs,
+                                   job_memory,
+                                   ffmpeg_configs)
+
+    import watcher
+    libs = [_ALL_REPOS[lib_str.lower()]
+            for lib_str in dict.fromkeys(lib_list)
+            if is_repo(lib_str.lower())]
+    daemon = watcher.WatchDaemon(lib_builder,
+                                 libs,
+                                 socket_path,
+                                 ffmpeg_src,
+                                 watcher.get_watcher(poll),
+                                 debounce,
+                                 max_parallel)
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        logging.info('Stopped watching')
+    finally:
+        if lib_builder.jobserver:
+            lib_builder.jobserver.close()
+
+def serve_builds(transport, repo_prefix, log_dir=None, log_tail=50,
+                 tarballs=None):
+    """Builds libs for a coordinator (See compile_libs()) reaching us
+        through transport, until interrupted.
+
+        Sources are downloaded to, and kept in, repo_prefix.  Tarball repos
+            are fetched with tarballs (A TarballFetcher).
+    """
+    lib_builder = builder.LibBuilder(repo_prefix,
+                                     None,
+                                     log_dir=log_dir,
+                                     log_tail=log_tail)
+    import distbuild
+    worker = distbuild.BuildWorker(lib_builder, _ALL_REPOS, tarballs)
+    try:
+        worker.serve(transport)
+    except KeyboardInterrupt:
+        logging.info('Worker stopped')
 
 def file_exists(file_str, path_str='.'):
     file_str = file_str.strip('/')
@@ -141,15 +756,25 @@ def _to_abspath(path_str):
 
     return path_str
 
+def _on_interrupt(signum, frame):
+    # What we run is in sessions of its own, so Ctrl-C doesn't reach it.
+    runner.kill_all()
+    raise KeyboardInterrupt
+
 def main(parser):
+    signal.signal(signal.SIGINT, _on_interrupt)
     args = parser.parse_args()
     fmt = '%-12s: %s'
 
     # We check for this argument first, that way if verbose level is changed
     #   to "DEBUG", we can see those verbose messages.
     if args.verbose_level != parser.get_default('verbose_level'):
+        _LOG_PIPELINE.set_level(args.verbose_level)
         logging.debug(fmt, 'verbose', args.verbose_level)
-        logging.getLogger().setLevel(args.verbose_level)
+
+    if args.log_json:
+        logging.debug(fmt, 'log_json', args.log_json)
+        _LOG_PIPELINE.add_json_sink(_to_abspath(args.log_json))
 
     try:
         if (args.prefix != parser.get_default('prefix')
@@ -162,16 +787,136 @@ def main(parser):
             logging.debug(fmt, 'repo_prefix', args.verbose_level)
             args.repo_prefix = _to_abspath(args.repo_prefix)
 
+        if (args.cache_dir != parser.get_default('cache_dir')
+                or not os.path.isabs(args.cache_dir)):
+            logging.debug(fmt, 'cache_dir', args.cache_dir)
+            args.cache_dir = _to_abspath(args.cache_dir)
+
+        history = _get_history(args.cache_dir, args.history)
+        plan = None
+        if args.plan:
+            plan = planner.BuildPlan(history
+                                     or _get_history(args.cache_dir, True))
+
+        if args.features:
+            resolution = resolve_features(
+                [f for feat in args.features for f in feat.split(',')
+                 if f.strip()],
+                args.allow_license)
+            args.download = (args.download or []) + [
+                n for n in resolution.libs
+                if not os.path.isdir(os.path.join(args.repo_prefix, n))]
+            args.compile_lib = (args.compile_lib or []) + list(
+                resolution.libs)
+
+        lock = None
+        if args.lockfile:
+            try:
+                lock = lockfile.Lockfile(_to_abspath(args.lockfile))
+            except (OSError, ValueError, TypeError, KeyError) as emsg:
+                logging.error("Couldn't read the lockfile: %s", emsg)
+                sys.exit(1)
+        elif args.lock_refresh is not None or args.lock_current is not None:
+            parser.error('--lock-refresh and --lock-current need --lockfile')
+
+        if args.lock_refresh is not None:
+            if not refresh_lock(lock,
+                                (args.lock_refresh
+                                 or list(lock.entries)
+                                 or [k for k in _ALL_REPOS
+                                     if os.path.isdir(os.path.join(
+                                         args.repo_prefix, k))]),
+                                args.vcs_jobs,
+                                args.vcs_timeout):
+                sys.exit(1)
+
+        if args.lock_current is not None:
+            if not lock_current(lock,
+                                (args.lock_current
+                                 or [k for k in _ALL_REPOS
+                                     if os.path.isdir(os.path.join(
+                                         args.repo_prefix, k))]),
+                                args.repo_prefix):
+                sys.exit(1)
+
         if args.update_repo != parser.get_default('update_repo'):
             logging.debug(fmt, 'update_repo', args.update_repo)
-            update_repos(args.repo_prefix, (_ALL_REPOS
-                                            if not args.update_repo
-                                            else args.update_repo))
+            update_repos(args.repo_prefix,
+                         (args.update_repo
+                          or [k for k in _ALL_REPOS
+                              if os.path.isdir(os.path.join(args.repo_prefix,
+                                                            k))]),
+                         args.vcs_jobs,
+                         args.vcs_timeout,
+                         _get_mirrors(args.cache_dir,
+                                      args.use_mirrors or lock is not None,
+                                      args.vcs_timeout),
+                         history,
+                         _get_tarballs(args.cache_dir,
+                                       args.tarball_connections),
+                         (remotecheck.RemoteCheck(
+                             os.path.join(args.cache_dir, 'remote-heads.json'),
+                             args.remote_check_ttl,
+                             args.vcs_timeout)
+                          if args.remote_check
+                          else None),
+                         (_to_abspath(args.changed_list)
+                          if args.changed_list
+                          else os.path.join(args.cache_dir,
+                                            'changed.json')),
+                         plan,
+                         lock)
+
+        if args.watch_status:
+            import watcher
+            try:
+                _LOG_PIPELINE.flush()
+                print(json.dumps(watcher.query(args.watch_socket
+                                               or os.path.join(args.cache_dir,
+                                                               'watch.sock')),
+                                 indent=1))
+            except OSError as emsg:
+                logging.error("Couldn't reach the watch daemon: %s", emsg)
+                sys.exit(1)
+
+            return
+
+        if args.serve:
+            serve_builds(_get_transport([args.serve]),
+                         args.repo_prefix,
+                         (_to_abspath(args.log_dir)
+                          if args.log_dir
+                          else os.path.join(args.cache_dir, 'logs')),
+                         args.log_tail,
+                         _get_tarballs(args.cache_dir,
+                                       args.tarball_connections))
+            return
 
         if args.list:
             list_repos()
 
-        # TODO: Do something with this...
+        if args.cache_stats:
+            print_cache_stats(_get_artifacts(args.cache_dir,
+                                             True,
+                                             args.cache_size))
+
+        if args.download:
+            logging.debug(fmt, 'download', args.download)
+            download_repos(args.download,
+                           args.repo_prefix,
+                           args.no_download,
+                           args.vcs_jobs,
+                           args.vcs_timeout,
+                           FetchMode(args.fetch_mode),
+                           _get_mirrors(args.cache_dir,
+                                        args.use_mirrors or lock is not None,
+                                        args.vcs_timeout),
+                           history,
+                           _get_tarballs(args.cache_dir,
+                                         args.tarball_connections),
+                           plan,
+                           lock)
+
         default_src = parser.get_default('ffmpeg_src')
         src_is_default = (args.ffmpeg_src == default_src)
         if (not src_is_default and not args.compile):
@@ -189,12 +934,133 @@ def main(parser):
                     args.ffmpeg_src)
                 sys.exit(1)
 
-        if args.compile_lib:
-            compile_libs(args.compile_lib, args.repo_prefix, args.prefix)
+        if args.pgo and not args.compile:
+            parser.error('--pgo needs --compile')
 
-        if args.download:
-            logging.debug(fmt, 'download', args.download)
-            download_repos(args.download, args.repo_prefix, args.no_download)
+        if args.compile_lib or args.compile:
+            state_dir = (os.path.join(args.cache_dir, 'incremental')
+                         if args.incremental
+                         else None)
+            config_cache = (configcache.ConfigCache(
+                                os.path.join(args.cache_dir, 'autoconf'))
+                            if args.config_cache
+                            else None)
+            compiler_cache = compilercache.CompilerCache.detect(
+                args.compiler_cache,
+                os.path.join(args.cache_dir, args.compiler_cache),
+                args.compiler_cache_size)
+            log_dir = (_to_abspath(args.log_dir)
+                       if args.log_dir
+                       else os.path.join(args.cache_dir, 'logs'))
+            ffmpeg_configs = _get_ffmpeg_configs(args.cache_dir,
+                                                 args.ffmpeg_config_cache)
+            build_root = _get_build_root(args.cache_dir,
+                                         (_to_abspath(args.build_dir)
+                                          if args.build_dir
+                                          else None),
+                                         args.build_in_ram,
+                                         args.ram_build_size << 20)
+            if not compile_libs(args.compile_lib or [],
+                                args.repo_prefix,
+                                args.prefix,
+                                args.ffmpeg_src if args.compile else None,
+                                args.max_parallel,
+                                _get_artifacts(args.cache_dir,
+                                               args.artifact_cache,
+                                               args.cache_size),
+                                state_dir,
+                                config_cache,
+                                compiler_cache,
+                                history,
+                                log_dir,
+                                args.log_tail,
+                                args.make_jobs,
+                                args.job_memory << 20,
+                                (_get_transport(args.workers)
+                                 if args.workers
+                                 else None),
+                                ffmpeg_configs,
+                                plan,
+                                build_root):
+                sys.exit(1)
+
+            if args.pgo and plan is None:
+                if not pgo_build(args.compile_lib or [],
+                                 args.repo_prefix,
+                                 args.prefix,
+                                 args.ffmpeg_src,
+                                 os.path.join(args.cache_dir, 'pgo'),
+                                 (_to_abspath(args.pgo_workload)
+                                  if args.pgo_workload
+                                  else None),
+                                 args.pgo_clip_size,
+                                 args.pgo_clip_seconds,
+                                 args.pgo_repeat,
+                                 state_dir,
+                                 config_cache,
+                                 compiler_cache,
+                                 history,
+                                 log_dir,
+                                 args.log_tail,
+                                 args.make_jobs,
+                                 args.job_memory << 20,
+                                 ffmpeg_configs,
+                                 build_root):
+                    sys.exit(1)
+
+        if plan is not None:
+            _LOG_PIPELINE.flush()
+            plan.print()
+            return
+
+        if args.benchmark:
+            if not benchmark_build(args.prefix,
+                                   os.path.join(args.cache_dir, 'benchmark'),
+                                   os.path.join(args.cache_dir,
+                                                'benchmarks.db'),
+                                   args.bench_presets,
+                                   args.bench_bit_depths,
+                                   args.bench_clip_size,
+                                   args.bench_clip_seconds,
+                                   args.bench_repeat,
+                                   args.bench_threshold / 100):
+                sys.exit(1)
+
+        if args.watch:
+            watch_libs(args.compile_lib or [],
+                       args.repo_prefix,
+                       args.prefix,
+                       (_to_abspath(args.watch_socket)
+                        if args.watch_socket
+                        else os.path.join(args.cache_dir, 'watch.sock')),
+                       args.ffmpeg_src if args.compile else None,
+                       args.max_parallel,
+                       os.path.join(args.cache_dir, 'incremental'),
+                       (configcache.ConfigCache(
+                           os.path.join(args.cache_dir, 'autoconf'))
+                        if args.config_cache
+                        else None),
+                       compilercache.CompilerCache.detect(
+                           args.compiler_cache,
+                           os.path.join(args.cache_dir, args.compiler_cache),
+                           args.compiler_cache_size),
+                       history,
+                       (_to_abspath(args.log_dir)
+                        if args.log_dir
+                        else os.path.join(args.cache_dir, 'logs')),
+                       args.log_tail,
+                       args.make_jobs,
+                       args.job_memory << 20,
+                       _get_ffmpeg_configs(args.cache_dir,
+                                           args.ffmpeg_config_cache),
+                       args.watch_debounce,
+                       args.watch_poll)
+
+        if args.report is not None:
+            history = history or _get_history(args.cache_dir, True)
+            _LOG_PIPELINE.flush()
+            history.report(args.report or None,
+                           threshold=args.regression_threshold / 100)
 
     except NotImplementedError as emsg:
         logging.error(f'{emsg!r} has not yet been implemented')
@@ -217,6 +1083,13 @@ def _setup_parser():
                         metavar='rprfx',
                         dest='repo_prefix')
 
+    parser.add_argument('--cache-dir',
+                        default=os.path.abspath('./ffcache'),
+                        help=('Location for mirrors, caches and other state '
+                              'kept between runs.'),
+                        metavar='dir',
+                        dest='cache_dir')
+
     parser.add_argument('-l',
                         '--list',
                         action='store_true',
@@ -247,17 +1120,417 @@ def _setup_parser():
                         metavar='repos',
                         dest='update_repo')
 
+    parser.add_argument('--fetch-mode',
+                        default=FetchMode.FULL.value,
+                        choices=[mode.value for mode in FetchMode],
+                        help=("How much of a repo to download.  Anything "
+                              "other than 'full' is meant for build-only "
+                              "checkouts."),
+                        dest='fetch_mode')
+
+    parser.add_argument('--use-mirrors',
+                        action='store_true',
+                        help=('Keep a local mirror of every repo in the '
+                              'cache directory and download from it.'),
+                        dest='use_mirrors')
+
+    parser.add_argument('--lockfile',
+                        help=('JSON file pinning libs to revisions.  Pinned '
+                              'libs are downloaded and updated to their '
+                              'pinned revision, as worktrees of local '
+                              'mirrors, instead of to the latest one.'),
+                        metavar='file',
+                        dest='lockfile')
+
+    parser.add_argument('--lock-refresh',
+                        nargs='*',
+                        help=('Pin libs (Those in --lockfile, or checked '
+                              'out, if none are given) to the revision '
+                              'upstream is at.'),
+                        metavar='lib',
+                        dest='lock_refresh')
+
+    parser.add_argument('--lock-current',
+                        nargs='*',
+                        help=('Pin libs (Every one checked out if none are '
+                              'given) to the revision checked out.'),
+                        metavar='lib',
+                        dest='lock_current')
+
+    parser.add_argument('--vcs-jobs',
+                        type=int,
+                        default=8,
+                        help=('Maximum number of repositories to download or '
+                              'update at the same time.'),
+                        metavar='n',
+                        dest='vcs_jobs')
+
+    parser.add_argument('--vcs-timeout',
+                        type=float,
+                        help=('Seconds before a download or update of a '
+                              'single repository is given up on.'),
+                        metavar='secs',
+                        dest='vcs_timeout')
+
+    parser.add_argument('--no-remote-check',
+                        action='store_false',
+                        help=("Always update repos, instead of first asking "
+                              'upstream whether they moved.'),
+                        dest='remote_check')
+
+    parser.add_argument('--remote-check-ttl',
+                        type=float,
+                        default=300,
+                        help=('Seconds the revision upstream is at is '
+                              'trusted for before asking again.'),
+                        metavar='secs',
+                        dest='remote_check_ttl')
+
+    parser.add_argument('--changed-list',
+                        help=('JSON file the names of the repos an update '
+                              "moved are written to.  Defaults to "
+                              "'changed.json' in the cache directory."),
+                        metavar='file',
+                        dest='changed_list')
+
+    parser.add_argument('--tarball-connections',
+                        type=int,
+                        default=4,
+                        help=('Connections each release tarball is '
+                              'downloaded over at once.'),
+                        metavar='n',
+                        dest='tarball_connections')
+
     parser.add_argument('--compile',
                         action='store_true',
                         default=False,
                         help='Perform compilation?',
                         dest='compile')
 
+    parser.add_argument('--features',
+                        nargs='+',
+                        help=("FFmpeg features wanted, e.g. 'h264-encode' or "
+                              "'mp3 encode'.  Only the libs needed for them "
+                              'are downloaded and built.  See --list for '
+                              'what each lib provides.'),
+                        metavar='feature',
+                        dest='features')
+
+    parser.add_argument('--allow-license',
+                        nargs='+',
+                        default=[],
+                        choices=['gpl', 'version3', 'nonfree'],
+                        help=('Licenses FFmpeg may be switched to by the '
+                              'libs --features picks.'),
+                        metavar='license',
+                        dest='allow_license')
+
+    parser.add_argument('--plan',
+                        action='store_true',
+                        help=('Shows what would be updated, downloaded and '
+                              'built, the commands that would be run, what '
+                              'is cached, and how long it would take going by '
+                              'the build history, without doing any of it.'),
+                        dest='plan')
+
     parser.add_argument('--compile-lib',
                         nargs='+',
-                        help='Compile specified libs',
+                        help=('Compile specified libs.  A variant of a lib '
+                              'is given with its options, e.g. '
+                              "'libx264:bit-depth=10,chroma-format=420'."),
                         dest='compile_lib')
 
+    parser.add_argument('-j',
+                        '--max-parallel',
+                        type=int,
+                        default=os.cpu_count() or 1,
+                        help=('Maximum number of libraries to build at the '
+                              'same time.'),
+                        metavar='n',
+                        dest='max_parallel')
+
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        help=('Reuse existing build trees.  configure is '
+                              'skipped when its arguments are unchanged and '
+                              "make's dependency tracking rebuilds the rest."),
+                        dest='incremental')
+
+    parser.add_argument('--no-config-cache',
+                        action='store_false',
+                        help=("Don't share configure results between "
+                              'autoconf libs.'),
+                        dest='config_cache')
+
+    parser.add_argument('--compiler-cache',
+                        default='auto',
+                        choices=['auto', 'ccache', 'sccache', 'none'],
+                        help=("Compiler cache to wrap every compiler with.  "
+                              "'auto' uses whichever is installed."),
+                        dest='compiler_cache')
+
+    parser.add_argument('--compiler-cache-size',
+                        default='5G',
+                        help='Size limit of the compiler cache.',
+                        metavar='size',
+                        dest='compiler_cache_size')
+
+    parser.add_argument('--no-ffmpeg-config-cache',
+                        action='store_false',
+                        help=("Always run FFmpeg's configure, instead of "
+                              'restoring what it generated the last time it '
+                              'ran with the same libs and compiler.'),
+                        dest='ffmpeg_config_cache')
+
+    parser.add_argument('--no-artifact-cache',
+                        action='store_false',
+                        help=("Always build libs, even if they were built "
+                              "before with the same revision, configure "
+                              "command and compiler."),
+                        dest='artifact_cache')
+
+    parser.add_argument('--cache-size',
+                        type=int,
+                        default=2048,
+                        help=('Size in MiB the artifact cache is kept under '
+                              'by evicting the least recently used builds.'),
+                        metavar='mib',
+                        dest='cache_size')
+
+    parser.add_argument('--cache-stats',
+                        action='store_true',
+                        help='Shows artifact cache statistics.',
+                        dest='cache_stats')
+
+    parser.add_argument('--no-history',
+                        action='store_false',
+                        help=("Don't record the time and resources used by "
+                              'each phase in the build history.'),
+                        dest='history')
+
+    parser.add_argument('--report',
+                        nargs='?',
+                        type=int,
+                        const=0,
+                        help=('Compares the phases of a run (The latest if '
+                              'not given) with the runs before it.'),
+                        metavar='run',
+                        dest='report')
+
+    parser.add_argument('--regression-threshold',
+                        type=float,
+                        default=20.0,
+                        help=('Percentage a phase has to be slower than '
+                              'usual to be reported as a regression.'),
+                        metavar='pct',
+                        dest='regression_threshold')
+
+    parser.add_argument('--make-jobs',
+                        type=int,
+                        help=('Job slots shared by every make, including '
+                              'those building at the same time.  Defaults to '
+                              'what the idle CPUs and available memory allow, '
+                              "0 doesn't pass -j at all."),
+                        metavar='n',
+                        dest='make_jobs')
+
+    parser.add_argument('--job-memory',
+                        type=int,
+                        default=1024,
+                        help=('MiB of memory a single compile job is '
+                              'expected to need.  Fewer job slots are handed '
+                              'out while less is available.'),
+                        metavar='mib',
+                        dest='job_memory')
+
+    parser.add_argument('--workers',
+                        nargs='+',
+                        help=('Build libs on workers started with --serve '
+                              'instead of here: host:port or Unix socket path '
+                              "of each, or 'dir:<path>' for every worker "
+                              'sharing that directory.'),
+                        metavar='addr',
+                        dest='workers')
+
+    parser.add_argument('--serve',
+                        help=('Run as a worker building libs for a '
+                              'coordinator started with --workers.  Listens '
+                              "on host:port or a Unix socket path, or takes "
+                              "jobs from 'dir:<path>'."),
+                        metavar='addr',
+                        dest='serve')
+
+    parser.add_argument('--build-dir',
+                        help=('Build libs out of tree in this directory '
+                              'instead of in their checkouts, so variants of '
+                              "a lib (e.g. 'libx264:bit-depth=10' given to "
+                              '--compile-lib) build at the same time.'),
+                        metavar='dir',
+                        dest='build_dir')
+
+    parser.add_argument('--build-in-ram',
+                        action='store_true',
+                        help=('Build libs out of tree in RAM (e.g. '
+                              '/dev/shm) when there is enough memory, in '
+                              '--build-dir otherwise.'),
+                        dest='build_in_ram')
+
+    parser.add_argument('--ram-build-size',
+                        default=2048,
+                        type=int,
+                        help=('MiB that must be free, in RAM and in the RAM '
+                              'backed directory, to build in RAM.'),
+                        metavar='MiB',
+                        dest='ram_build_size')
+
+    parser.add_argument('--watch',
+                        action='store_true',
+                        help=('After building, keep watching the sources of '
+                              'the --compile-lib libs (and FFmpeg with '
+                              '--compile), rebuilding what changed and the '
+                              'libs depending on it, then relinking FFmpeg.'),
+                        dest='watch')
+
+    parser.add_argument('--watch-socket',
+                        help=('Unix socket the --watch daemon serves its '
+                              "status on.  Defaults to 'watch.sock' in the "
+                              'cache directory.'),
+                        metavar='path',
+                        dest='watch_socket')
+
+    parser.add_argument('--watch-status',
+                        action='store_true',
+                        help='Shows the status of a running --watch daemon.',
+                        dest='watch_status')
+
+    parser.add_argument('--watch-debounce',
+                        default=1.0,
+                        type=float,
+                        help=('Seconds without changes before --watch '
+                              'rebuilds.'),
+                        metavar='secs',
+                        dest='watch_debounce')
+
+    parser.add_argument('--watch-poll',
+                        action='store_true',
+                        help=('Poll for changes instead of using inotify.  '
+                              'Needed on some network filesystems.'),
+                        dest='watch_poll')
+
+    parser.add_argument('--pgo',
+                        action='store_true',
+                        help=('After building, rebuild libx264 and FFmpeg '
+                              'with profile guided optimization, trained on '
+                              'the --pgo-workload, and show how much faster '
+                              'it got.  Needs --compile, and gcc or clang.'),
+                        dest='pgo')
+
+    parser.add_argument('--pgo-workload',
+                        help=('File of FFmpeg commands, without the ffmpeg, '
+                              'one per line, to train and time the PGO build '
+                              'with.  {clip} is the generated test clip.  '
+                              'Defaults to libx264 encodes at the ultrafast, '
+                              'medium and slow presets.'),
+                        metavar='file',
+                        dest='pgo_workload')
+
+    parser.add_argument('--pgo-clip-size',
+                        default='1280x720',
+                        help='Frame size of the PGO test clip.',
+                        metavar='WxH',
+                        dest='pgo_clip_size')
+
+    parser.add_argument('--pgo-clip-seconds',
+                        default=3,
+                        type=int,
+                        help='Length of the PGO test clip.',
+                        metavar='s',
+                        dest='pgo_clip_seconds')
+
+    parser.add_argument('--pgo-repeat',
+                        default=3,
+                        type=int,
+                        help=('Times every workload command is timed, the '
+                              'fastest counts.'),
+                        metavar='n',
+                        dest='pgo_repeat')
+
+    parser.add_argument('--benchmark',
+                        action='store_true',
+                        help=('After building, time libx264 and libmp3lame '
+                              'encodes with the ffmpeg in --prefix, keep the '
+                              'fps, CPU time and peak memory with the lib '
+                              'revisions and configure commands, and fail if '
+                              'any got slower than --bench-threshold.'),
+                        dest='benchmark')
+
+    parser.add_argument('--bench-presets',
+                        nargs='+',
+                        default=['ultrafast', 'medium', 'slow'],
+                        help='libx264 presets to benchmark.',
+                        metavar='preset',
+                        dest='bench_presets')
+
+    parser.add_argument('--bench-bit-depths',
+                        nargs='+',
+                        type=int,
+                        choices=(8, 10),
+                        default=[8, 10],
+                        help='libx264 bit depths to benchmark.',
+                        metavar='bits',
+                        dest='bench_bit_depths')
+
+    parser.add_argument('--bench-clip-size',
+                        default='1280x720',
+                        help='Frame size of the benchmark video.',
+                        metavar='WxH',
+                        dest='bench_clip_size')
+
+    parser.add_argument('--bench-clip-seconds',
+                        default=5,
+                        type=int,
+                        help='Length of the benchmark video.',
+                        metavar='s',
+                        dest='bench_clip_seconds')
+
+    parser.add_argument('--bench-repeat',
+                        default=3,
+                        type=int,
+                        help=('Times every benchmark is run, the fastest '
+                              'counts.'),
+                        metavar='n',
+                        dest='bench_repeat')
+
+    parser.add_argument('--bench-threshold',
+                        type=float,
+                        default=5.0,
+                        help=('Percentage a benchmark has to be slower than '
+                              'the median of the previous 5 to fail the '
+                              'run.'),
+                        metavar='pct',
+                        dest='bench_threshold')
+
+    parser.add_argument('--log-dir',
+                        help=('Where the compressed output of every build '
+                              "phase is kept.  Defaults to 'logs' in the "
+                              'cache directory.'),
+                        metavar='dir',
+                        dest='log_dir')
+
+    parser.add_argument('--log-json',
+                        help=('Also append everything logged to this file, '
+                              'one JSON object per line, with the lib and '
+                              'phase it was logged for.'),
+                        metavar='file',
+                        dest='log_json')
+
+    parser.add_argument('--log-tail',
+                        type=int,
+                        default=50,
+                        help='Lines of output shown when a build phase fails.',
+                        metavar='n',
+                        dest='log_tail')
+
     parser.add_argument('-v',
                         '--verbose',
                         default=(logging.getLevelName(logging.getLogger()
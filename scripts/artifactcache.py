@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""Content Addressed Build Artifact Cache"""
+
+import hashlib
+import json
+import logging
+import os
+import tarfile
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from tarball import extract_all
+
+class ArtifactCache:
+    """Stores the files a library installs, keyed on everything that went
+        into building them.
+
+        Every entry is a tar.gz of the installed files, relative to the
+            prefix they were installed into.  An index of the entries is kept
+            in 'index.json' and used to evict the least recently used entries
+            once the cache grows over max_bytes.
+    """
+
+    _INDEX = 'index.json'
+
+    def __init__(self, root, max_bytes=2 * 1024**3):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(**parts):
+        """Returns the hex digest identifying parts.
+
+            parts must be JSON serializable, e.g. the revision, configure
+                command, compiler identity and environment flags of a build.
+        """
+        blob = json.dumps(parts, sort_keys=True)
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def _entry_path(self, key):
+        return self.root / 'objects' / key[:2] / f'{key:s}.tar.gz'
+
+    def _load_index(self):
+        try:
+            with open(self.root / self._INDEX) as index_file:
+                return json.load(index_file)
+        except FileNotFoundError:
+            return {'entries': {}, 'hits': 0, 'misses': 0}
+        except ValueError:
+            logging.warning("Artifact cache index is corrupt, starting over")
+            return {'entries': {}, 'hits': 0, 'misses': 0}
+
+    def _save_index(self, index):
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_str = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        with os.fdopen(fd, 'w') as index_file:
+            json.dump(index, index_file, indent=1)
+
+        os.replace(tmp_str, self.root / self._INDEX)
+
+    def restore(self, key, prefix):
+        """Extracts the entry for key into prefix.
+
+            Returns True on a hit, False if there is no usable entry.
+        """
+        with self._lock:
+            index = self._load_index()
+            entry = index['entries'].get(key)
+            path = self._entry_path(key)
+            if entry is None or not path.is_file():
+                index['entries'].pop(key, None)
+                index['misses'] += 1
+                self._save_index(index)
+                return False
+
+            entry['atime'] = time.time()
+            index['hits'] += 1
+            self._save_index(index)
+
+        logging.info("Restoring '%s' from the artifact cache", entry['name'])
+        with tarfile.open(path) as tar:
+            extract_all(tar, prefix)
+
+        return True
+
+    def contains(self, key):
+        """Returns True if there is an entry for key, without counting it as
+            a hit or a miss.
+        """
+        with self._lock:
+            return (key in self._load_index()['entries']
+                    and self._entry_path(key).is_file())
+
+    def store(self, key, name, src_dir):
+        """Adds the contents of src_dir as the entry for key.
+
+            Arguments, required:
+                key: Key from make_key().
+                name: Name shown in stats(), normally the library name.
+                src_dir: Directory laid out the way it is to be restored
+                    into the prefix.
+        """
+        path = self._entry_path(key)
+        os.makedirs(path.parent, exist_ok=True)
+        fd, tmp_str = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        os.close(fd)
+        with tarfile.open(tmp_str, 'w:gz') as tar:
+            for child in sorted(os.listdir(src_dir)):
+                tar.add(os.path.join(src_dir, child), arcname=child)
+
+        os.replace(tmp_str, path)
+        with self._lock:
+            index = self._load_index()
+            index['entries'][key] = {'name': name,
+                                     'size': path.stat().st_size,
+                                     'atime': time.time()}
+            self._evict(index)
+            self._save_index(index)
+
+        logging.debug("Stored '%s' in the artifact cache as %s", name, key)
+
+    def _evict(self, index):
+        entries = index['entries']
+        total = sum(e['size'] for e in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]['atime']):
+            if total <= self.max_bytes:
+                break
+
+            logging.info("Evicting '%s' (%s) from the artifact cache",
+                         entries[key]['name'], key)
+            total -= entries[key]['size']
+            del entries[key]
+            try:
+                os.remove(self._entry_path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        """Returns a dict describing the contents of the cache."""
+        with self._lock:
+            index = self._load_index()
+
+        entries = index['entries']
+        lookups = index['hits'] + index['misses']
+        return {
+            'entries': len(entries),
+            'size': sum(e['size'] for e in entries.values()),
+            'max_size': self.max_bytes,
+            'hits': index['hits'],
+            'misses': index['misses'],
+            'hit_rate': index['hits'] / lookups if lookups else 0.0,
+            'libraries': sorted({e['name'] for e in entries.values()})
+        }
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""Encode Benchmark"""
+
+import json
+import logging
+import os
+import shlex
+import socket
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+import runner
+from buildhistory import SqliteStore
+
+class BenchCase(NamedTuple):
+    # e.g. 'x264 medium 10-bit'.
+    name: str
+    # File name of the input in the work directory, it tells inputs of
+    #   other sizes and lengths apart.
+    input: str
+    # FFmpeg arguments, {input} is the input.
+    args: str
+    # Frames encoded, 0 for audio.
+    frames: int
+    # Length of the input.
+    seconds: float
+
+class BenchResult(NamedTuple):
+    case: str
+    input: str
+    success: bool
+    wall: float
+    # User and system time.
+    cpu: float
+    # Peak RSS in KiB.
+    maxrss: int
+    # Frames per second, 0 for audio.
+    fps: float
+    # Seconds of input encoded per second.
+    speed: float
+
+class BenchRegression(NamedTuple):
+    case: str
+    speed: float
+    baseline: float
+
+    @property
+    def change(self):
+        return (self.speed - self.baseline) / self.baseline
+
+class BenchmarkStore(SqliteStore):
+    """Keeps the results of every benchmark in SQLite, along with what was
+        benchmarked: the FFmpeg version, the revision of every lib and the
+        configure commands.
+
+        Results are only compared to those of the same case, input and host.
+    """
+
+    _SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS builds (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started REAL NOT NULL,
+            host TEXT NOT NULL,
+            version TEXT NOT NULL,
+            revisions TEXT NOT NULL,
+            configure TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS results (
+            build_id INTEGER NOT NULL REFERENCES builds(id),
+            name TEXT NOT NULL,
+            input TEXT NOT NULL,
+            success INTEGER NOT NULL,
+            wall REAL NOT NULL,
+            cpu REAL NOT NULL,
+            maxrss INTEGER NOT NULL,
+            fps REAL NOT NULL,
+            speed REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS results_name ON results(name, input);
+    '''
+
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self.host = socket.gethostname()
+
+    def add_build(self, version, revisions, configure):
+        """Adds a benchmarked build, returning its id.
+
+            Arguments, required:
+                version: What 'ffmpeg -version' says first.
+                revisions: dict of lib (or 'ffmpeg') to the revision it was
+                    built from.
+                configure: dict of lib (or 'ffmpeg') to its configure
+                    command.
+        """
+        with self._lock, self._connect() as db:
+            cur = db.execute(
+                'INSERT INTO builds (started, host, version, revisions, '
+                'configure) VALUES (?, ?, ?, ?, ?)',
+                (time.time(), self.host, version,
+                 json.dumps(revisions, sort_keys=True),
+                 json.dumps(configure, sort_keys=True)))
+            return cur.lastrowid
+
+    def record(self, build_id, result):
+        """Records result, a BenchResult, of build_id."""
+        with self._lock, self._connect() as db:
+            db.execute(
+                'INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (build_id, *result))
+
+    def results(self, build_id):
+        """Returns a list of BenchResult of build_id."""
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT name, input, success, wall, cpu, maxrss, fps, speed '
+                'FROM results WHERE build_id = ?', (build_id,)).fetchall()
+
+        return [BenchResult(*row) for row in rows]
+
+    def baseline(self, result, build_id, window=5):
+        """Returns the median speed of the window successful results of the
+            case of result before build_id on this host, or None if there
+            are none.
+        """
+        return self._median('SELECT speed FROM results JOIN builds ON '
+                            'build_id = id WHERE name = ? AND input = ? AND '
+                            'host = ? AND success AND build_id < ? '
+                            'ORDER BY build_id DESC LIMIT ?',
+                            (result.case, result.input, self.host, build_id,
+                             window))
+
+    def regressions(self, build_id, window=5, threshold=0.05):
+        """Returns a list of BenchRegression for the cases of build_id that
+            got more than threshold slower than their baseline().
+        """
+        found = []
+        for res in self.results(build_id):
+            if not res.success:
+                continue
+
+            baseline = self.baseline(res, build_id, window)
+            if baseline and (baseline - res.speed) / baseline > threshold:
+                found.append(BenchRegression(res.case, res.speed, baseline))
+
+        return found
+
+    def report(self, build_id, window=5, threshold=0.05):
+        """Prints the results of build_id next to their baseline and flags
+            regressions.  Returns the list of BenchRegression.
+        """
+        regressed = {r.case: r
+                     for r in self.regressions(build_id, window, threshold)}
+        print(f'Benchmark {build_id:d}, compared to the median of the '
+              f'previous {window:d}:')
+        print(f"{'case':<22s} {'fps':>8s} {'speed':>8s} {'baseline':>8s} "
+              f"{'cpu':>8s} {'rss MiB':>8s}")
+        for res in self.results(build_id):
+            baseline = self.baseline(res, build_id, window)
+            flag = ''
+            if res.case in regressed:
+                flag = f'  REGRESSED {regressed[res.case].change:+.0%}'
+            elif not res.success:
+                flag = '  FAILED'
+
+            print(f'{res.case:<22s} '
+                  f"{f'{res.fps:.1f}' if res.fps else '-':>8s} "
+                  f'{res.speed:7.2f}x '
+                  f"{'-' if baseline is None else f'{baseline:.2f}x':>8s} "
+                  f'{res.cpu:8.1f} {res.maxrss / 1024:8.1f}{flag:s}')
+
+        if regressed:
+            logging.warning('%d case(s) got more than %.0f%% slower',
+                            len(regressed), threshold * 100)
+
+        return list(regressed.values())
+
+class EncodeBenchmark:
+    """Times a fixed matrix of encodes with ffmpeg: libx264 at every preset
+        and bit depth, and libmp3lame at CBR and VBR.  Cases of encoders
+        ffmpeg wasn't built with, or bit depths its libx264 can't encode,
+        are left out.
+
+        The inputs are generated by ffmpeg itself, testsrc2 for video and a
+            sine for audio, and kept in work_dir.
+
+        Arguments, required:
+            ffmpeg: The ffmpeg binary.
+            work_dir: Where the inputs are kept.
+
+        Arguments, optional:
+            presets: libx264 presets.
+            bit_depths: libx264 bit depths, 8 and/or 10.
+            clip_size: Frame size of the video input, as WIDTHxHEIGHT.
+            clip_seconds: Length of the video input.
+            repeat: How many times every case is run, the fastest counts.
+    """
+
+    # Audio encodes are a lot faster, so the input is longer.
+    _AUDIO_SECONDS = 60
+
+    _RATE = 30
+
+    _DEPTH_TO_PIX_FMT = {8: 'yuv420p', 10: 'yuv420p10le'}
+
+    # (name, arguments) of the libmp3lame cases.
+    _LAME_CASES = (
+        ('lame cbr 320k', '-c:a libmp3lame -b:a 320k'),
+        ('lame vbr V2', '-c:a libmp3lame -q:a 2'),
+    )
+
+    def __init__(self, ffmpeg, work_dir,
+                 presets=('ultrafast', 'medium', 'slow'), bit_depths=(8, 10),
+                 clip_size='1280x720', clip_seconds=5, repeat=3):
+        self.ffmpeg = str(ffmpeg)
+        self.work_dir = Path(work_dir)
+        self.presets = tuple(presets)
+        self.bit_depths = tuple(bit_depths)
+        self.clip_size = clip_size
+        self.clip_seconds = clip_seconds
+        self.repeat = max(1, repeat)
+
+    def _ffmpeg(self, args_str):
+        return runner.run([self.ffmpeg, '-hide_banner', '-nostdin',
+                           *shlex.split(args_str)])
+
+    def build_info(self):
+        """Returns (version, configure) of ffmpeg, as 'ffmpeg -version'
+            shows them, or None if it doesn't run.
+        """
+        res = self._ffmpeg('-version')
+        if not res.success:
+            logging.error("Couldn't run '%s':\n%s", self.ffmpeg, res.output)
+            return None
+
+        lines = res.output.strip().splitlines()
+        configure_str = next((line.partition(':')[2].strip()
+                              for line in lines
+                              if line.startswith('configuration:')), '')
+        return lines[0], configure_str
+
+    def cases(self):
+        """Returns the BenchCases ffmpeg can run."""
+        res = self._ffmpeg('-encoders')
+        encoders = {line.split()[1] for line in res.output.splitlines()
+                    if len(line.split()) > 1 and line.startswith(' ')}
+        cases = []
+        if 'libx264' in encoders:
+            res = self._ffmpeg('-h encoder=libx264')
+            for depth in self.bit_depths:
+                pix_fmt = self._DEPTH_TO_PIX_FMT[depth]
+                if pix_fmt not in res.output.split():
+                    logging.warning("libx264 can't encode %d-bit, leaving "
+                                    'it out', depth)
+                    continue
+
+                input_str = (f'{self.clip_size:s}-{pix_fmt:s}-'
+                             f'{self.clip_seconds:d}s.y4m')
+                cases += [BenchCase(f'x264 {preset:s} {depth:d}-bit',
+                                    input_str,
+                                    f'-i {{input}} -c:v libx264 '
+                                    f'-preset {preset:s} -f null -',
+                                    self._RATE * self.clip_seconds,
+                                    self.clip_seconds)
+                          for preset in self.presets]
+        else:
+            logging.warning('FFmpeg was built without libx264')
+
+        if 'libmp3lame' in encoders:
+            cases += [BenchCase(name,
+                                f'sine-{self._AUDIO_SECONDS:d}s.wav',
+                                f'-i {{input}} {args_str:s} -f null -',
+                                0,
+                                self._AUDIO_SECONDS)
+                      for name, args_str in self._LAME_CASES]
+        else:
+            logging.warning('FFmpeg was built without libmp3lame')
+
+        return cases
+
+    def _source(self, input_str):
+        """Returns the lavfi source input_str is generated from."""
+        if input_str.endswith('.wav'):
+            return (f'-f lavfi -i sine=frequency=440:sample_rate=44100:'
+                    f'duration={self._AUDIO_SECONDS:d} -ac 2')
+
+        size_str, pix_fmt, _ = input_str.split('-')
+        return (f'-f lavfi -i testsrc2=size={size_str:s}:rate={self._RATE:d}:'
+                f'duration={self.clip_seconds:d} -pix_fmt {pix_fmt:s} '
+                '-strict -1')
+
+    def _input(self, input_str):
+        """Returns the path of input_str, generating it if it isn't yet."""
+        path = self.work_dir / input_str
+        if path.is_file():
+            return path
+
+        logging.info("Generating '%s'...", input_str)
+        os.makedirs(self.work_dir, exist_ok=True)
+        tmp_path = path.with_name(f'tmp-{path.name:s}')
+        res = self._ffmpeg(f'-loglevel error -y {self._source(input_str):s} '
+                           f'{shlex.quote(str(tmp_path)):s}')
+        if not res.success:
+            logging.error("Couldn't generate '%s':\n%s", input_str,
+                          res.output)
+            return None
+
+        os.replace(tmp_path, path)
+        return path
+
+    def run_case(self, case):
+        """Runs case repeat times, returning the BenchResult of the fastest
+            run, with the largest peak RSS of them all.
+        """
+        input_path = self._input(case.input)
+        if input_path is None:
+            return BenchResult(case.name, case.input, False, 0, 0, 0, 0, 0)
+
+        args_str = case.args.format(input=shlex.quote(str(input_path)))
+        best = None
+        maxrss = 0
+        for _ in range(self.repeat):
+            res = self._ffmpeg(f'-loglevel error {args_str:s}')
+            if not res.success:
+                logging.error("'%s' failed with exit code %d:\n%s",
+                              case.name, res.returncode, res.output)
+                return BenchResult(case.name, case.input, False,
+                                   res.duration, res.user + res.sys,
+                                   res.maxrss, 0, 0)
+
+            maxrss = max(maxrss, res.maxrss)
+            if best is None or res.duration < best.duration:
+                best = res
+
+        wall = max(best.duration, 1e-6)
+        return BenchResult(case.name, case.input, True, best.duration,
+                           best.user + best.sys, maxrss,
+                           case.frames / wall, case.seconds / wall)
+
+    def run(self):
+        """Runs every case, returning their BenchResults."""
+        results = []
+        for case in self.cases():
+            logging.info("Benchmarking '%s'...", case.name)
+            results.append(self.run_case(case))
+
+        return results
@@ -0,0 +1,758 @@
+#!/usr/bin/env python3
+"""Library Builder"""
+
+import filecmp
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+import jobserver
+import runner
+import toolchain
+from repobase import BuildStep, RepoBase, RepoTool
+from utils_ import vlogger
+
+# Directories that are usually RAM backed, in order of preference.
+_RAM_DIRS = ('/dev/shm', os.environ.get('XDG_RUNTIME_DIR'))
+
+# What was installed in a prefix, relative to it, see
+#   LibBuilder.record_install().
+PROVENANCE_FILE = os.path.join('share', 'ffscript', 'provenance.json')
+
+def read_provenance(prefix):
+    """Returns {name: {'revision', 'configure', 'installed'}} of everything
+        installed in prefix, see LibBuilder.record_install(), or {} if
+        nothing was recorded.  The entry of 'ffmpeg' also has the 'libs' it
+        was linked with.
+    """
+    try:
+        with open(os.path.join(prefix, PROVENANCE_FILE)) as prov_file:
+            return json.load(prov_file)
+    except (OSError, ValueError):
+        return {}
+
+def find_ram_dir(min_free):
+    """Returns a RAM backed directory with at least min_free bytes free, in
+        a system with at least as much memory available, or None.
+    """
+    memory = jobserver.available_memory()
+    if memory is not None and memory < min_free:
+        return None
+
+    for dir_str in filter(None, _RAM_DIRS):
+        try:
+            stat = os.statvfs(dir_str)
+        except OSError:
+            continue
+
+        if (os.access(dir_str, os.W_OK)
+                and stat.f_bavail * stat.f_frsize >= min_free):
+            return dir_str
+
+    return None
+
+class FFmpegSource(RepoBase):
+    """FFmpeg's git checkout, only to get its revision and fingerprint it
+        like the libs.
+    """
+
+    def __init__(self):
+        super().__init__('ffmpeg', repo_tool=RepoTool.GIT_TOOL)
+
+    def get_repo_download(self):
+        pass
+
+class LibPlan(NamedTuple):
+    # BuildSteps of the lib, including those that will be skipped.
+    steps: list
+    # Phases of steps that won't run.
+    skip: set
+    # True if the build will be restored from the artifact cache.
+    cached: bool
+
+class LibBuilder:
+    """Configures, builds and installs libraries into prefix.
+
+        Nothing in here changes the current directory, so a single instance
+            can be shared between the threads of a BuildScheduler.
+
+        Libs are built in their checkout, unless build_root is given.  Each
+            lib (or variant of one, see variants.LibVariant) is then built in
+            its own directory under it, so any number can be built at once
+            from one checkout, which is never written to.  Libs that can't
+            be built out of tree (See RepoBase.out_of_tree) are copied there
+            first.  The checkout of a lib that can must not be configured
+            in tree.
+    """
+
+    # Files that only exist once a source tree has been configured.
+    _CONFIGURED_FILES = ('config.status', 'config.mak')
+
+    # What FFmpeg's configure generates, relative to its source.
+    _FFMPEG_CONFIG_FILES = ('config.h', 'config.mak', 'config.asm',
+                            'config_components.h', 'doc/config.texi',
+                            'ffbuild/config.*', 'libavutil/avconfig.h',
+                            'lib*/*_list.c', 'lib*/*.pc')
+
+    # What FFmpeg's make links against the libs, relative to its source.
+    _FFMPEG_LINKED = ('ffmpeg', 'ffmpeg_g', 'ffprobe', 'ffprobe_g', 'ffplay',
+                      'ffplay_g', 'lib*/lib*.so*', 'lib*/lib*.dylib')
+
+    def __init__(self,
+                 repo_prefix,
+                 prefix,
+                 artifacts=None,
+                 state_dir=None,
+                 config_cache=None,
+                 compiler_cache=None,
+                 history=None,
+                 log_dir=None,
+                 log_tail=50,
+                 jobserver=None,
+                 ffmpeg_configs=None,
+                 build_root=None,
+                 extra_flags=None):
+        self.repo_prefix = repo_prefix
+        self.prefix = prefix
+        # An artifactcache.ArtifactCache, or None to always build.
+        self.artifacts = artifacts
+        # Where the incremental build state of each lib is kept, or None to
+        #   always run every phase.
+        self.state_dir = state_dir
+        # A configcache.ConfigCache shared by autoconf libs, or None.
+        self.config_cache = config_cache
+        # A compilercache.CompilerCache wrapping CC/CXX, or None.
+        self.compiler_cache = compiler_cache
+        # Compiler cache hits/misses of each lib built, see report().
+        self.compiler_stats = {}
+        # Compiler cache stats from before the first build, and the file the
+        #   compiles of each lib being built are logged to, see
+        #   _count_compiles().
+        self._cache_before = None
+        self._cache_counting = False
+        self._stats_logs = {}
+        self._stats_lock = threading.Lock()
+        # Why each lib built incrementally ran the phases it did, see
+        #   report().
+        self.incremental = {}
+        # A buildhistory.BuildHistory every phase is recorded in, or None.
+        self.history = history
+        # Output of every phase goes to log_dir/<lib>/<phase>.log.gz, and
+        #   only the last log_tail lines of it are kept in memory and shown
+        #   when the phase fails.
+        self.log_dir = log_dir
+        self.log_tail = log_tail
+        # A jobserver.JobServer every make shares its job slots with, or None
+        #   to run make without -j.
+        self.jobserver = jobserver
+        # An artifactcache.ArtifactCache the files FFmpeg's configure
+        #   generates are kept in, or None to always run it.
+        self.ffmpeg_configs = ffmpeg_configs
+        # Where libs are built out of tree, or None to build in the checkouts.
+        self.build_root = build_root
+        # (cflags, ldflags) added to those of FFmpeg and of the libs taking
+        #   extra-cflags/extra-ldflags, e.g. to build with PGO, or None.
+        self.extra_flags = extra_flags
+        self._provenance_lock = threading.Lock()
+
+    def source_dir(self, lib):
+        return Path(self.repo_prefix, lib.source_name)
+
+    def build_dir(self, lib):
+        """Returns the directory lib is configured and built in."""
+        if self.build_root is None:
+            return self.source_dir(lib)
+
+        return Path(self.build_root, lib.name)
+
+    def lib_prefix(self, lib):
+        """Returns where lib is installed."""
+        return lib.install_prefix or self.prefix
+
+    def get_build_commands(self, lib, destdir=None):
+        """Returns the BuildSteps of lib, run in build_dir()."""
+        source_path = None
+        if self.build_root is not None and lib.out_of_tree:
+            source_path = self.source_dir(lib)
+
+        return lib.get_build_commands(destdir=destdir,
+                                      source_path=source_path,
+                                      **self.get_config_kwargs(lib))
+
+    @staticmethod
+    def _sync_tree(src_str, dst_str):
+        """Copies the files of src_str that changed since the last copy to
+            dst_str, keeping their modification times so make only rebuilds
+            what changed.  VCS metadata is left out.
+        """
+        for root, dirs, files in os.walk(src_str):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            dst_root = os.path.join(dst_str, os.path.relpath(root, src_str))
+            os.makedirs(dst_root, exist_ok=True)
+            for name in files:
+                src_file = os.path.join(root, name)
+                dst_file = os.path.join(dst_root, name)
+                src_stat = os.lstat(src_file)
+                try:
+                    dst_stat = os.lstat(dst_file)
+                except FileNotFoundError:
+                    pass
+                else:
+                    if (dst_stat.st_mtime_ns == src_stat.st_mtime_ns
+                            and dst_stat.st_size == src_stat.st_size):
+                        continue
+
+                    os.remove(dst_file)
+
+                shutil.copy2(src_file, dst_file, follow_symlinks=False)
+
+    def _prepare_build_dir(self, lib):
+        if self.build_root is None:
+            return
+
+        build_path = self.build_dir(lib)
+        os.makedirs(build_path, exist_ok=True)
+        if not lib.out_of_tree:
+            logging.debug("Copying '%s' to '%s'", lib.name, build_path)
+            self._sync_tree(self.source_dir(lib), build_path)
+
+    def get_env(self):
+        env = dict(os.environ)
+        pkg_path = os.path.join(self.prefix, 'lib', 'pkgconfig')
+        env['PKG_CONFIG_PATH'] = os.pathsep.join(
+            p for p in (pkg_path, env.get('PKG_CONFIG_PATH')) if p)
+        if self.compiler_cache:
+            env = self.compiler_cache.wrap_env(env)
+
+        return env
+
+    def get_config_kwargs(self, lib):
+        """Returns the keyword arguments lib is configured with."""
+        kwargs = {'prefix': self.lib_prefix(lib)}
+        if self.config_cache and lib.autoconf:
+            kwargs['cache_file'] = str(
+                self.config_cache.lib_path(lib, self.get_env()))
+
+        if self.extra_flags and lib.options.has_option('extra-cflags'):
+            kwargs['extra-cflags'], kwargs['extra-ldflags'] = (
+                self.extra_flags)
+
+        return kwargs
+
+    def log_path(self, name, phase):
+        """Returns the log file of phase of name, or None if not logging."""
+        if self.log_dir is None:
+            return None
+
+        return Path(self.log_dir, name, f'{phase:s}.log.gz')
+
+    def run_steps(self, name, steps, cwd, skip=()):
+        env = self.get_env()
+        if name in self._stats_logs:
+            env = self.compiler_cache.log_env(env, self._stats_logs[name])
+
+        pass_fds = ()
+        if self.jobserver:
+            env = self.jobserver.env(env)
+            pass_fds = self.jobserver.fds
+
+        for step in steps:
+            if step.phase in skip:
+                continue
+
+            log_path = self.log_path(name, step.phase)
+            with vlogger.log_context(name, step.phase):
+                if self.jobserver:
+                    self.jobserver.acquire()
+
+                try:
+                    res = runner.run(step.command, cwd=cwd, env=env,
+                                     log_path=log_path, tail=self.log_tail,
+                                     pass_fds=pass_fds)
+                finally:
+                    if self.jobserver:
+                        self.jobserver.release()
+
+                if self.history:
+                    self.history.record(name, step.phase, res)
+
+                if not res.success:
+                    logging.error("%s of '%s' failed with exit code %d, "
+                                  'last %d lines:\n%s',
+                                  step.phase.capitalize(), name,
+                                  res.returncode, self.log_tail, res.output)
+                    if log_path:
+                        logging.error("Full log is in '%s'", log_path)
+
+                    return False
+
+        return True
+
+    def _state_path(self, lib):
+        return Path(self.state_dir, f'{lib.name:s}.json')
+
+    def _load_state(self, lib):
+        try:
+            with open(self._state_path(lib)) as state_file:
+                return json.load(state_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _save_state(self, lib, state):
+        if state is None:
+            try:
+                os.remove(self._state_path(lib))
+            except FileNotFoundError:
+                pass
+            return
+
+        os.makedirs(self.state_dir, exist_ok=True)
+        with open(self._state_path(lib), 'w') as state_file:
+            json.dump(state, state_file, indent=1)
+
+    @staticmethod
+    def _configure_command(steps):
+        return next(s.command for s in steps if s.phase == 'configure')
+
+    def _skip(self, lib, phases, reason_str):
+        logging.info('%s: %s', lib.name, reason_str)
+        self.incremental[lib.name] = reason_str
+        return phases
+
+    def _skip_phases(self, lib, steps, fingerprint):
+        """Returns the phases of steps that an incremental build can skip."""
+        state = self._load_state(lib)
+        configure_str = self._configure_command(steps)
+        build_path = self.build_dir(lib)
+        if state is None:
+            return self._skip(lib, set(),
+                              'no previous build recorded, running every '
+                              'phase')
+
+        if state.get('configure') != configure_str:
+            return self._skip(lib, set(),
+                              'configure arguments changed, reconfiguring')
+
+        if not any((build_path / f).is_file()
+                   for f in self._CONFIGURED_FILES):
+            return self._skip(lib, set(),
+                              'build tree is not configured, reconfiguring')
+
+        if fingerprint is None:
+            return self._skip(lib, {'configure'},
+                              "configure skipped, can't fingerprint the "
+                              'sources, running make')
+
+        if state.get('fingerprint') != fingerprint:
+            return self._skip(lib, {'configure'},
+                              'configure skipped, sources changed, running '
+                              'make')
+
+        return self._skip(lib, {'configure', 'make'},
+                          'sources unchanged since the last build, skipping '
+                          'configure and make')
+
+    def cache_key(self, lib, steps, fingerprint):
+        """Returns the artifact cache key for building lib with steps, or
+            None if the sources can't be fingerprinted.
+        """
+        if fingerprint is None:
+            return None
+
+        env = self.get_env()
+        return self.artifacts.make_key(
+            name=lib.name,
+            fingerprint=fingerprint,
+            commands=[step.command for step in steps],
+            compiler=toolchain.compiler_identity(env),
+            env=toolchain.env_flags(env))
+
+    @staticmethod
+    def _copy_tree(src_str, dst_str):
+        for root, dirs, files in os.walk(src_str):
+            rel_str = os.path.relpath(root, src_str)
+            for name in dirs:
+                os.makedirs(os.path.join(dst_str, rel_str, name),
+                            exist_ok=True)
+
+            for name in files:
+                dst_file = os.path.join(dst_str, rel_str, name)
+                if os.path.lexists(dst_file):
+                    os.remove(dst_file)
+
+                shutil.copy2(os.path.join(root, name), dst_file,
+                             follow_symlinks=False)
+
+    def _build_cached(self, lib, key, build_path, skip):
+        stage_str = tempfile.mkdtemp(prefix=f'ffscript-{lib.name:s}-')
+        prefix_str = self.lib_prefix(lib)
+        try:
+            if not self.run_steps(lib.name,
+                                  self.get_build_commands(lib, stage_str),
+                                  build_path,
+                                  skip):
+                return False
+
+            staged_str = os.path.join(stage_str,
+                                      prefix_str.lstrip(os.sep))
+            if not os.path.isdir(staged_str):
+                logging.error("'%s' didn't install anything into '%s'",
+                              lib.name, staged_str)
+                return False
+
+            self.artifacts.store(key, lib.name, staged_str)
+            self._copy_tree(staged_str, prefix_str)
+        finally:
+            shutil.rmtree(stage_str, ignore_errors=True)
+
+        return True
+
+    def plan(self, lib):
+        """Returns the LibPlan of what build() would do for lib right now,
+            without doing any of it.
+        """
+        steps = self.get_build_commands(lib)
+        src_path = self.source_dir(lib)
+        if not src_path.is_dir():
+            return LibPlan(steps, set(), False)
+
+        fingerprint = None
+        if self.artifacts or self.state_dir:
+            fingerprint = lib.get_fingerprint(src_path)
+
+        if self.artifacts:
+            key = self.cache_key(lib, steps, fingerprint)
+            if key is not None and self.artifacts.contains(key):
+                return LibPlan(steps, {s.phase for s in steps}, True)
+
+        skip = set()
+        if self.state_dir:
+            skip = self._skip_phases(lib, steps, fingerprint)
+
+        return LibPlan(steps, skip, False)
+
+    def plan_ffmpeg(self, ffmpeg_src, libs):
+        """Returns the LibPlan of what build_ffmpeg() would do right now.
+
+            The libs aren't installed yet when planning a full build, so
+                whether configure is cached can only be told for the prefix
+                as it is.
+        """
+        steps = [BuildStep('configure', f'./{self.get_ffmpeg_config(libs):s}'),
+                 BuildStep('make', 'make'),
+                 BuildStep('install', 'make install')]
+        skip = set()
+        if (self.ffmpeg_configs
+                and Path(ffmpeg_src, 'configure').is_file()
+                and self.ffmpeg_configs.contains(
+                    self.ffmpeg_config_key(ffmpeg_src, steps[0].command))):
+            skip.add('configure')
+
+        return LibPlan(steps, skip, False)
+
+    def record_install(self, name, revision, configure_str, **extra):
+        """Records in the prefix that name was just installed from revision
+            with configure_str, along with anything in extra.  What the
+            prefix holds can then be told later on (See read_provenance()),
+            when the checkouts and the defaults may have moved on.
+        """
+        path_str = os.path.join(self.prefix, PROVENANCE_FILE)
+        with self._provenance_lock:
+            provenance = read_provenance(self.prefix)
+            provenance[name] = dict(revision=revision,
+                                    configure=configure_str,
+                                    installed=time.time(),
+                                    **extra)
+            os.makedirs(os.path.dirname(path_str), exist_ok=True)
+            with open(f'{path_str:s}.tmp', 'w') as prov_file:
+                json.dump(provenance, prov_file, indent=2, sort_keys=True)
+
+            os.replace(f'{path_str:s}.tmp', path_str)
+
+    def _count_compiles(self, name, build, *args):
+        """Returns build(*args), counting the compiler cache hits and misses
+            of the compiles of name.
+
+            Libs are built at the same time and share the cache, so its
+                stats are only taken once, before the first build, for the
+                totals of the run.  Each build logs its own compiles, when
+                the cache can (See CompilerCache.log_env()).
+        """
+        if not self.compiler_cache:
+            return build(*args)
+
+        with self._stats_lock:
+            if not self._cache_counting:
+                self._cache_counting = True
+                self._cache_before = self.compiler_cache.stats()
+
+        if not self.compiler_cache.logs_stats:
+            return build(*args)
+
+        fd, log_str = tempfile.mkstemp(prefix=f'ffscript-{name:s}-',
+                                       suffix='.stats')
+        os.close(fd)
+        self._stats_logs[name] = log_str
+        try:
+            return build(*args)
+        finally:
+            del self._stats_logs[name]
+            self.compiler_stats[name] = self.compiler_cache.log_stats(
+                log_str)
+            os.remove(log_str)
+
+    def build(self, lib):
+        """Builds and installs lib, returning True on success."""
+        success = self._count_compiles(lib.name, self._build, lib)
+        if success:
+            self.record_install(
+                lib.name, lib.get_revision(str(self.source_dir(lib))),
+                self._configure_command(self.get_build_commands(lib)))
+
+        return success
+
+    def _build(self, lib):
+        src_path = self.source_dir(lib)
+        if not src_path.is_dir():
+            logging.error("Source for '%s' was not found in '%s'",
+                          lib.name, src_path)
+            return False
+
+        steps = self.get_build_commands(lib)
+        fingerprint = None
+        if self.artifacts or self.state_dir:
+            fingerprint = lib.get_fingerprint(src_path)
+
+        key = None
+        if self.artifacts:
+            key = self.cache_key(lib, steps, fingerprint)
+            if key is not None and self.artifacts.restore(
+                    key, self.lib_prefix(lib)):
+                return True
+
+        self._prepare_build_dir(lib)
+        build_path = self.build_dir(lib)
+
+        skip = set()
+        if self.state_dir:
+            skip = self._skip_phases(lib, steps, fingerprint)
+            # Forget the last build until this one succeeds, so a failed
+            #   configure is never skipped next time.
+            self._save_state(lib, None)
+
+        use_config_cache = (self.config_cache and lib.autoconf
+                            and 'configure' not in skip)
+        if use_config_cache:
+            self.config_cache.checkout(lib, self.get_env())
+
+        if key is not None:
+            logging.info("Building '%s' (artifact cache miss)...", lib.name)
+            success = self._build_cached(lib, key, build_path, skip)
+        else:
+            logging.info("Building '%s'...", lib.name)
+            success = self.run_steps(lib.name, steps, build_path, skip)
+
+        if success and use_config_cache:
+            self.config_cache.merge(lib, self.get_env())
+
+        if success and self.state_dir:
+            self._save_state(lib, {'configure': self._configure_command(steps),
+                                   'fingerprint': fingerprint})
+
+        return success
+
+    def get_ffmpeg_config(self, libs):
+        """Returns the FFmpeg configure command enabling every lib in libs,
+            along with whatever their licenses require.
+        """
+        cflags_str, ldflags_str = ('', '')
+        if self.extra_flags:
+            cflags_str, ldflags_str = (f' {f:s}' for f in self.extra_flags)
+
+        command_str = f'configure --prefix={self.prefix:s} '
+        command_str += (f"--extra-cflags='-I{self.prefix:s}/include"
+                        f"{cflags_str:s}' "
+                        f"--extra-ldflags='-L{self.prefix:s}/lib"
+                        f"{ldflags_str:s}' ")
+        env = self.get_env()
+        if self.compiler_cache:
+            # FFmpeg's configure ignores CC and CXX from the environment.
+            command_str += f"--cc='{env['CC']:s}' --cxx='{env['CXX']:s}' "
+        elif self.extra_flags and 'CC' in env:
+            # The flags are for the compiler the libs are built with, which
+            #   isn't necessarily FFmpeg's default.
+            command_str += f"--cc='{env['CC']:s}' "
+
+        for switch in dict.fromkeys(s for lib in libs
+                                    for s in lib.license_switches):
+            command_str += f'{switch:s} '
+
+        for lib in libs:
+            command_str += f'{lib.switch:s} '
+
+        return command_str
+
+    def build_ffmpeg(self, ffmpeg_src, libs):
+        """Configures, builds and installs FFmpeg from ffmpeg_src."""
+        logging.info('Building FFmpeg...')
+        return self._count_compiles('ffmpeg', self._build_ffmpeg, ffmpeg_src,
+                                    libs)
+
+    def relink_ffmpeg(self, ffmpeg_src, libs):
+        """Builds FFmpeg like build_ffmpeg(), relinking everything linked
+            against the libs even if FFmpeg's sources didn't change.
+        """
+        for pattern in self._FFMPEG_LINKED:
+            for path in Path(ffmpeg_src).glob(pattern):
+                if path.is_file() or path.is_symlink():
+                    path.unlink()
+
+        return self.build_ffmpeg(ffmpeg_src, libs)
+
+    def _pkg_config_view(self):
+        """Returns {name: sha256} of the pkg-config files in the prefix."""
+        view = {}
+        pkg_path = Path(self.prefix, 'lib', 'pkgconfig')
+        if pkg_path.is_dir():
+            for pc_path in sorted(pkg_path.glob('*.pc')):
+                view[pc_path.name] = hashlib.sha256(
+                    pc_path.read_bytes()).hexdigest()
+
+        return view
+
+    def ffmpeg_config_key(self, ffmpeg_src, configure_str):
+        """Returns the key the output of configure_str, run in ffmpeg_src,
+            is cached under.
+        """
+        env = self.get_env()
+        return self.ffmpeg_configs.make_key(
+            configure=configure_str,
+            script=hashlib.sha256(
+                Path(ffmpeg_src, 'configure').read_bytes()).hexdigest(),
+            compiler=toolchain.compiler_identity(env),
+            env=toolchain.env_flags(env),
+            pkg_config=self._pkg_config_view())
+
+    def _store_ffmpeg_config(self, key, ffmpeg_src):
+        """Stores everything configure generates in ffmpeg_src, see
+            _FFMPEG_CONFIG_FILES.
+
+            Configure leaves files whose contents didn't change alone, so
+                all of them are stored every time, not just the ones it
+                wrote.
+        """
+        stage_str = tempfile.mkdtemp(prefix='ffscript-ffconfig-')
+        count = 0
+        try:
+            for pattern in self._FFMPEG_CONFIG_FILES:
+                for path in Path(ffmpeg_src).glob(pattern):
+                    rel_str = os.path.relpath(path, ffmpeg_src)
+                    os.makedirs(os.path.join(stage_str,
+                                             os.path.dirname(rel_str)),
+                                exist_ok=True)
+                    shutil.copy2(path, os.path.join(stage_str, rel_str))
+                    count += 1
+
+            self.ffmpeg_configs.store(key, 'ffmpeg-configure', stage_str)
+        finally:
+            shutil.rmtree(stage_str, ignore_errors=True)
+
+        logging.debug('Cached %d files generated by configure', count)
+
+    def _restore_ffmpeg_config(self, key, ffmpeg_src):
+        """Restores the output of configure cached under key into
+            ffmpeg_src, returning False if there is none.
+
+            Only the files whose contents differ are replaced, and those get
+                the current time, so make rebuilds whatever depends on them
+                even if the objects are newer than when they were cached.
+        """
+        stage_str = tempfile.mkdtemp(prefix='ffscript-ffconfig-')
+        try:
+            if not self.ffmpeg_configs.restore(key, stage_str):
+                return False
+
+            for root, _, files in os.walk(stage_str):
+                for name in files:
+                    src_str = os.path.join(root, name)
+                    dst_str = os.path.join(ffmpeg_src,
+                                           os.path.relpath(src_str,
+                                                           stage_str))
+                    try:
+                        if filecmp.cmp(src_str, dst_str, shallow=False):
+                            continue
+                    except FileNotFoundError:
+                        os.makedirs(os.path.dirname(dst_str), exist_ok=True)
+
+                    shutil.copyfile(src_str, dst_str)
+        finally:
+            shutil.rmtree(stage_str, ignore_errors=True)
+
+        return True
+
+    def _build_ffmpeg(self, ffmpeg_src, libs):
+        configure_str = f'./{self.get_ffmpeg_config(libs):s}'
+        configure = BuildStep('configure', configure_str)
+        key = None
+        if self.ffmpeg_configs:
+            key = self.ffmpeg_config_key(ffmpeg_src, configure_str)
+            if self._restore_ffmpeg_config(key, ffmpeg_src):
+                logging.info('Restored the output of FFmpeg configure')
+                configure = None
+
+        if configure:
+            if not self.run_steps('ffmpeg', [configure], ffmpeg_src):
+                return False
+
+            if key:
+                self._store_ffmpeg_config(key, ffmpeg_src)
+
+        if not self.run_steps('ffmpeg',
+                              [BuildStep('make', 'make'),
+                               BuildStep('install', 'make install')],
+                              ffmpeg_src):
+            return False
+
+        revision = None
+        if Path(ffmpeg_src, '.git').exists():
+            revision = FFmpegSource().get_revision(str(ffmpeg_src))
+
+        self.record_install('ffmpeg', revision, configure_str,
+                            libs=[lib.name for lib in libs])
+        return True
+
+    def report(self):
+        """Prints why every lib built incrementally ran the phases it did,
+            and the compiler cache hit rate of every lib built, when the
+            cache can tell (See _count_compiles()), and of the whole run.
+        """
+        if self.incremental:
+            width = max(len(n) for n in self.incremental)
+            print('Incremental builds:')
+            for name, reason_str in self.incremental.items():
+                print(f'{name:<{width}s} {reason_str:s}')
+
+        if not self._cache_counting:
+            return
+
+        rows = dict(self.compiler_stats)
+        rows['total'] = self.compiler_cache.delta(self._cache_before,
+                                                  self.compiler_cache.stats())
+        width = max(len(n) for n in rows)
+        print(f'{self.compiler_cache.tool:s} statistics:')
+        for name, stats in rows.items():
+            if stats is None:
+                print(f"{name:<{width}s} {'?':>6s} hits {'?':>6s} misses")
+                continue
+
+            total = stats['hits'] + stats['misses']
+            rate_str = f"{stats['hits'] / total:.1%}" if total else '-'
+            print(f"{name:<{width}s} {stats['hits']:6d} hits "
+                  f"{stats['misses']:6d} misses {rate_str:>7s}")
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""Historical Build Database"""
+
+import logging
+import os
+import socket
+import sqlite3
+import statistics
+import threading
+import time
+from typing import NamedTuple
+
+import runner
+
+class PhaseRecord(NamedTuple):
+    run_id: int
+    lib: str
+    phase: str
+    success: bool
+    wall: float
+    user: float
+    sys: float
+    maxrss: int
+
+class Regression(NamedTuple):
+    lib: str
+    phase: str
+    wall: float
+    baseline: float
+
+    @property
+    def change(self):
+        return (self.wall - self.baseline) / self.baseline
+
+class SqliteStore:
+    """A SQLite database of timings, shared by the threads of a build.
+
+        The database is only opened, and created, once something is recorded
+            or read, so invocations that don't use it leave nothing behind.
+    """
+
+    # Statements creating the tables, run when the database is opened.
+    _SCHEMA = ''
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Returns the connection to the database, opening it the first
+            time.  Must be called with self._lock held.
+        """
+        if self._db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)),
+                        exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.executescript(self._SCHEMA)
+
+        return self._db
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _median(self, query_str, params):
+        """Returns the median of the first column of the rows query_str
+            selects, or None if there are none.  Baselines are medians, so a
+            single slow or fast run doesn't move them.
+        """
+        with self._lock:
+            rows = self._connect().execute(query_str, params).fetchall()
+
+        return statistics.median(r[0] for r in rows) if rows else None
+
+class BuildHistory(SqliteStore):
+    """Records the resources used by every phase of every build in SQLite.
+
+        A run is one invocation of ffscript, see start_run().  Phases are
+            'download', 'update', 'configure', 'make' and 'install'.
+    """
+
+    _SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started REAL NOT NULL,
+            host TEXT NOT NULL,
+            args TEXT
+        );
+        CREATE TABLE IF NOT EXISTS phases (
+            run_id INTEGER NOT NULL REFERENCES runs(id),
+            lib TEXT NOT NULL,
+            phase TEXT NOT NULL,
+            success INTEGER NOT NULL,
+            wall REAL NOT NULL,
+            user REAL NOT NULL,
+            sys REAL NOT NULL,
+            maxrss INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS phases_lib ON phases(lib, phase);
+    '''
+
+    def __init__(self, db_path, args=''):
+        super().__init__(db_path)
+        # Command line the run was started with, see start_run().
+        self.args = args
+        self.run_id = None
+
+    def _insert_run(self):
+        cur = self._connect().execute(
+            'INSERT INTO runs (started, host, args) VALUES (?, ?, ?)',
+            (time.time(), socket.gethostname(), self.args))
+        return cur.lastrowid
+
+    def start_run(self):
+        """Starts a new run that record() adds to, returning its id.
+
+            record() starts a run by itself if none was started, so only
+                invocations that actually build something show up as runs.
+        """
+        with self._lock, self._connect():
+            self.run_id = self._insert_run()
+
+        return self.run_id
+
+    def record(self, lib, phase, results):
+        """Records phase of lib.
+
+            Arguments, required:
+                lib: Name of the library, or 'ffmpeg'.
+                phase: Name of the phase.
+                results: runner.RunResult, or a list of them if the phase
+                    took several commands.  Times are added up and the
+                    largest peak RSS is kept.
+        """
+        if isinstance(results, runner.RunResult):
+            results = [results]
+
+        with self._lock, self._connect() as db:
+            if self.run_id is None:
+                self.run_id = self._insert_run()
+
+            db.execute(
+                'INSERT INTO phases VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.run_id, lib, phase,
+                 all(r.success for r in results),
+                 sum(r.duration for r in results),
+                 sum(r.user for r in results),
+                 sum(r.sys for r in results),
+                 max((r.maxrss for r in results), default=0)))
+
+    def runs(self, limit=10):
+        """Returns (id, started, host, args) of the latest runs."""
+        with self._lock:
+            return self._connect().execute(
+                'SELECT id, started, host, args FROM runs '
+                'ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+
+    def phases(self, run_id):
+        """Returns a list of PhaseRecord of run_id."""
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT * FROM phases WHERE run_id = ?', (run_id,)).fetchall()
+
+        return [PhaseRecord(*row) for row in rows]
+
+    def estimate(self, lib, phase, window=5):
+        """Returns the median wall time of the last window successful runs of
+            phase of lib, or None if it never ran.
+        """
+        return self._baseline(lib, phase, float('inf'), window)
+
+    def _baseline(self, lib, phase, run_id, window):
+        return self._median('SELECT wall FROM phases WHERE lib = ? AND '
+                            'phase = ? AND success AND run_id < ? '
+                            'ORDER BY run_id DESC LIMIT ?',
+                            (lib, phase, run_id, window))
+
+    def regressions(self, run_id=None, window=5, threshold=0.2,
+                    min_seconds=1.0):
+        """Returns a list of Regression for phases of run_id that took more
+            than threshold longer than the median of the window successful
+            runs before it.
+
+            Phases of less than min_seconds are ignored, their timing is mostly
+                noise.
+        """
+        if run_id is None:
+            latest = self.runs(1)
+            if not latest:
+                return []
+
+            run_id = latest[0][0]
+
+        found = []
+        for rec in self.phases(run_id):
+            if not rec.success or rec.wall < min_seconds:
+                continue
+
+            baseline = self._baseline(rec.lib, rec.phase, run_id, window)
+            if baseline and (rec.wall - baseline) / baseline > threshold:
+                found.append(Regression(rec.lib, rec.phase, rec.wall,
+                                        baseline))
+
+        return found
+
+    def report(self, run_id=None, window=5, threshold=0.2):
+        """Prints the phases of run_id next to their baseline and flags
+            regressions.  Returns the list of Regression.
+        """
+        if run_id is None:
+            latest = self.runs(1)
+            if not latest:
+                print('No runs have been recorded.')
+                return []
+
+            run_id = latest[0][0]
+
+        regressed = {(r.lib, r.phase): r
+                     for r in self.regressions(run_id, window, threshold)}
+        print(f'Run {run_id:d}, compared to the median of the previous '
+              f'{window:d} runs:')
+        print(f"{'lib':<12s} {'phase':<10s} {'wall':>8s} {'baseline':>8s} "
+              f"{'user':>8s} {'sys':>8s} {'rss MiB':>8s}")
+        for rec in self.phases(run_id):
+            baseline = self._baseline(rec.lib, rec.phase, run_id, window)
+            flag = ''
+            if (rec.lib, rec.phase) in regressed:
+                change = regressed[rec.lib, rec.phase].change
+                flag = f'  REGRESSED {change:+.0%}'
+            elif not rec.success:
+                flag = '  FAILED'
+
+            print(f'{rec.lib:<12s} {rec.phase:<10s} {rec.wall:8.1f} '
+                  f"{'-' if baseline is None else f'{baseline:.1f}':>8s} "
+                  f'{rec.user:8.1f} {rec.sys:8.1f} '
+                  f'{rec.maxrss / 1024:8.1f}{flag:s}')
+
+        if regressed:
+            logging.warning('%d phase(s) regressed by more than %.0f%%',
+                            len(regressed), threshold * 100)
+
+        return list(regressed.values())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Compiler Cache (ccache/sccache) Integration"""
+
+import json
+import logging
+import os
+import shutil
+from collections import Counter
+
+import runner
+import toolchain
+
+class CompilerCache:
+    """Wraps the C/C++ compilers of every build with ccache or sccache.
+
+        Arguments, required:
+            tool: 'ccache' or 'sccache'.
+            cache_dir: Directory the compiler cache is kept in.
+
+        Arguments, optional:
+            max_size: Size limit understood by tool, e.g. '5G'.
+    """
+
+    _TOOL_TO_ENV = {
+        'ccache': {'dir': 'CCACHE_DIR', 'size': 'CCACHE_MAXSIZE'},
+        'sccache': {'dir': 'SCCACHE_DIR', 'size': 'SCCACHE_CACHE_SIZE'}
+    }
+
+    _TOOL_TO_STATS_CMD = {
+        'ccache': 'ccache --print-stats',
+        'sccache': 'sccache --show-stats --stats-format=json'
+    }
+
+    # Variable naming a file every compile appends its result to, see
+    #   log_env().  sccache only keeps the totals of its server.
+    _TOOL_TO_STATS_LOG_ENV = {
+        'ccache': 'CCACHE_STATSLOG'
+    }
+
+    def __init__(self, tool, cache_dir, max_size='5G'):
+        if tool not in self._TOOL_TO_ENV:
+            raise ValueError(f'{tool!r} is not a supported compiler cache')
+
+        self.tool = tool
+        self.cache_dir = str(cache_dir)
+        self.max_size = max_size
+
+    @classmethod
+    def detect(cls, tool, cache_dir, max_size='5G'):
+        """Returns a CompilerCache for tool, or None if it isn't installed.
+
+            tool can also be 'auto' to use whichever of ccache or sccache is
+                installed, or 'none'.
+        """
+        tools = tuple(cls._TOOL_TO_ENV) if tool == 'auto' else (tool,)
+        for name in tools:
+            if name in cls._TOOL_TO_ENV and shutil.which(name):
+                logging.debug("Using '%s' as compiler cache", name)
+                return cls(name, cache_dir, max_size)
+
+        if tool not in ('auto', 'none'):
+            logging.warning("Compiler cache '%s' is not installed", tool)
+
+        return None
+
+    def wrap_env(self, env):
+        """Returns a copy of env with CC and CXX wrapped by the cache."""
+        env = dict(env)
+        for var, default in (('CC', 'cc'), ('CXX', 'c++')):
+            compiler_str = toolchain.strip_wrappers(env.get(var, default))
+            env[var] = f'{self.tool:s} {compiler_str:s}'
+
+        env[self._TOOL_TO_ENV[self.tool]['dir']] = self.cache_dir
+        env[self._TOOL_TO_ENV[self.tool]['size']] = self.max_size
+        return env
+
+    @property
+    def logs_stats(self):
+        """True if the stats of one build can be told apart from those of
+            the builds running along with it, see log_env().
+        """
+        return self.tool in self._TOOL_TO_STATS_LOG_ENV
+
+    def log_env(self, env, log_path):
+        """Returns a copy of env where every compile appends its result to
+            log_path, read by log_stats().  Only if logs_stats.
+        """
+        env = dict(env)
+        env[self._TOOL_TO_STATS_LOG_ENV[self.tool]] = str(log_path)
+        return env
+
+    @staticmethod
+    def _ccache_stats(counters):
+        return {'hits': (counters.get('direct_cache_hit', 0)
+                         + counters.get('preprocessed_cache_hit', 0)),
+                'misses': counters.get('cache_miss', 0)}
+
+    def log_stats(self, log_path):
+        """Returns a dict with the 'hits' and 'misses' of the compiles
+            logged to log_path (See log_env()), or None if it couldn't be
+            read.
+        """
+        # Every compile logs a '# <source file>' line, then the name of
+        #   each counter it incremented on a line of its own.
+        try:
+            with open(log_path) as log_file:
+                counters = Counter(line.strip() for line in log_file
+                                   if line.strip()
+                                   and not line.startswith('#'))
+        except FileNotFoundError:
+            counters = Counter()
+        except OSError as emsg:
+            logging.warning("Couldn't read '%s' statistics: %s", self.tool,
+                            emsg)
+            return None
+
+        return self._ccache_stats(counters)
+
+    def _parse_ccache(self, output):
+        stats = {}
+        for line in output.splitlines():
+            key, _, value = line.partition('\t')
+            if value.strip().isdigit():
+                stats[key] = int(value)
+
+        return self._ccache_stats(stats)
+
+    def _parse_sccache(self, output):
+        stats = json.loads(output).get('stats', {})
+        return {'hits': sum(stats.get('cache_hits', {})
+                            .get('counts', {}).values()),
+                'misses': sum(stats.get('cache_misses', {})
+                              .get('counts', {}).values())}
+
+    def stats(self):
+        """Returns a dict with the total 'hits' and 'misses' of the cache, or
+            None if they couldn't be read.
+        """
+        res = runner.run(self._TOOL_TO_STATS_CMD[self.tool],
+                         env=self.wrap_env(os.environ))
+        if not res.success:
+            logging.warning("Couldn't read '%s' statistics", self.tool)
+            return None
+
+        try:
+            if self.tool == 'ccache':
+                return self._parse_ccache(res.output)
+
+            return self._parse_sccache(res.output)
+        except ValueError:
+            logging.warning("Couldn't parse '%s' statistics", self.tool)
+            return None
+
+    @staticmethod
+    def delta(before, after):
+        """Returns the stats accumulated between two calls to stats()."""
+        if before is None or after is None:
+            return None
+
+        return {k: after[k] - before[k] for k in after}
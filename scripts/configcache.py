@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Shared Autoconf Configure Cache"""
+
+import logging
+import os
+import re
+import shutil
+import threading
+from pathlib import Path
+
+import toolchain
+
+class ConfigCache:
+    """Shares autoconf's configure cache between every autoconf library
+        built with the same toolchain.
+
+        Each lib gets its own copy of the shared cache to pass to
+            '--cache-file', so concurrent configures never write to the same
+            file.  Once a lib has been configured its results are merged back
+            into the shared cache for the next lib.
+
+        The cache is kept per toolchain_id(), so changing the compiler or
+            any of the flags in toolchain.ENV_FLAGS starts a new cache.
+    """
+
+    _SHARED = 'config.cache'
+
+    # Lines of a cache file look like "ac_cv_foo=${ac_cv_foo=bar}".
+    _LINE_RE = re.compile(r'^(?P<var>[A-Za-z_][A-Za-z0-9_]*)=')
+
+    # ac_cv_env_* records the "precious" variables of the package that wrote
+    #   it.  Sharing them makes configure of other packages abort.
+    _PRIVATE_PREFIXES = ('ac_cv_env_',)
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+
+    def _dir(self, env):
+        return self.root / toolchain.toolchain_id(env)
+
+    def lib_path(self, lib, env):
+        """Returns the path of the cache file lib should be configured with."""
+        return self._dir(env) / f'{lib.name:s}.cache'
+
+    def checkout(self, lib, env):
+        """Seeds the cache file of lib from the shared cache."""
+        cache_dir = self._dir(env)
+        os.makedirs(cache_dir, exist_ok=True)
+        lib_path = self.lib_path(lib, env)
+        with self._lock:
+            if (cache_dir / self._SHARED).is_file():
+                shutil.copyfile(cache_dir / self._SHARED, lib_path)
+            elif lib_path.exists():
+                os.remove(lib_path)
+
+    def _read(self, path):
+        entries = {}
+        try:
+            with open(path) as cache_file:
+                for line in cache_file:
+                    match = self._LINE_RE.match(line)
+                    if (match and not match.group('var')
+                            .startswith(self._PRIVATE_PREFIXES)):
+                        entries[match.group('var')] = line
+
+        except FileNotFoundError:
+            pass
+
+        return entries
+
+    def merge(self, lib, env):
+        """Merges the results of configuring lib into the shared cache."""
+        cache_dir = self._dir(env)
+        lib_entries = self._read(self.lib_path(lib, env))
+        with self._lock:
+            entries = self._read(cache_dir / self._SHARED)
+            new_count = len(set(lib_entries) - set(entries))
+            entries.update(lib_entries)
+            tmp_path = cache_dir / f'{self._SHARED:s}.tmp'
+            with open(tmp_path, 'w') as cache_file:
+                cache_file.writelines(entries[k] for k in sorted(entries))
+
+            os.replace(tmp_path, cache_dir / self._SHARED)
+
+        logging.debug("Added %d configure results from '%s' to the shared "
+                      'cache', new_count, lib.name)
@@ -0,0 +1,616 @@
+#!/usr/bin/env python3
+"""Distributed Library Builds"""
+
+import copy
+import io
+import json
+import logging
+import os
+import queue
+import shutil
+import socket
+import socketserver
+import struct
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import NamedTuple
+
+import builder
+import runner
+import toolchain
+from repobase import BuildStep, RepoTool
+from tarball import ChecksumError, extract_all
+
+class BuildSpec(NamedTuple):
+    """Everything a worker needs to build a library the way the coordinator
+        would have.
+    """
+    name: str
+    # Revision to check out, None for whatever the worker updates to.
+    revision: str
+    # Command returned by get_config(), without the leading './'.
+    config: str
+    # toolchain.toolchain_id() of the coordinator.
+    toolchain: str
+    # Prefix the coordinator installs into.  The worker builds in a prefix
+    #   of its own and relocates what it installed to this one.
+    prefix: str
+    # Libs whose archives are sent along and installed before building,
+    #   every lib the lib depends on, directly or not.
+    depends: tuple = ()
+
+class BuildResult(NamedTuple):
+    name: str
+    success: bool
+    # Last lines of output of the phase that failed, if any.
+    output: str
+    # tar.gz of the installed files, relative to the prefix.
+    archive: bytes
+    worker: str
+
+# Blob holding the whole prefix of the coordinator, sent instead of the
+#   archives of the dependencies that were installed before the run.
+PREFIX_BLOB = '<prefix>'
+
+_HEADER = struct.Struct('!Q')
+
+def encode(header, blobs=None):
+    """Returns header, a JSON serializable dict, and blobs, a dict of names
+        to bytes, as a single message.
+    """
+    blobs = blobs or {}
+    header = dict(header, blobs=[[k, len(v)] for k, v in blobs.items()])
+    header_bytes = json.dumps(header).encode()
+    return b''.join([_HEADER.pack(len(header_bytes)), header_bytes,
+                     *blobs.values()])
+
+def decode(message):
+    """Returns the (header, blobs) of a message from encode()."""
+    (size,) = _HEADER.unpack_from(message)
+    offset = _HEADER.size + size
+    header = json.loads(message[_HEADER.size:offset])
+    blobs = {}
+    for name, blob_size in header.pop('blobs'):
+        blobs[name] = message[offset:offset + blob_size]
+        offset += blob_size
+
+    return header, blobs
+
+class Transport(ABC):
+    """Carries messages from the coordinator to workers and back."""
+
+    @abstractmethod
+    def submit(self, message):
+        """Hands message to a worker, returning its reply.  Blocks until
+            the worker is done.  Called from several threads at once.
+        """
+
+    @abstractmethod
+    def serve(self, handler):
+        """Calls handler with every message for this worker, replying with
+            what it returns, until interrupted.
+        """
+
+class _ReusableTCPServer(socketserver.TCPServer):
+    # A restarted worker can listen again without waiting out TIME_WAIT.
+    allow_reuse_address = True
+
+class SocketTransport(Transport):
+    """One connection per build to workers listening on a socket.
+
+        Arguments, required:
+            addresses: 'host:port', or the path of a Unix socket, of every
+                worker.  Each worker builds one lib at a time.  serve() listens
+                on the first one.
+
+        Arguments, optional:
+            connect_timeout: Seconds to wait for a worker to accept, and for
+                any message to make progress.
+            timeout: Seconds to wait for a worker to reply, i.e. to build.
+    """
+
+    def __init__(self, addresses, connect_timeout=30.0, timeout=6 * 3600.0):
+        self.addresses = list(addresses)
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self._free = queue.Queue()
+        for address in self.addresses:
+            self._free.put(address)
+
+    @staticmethod
+    def _family(address):
+        host, sep, port = address.rpartition(':')
+        if sep and port.isdigit():
+            return socket.AF_INET, (host or 'localhost', int(port))
+
+        return socket.AF_UNIX, address
+
+    @staticmethod
+    def _send(sock, message):
+        sock.sendall(_HEADER.pack(len(message)))
+        sock.sendall(message)
+
+    @staticmethod
+    def _recv(sock_file):
+        size_bytes = sock_file.read(_HEADER.size)
+        if len(size_bytes) != _HEADER.size:
+            raise ConnectionError('Connection closed')
+
+        (size,) = _HEADER.unpack(size_bytes)
+        message = sock_file.read(size)
+        if len(message) != size:
+            raise ConnectionError('Connection closed')
+
+        return message
+
+    def submit(self, message):
+        address = self._free.get()
+        try:
+            family, sock_addr = self._family(address)
+            with socket.socket(family, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.connect_timeout)
+                sock.connect(sock_addr)
+                self._send(sock, message)
+                sock.settimeout(self.timeout)
+                with sock.makefile('rb') as sock_file:
+                    return self._recv(sock_file)
+        finally:
+            self._free.put(address)
+
+    def serve(self, handler):
+        family, sock_addr = self._family(self.addresses[0])
+        transport = self
+
+        class _Handler(socketserver.StreamRequestHandler):
+            # A peer that stalls mid message doesn't hold up the worker.
+            timeout = transport.connect_timeout
+
+            def handle(self):
+                reply = handler(transport._recv(self.rfile))
+                transport._send(self.request, reply)
+
+        if family == socket.AF_UNIX:
+            if os.path.exists(sock_addr):
+                os.remove(sock_addr)
+
+            server = socketserver.UnixStreamServer(sock_addr, _Handler)
+        else:
+            server = _ReusableTCPServer(sock_addr, _Handler)
+
+        logging.info("Worker listening on '%s'", self.addresses[0])
+        with server:
+            server.serve_forever()
+
+class DirectoryTransport(Transport):
+    """Jobs and results exchanged through a directory every host can see,
+        e.g. over NFS.
+
+        Jobs are claimed by renaming them, so any number of workers can
+            share the directory.  Workers touch the jobs they claimed every
+            stale / 4 seconds while building, and claims not touched for
+            stale seconds, e.g. of a worker that died, are put back for
+            another worker to take.
+
+        Arguments, required:
+            root: The shared directory.
+
+        Arguments, optional:
+            poll: Seconds between checks for jobs and results.
+            stale: Seconds after which a claim is taken to be abandoned.
+            timeout: Seconds submit() waits for a result before giving up.
+    """
+
+    def __init__(self, root, poll=0.5, stale=120.0, timeout=6 * 3600.0):
+        self.root = Path(root)
+        self.poll = poll
+        self.stale = stale
+        self.timeout = timeout
+        for sub in ('jobs', 'claimed', 'results'):
+            os.makedirs(self.root / sub, exist_ok=True)
+
+    def _write(self, path, message):
+        fd, tmp_str = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(message)
+
+        os.replace(tmp_str, path)
+
+    def submit(self, message):
+        # Named so that sorting the names sorts the jobs oldest first.
+        job_id = f'{time.time_ns():020d}-{uuid.uuid4().hex:s}'
+        job_path = self.root / 'jobs' / job_id
+        claimed = self.root / 'claimed' / job_id
+        result_path = self.root / 'results' / job_id
+        self._write(job_path, message)
+        deadline = time.monotonic() + self.timeout
+        while not result_path.exists():
+            if time.monotonic() > deadline:
+                for path in (job_path, claimed):
+                    path.unlink(missing_ok=True)
+
+                raise TimeoutError(f'No result for job {job_id:s} after '
+                                   f'{self.timeout:.0f}s')
+
+            self._requeue_stale(claimed, job_path)
+            time.sleep(self.poll)
+
+        reply = result_path.read_bytes()
+        os.remove(result_path)
+        return reply
+
+    def _requeue_stale(self, claimed, job_path):
+        try:
+            age = time.time() - claimed.stat().st_mtime
+        except FileNotFoundError:
+            return
+
+        if age > self.stale:
+            logging.warning("Job '%s' was abandoned by its worker, "
+                            'requeueing it', claimed.name)
+            try:
+                os.rename(claimed, job_path)
+            except FileNotFoundError:
+                pass
+
+    def _heartbeat(self, claimed, done):
+        while not done.wait(self.stale / 4):
+            try:
+                os.utime(claimed)
+            except FileNotFoundError:
+                return
+
+    def _claim(self):
+        for job_path in sorted(Path(self.root, 'jobs').iterdir()):
+            claimed = self.root / 'claimed' / job_path.name
+            try:
+                os.rename(job_path, claimed)
+            except FileNotFoundError:
+                # Another worker got it first.
+                continue
+
+            # Claimed now, not when it was queued.
+            os.utime(claimed)
+            return claimed
+
+        return None
+
+    def serve(self, handler):
+        logging.info("Worker waiting for jobs in '%s'", self.root)
+        while True:
+            claimed = self._claim()
+            if claimed is None:
+                time.sleep(self.poll)
+                continue
+
+            done = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat,
+                                         args=(claimed, done),
+                                         daemon=True)
+            heartbeat.start()
+            try:
+                reply = handler(claimed.read_bytes())
+            finally:
+                done.set()
+                heartbeat.join()
+
+            self._write(self.root / 'results' / claimed.name, reply)
+            claimed.unlink(missing_ok=True)
+
+def get_transport(addresses):
+    """Returns the Transport for addresses.  'dir:<path>' is a
+        DirectoryTransport, anything else a SocketTransport.
+    """
+    if len(addresses) == 1 and addresses[0].startswith('dir:'):
+        return DirectoryTransport(addresses[0][len('dir:'):])
+
+    return SocketTransport(addresses)
+
+def _pack(src_str):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+        for child in sorted(os.listdir(src_str)):
+            tar.add(os.path.join(src_str, child), arcname=child)
+
+    return buf.getvalue()
+
+def _unpack(archive, dest_str):
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        extract_all(tar, dest_str)
+
+def _relocate(root_str, old_str, new_str):
+    """Replaces old_str with new_str in the text files under root_str, e.g.
+        pkg-config and libtool files, so what's installed there can be used
+        from another prefix.  Binaries are left as they are.
+    """
+    old, new = old_str.encode(), new_str.encode()
+    for dir_str, _, files in os.walk(root_str):
+        for file_str in files:
+            path_str = os.path.join(dir_str, file_str)
+            if os.path.islink(path_str):
+                continue
+
+            with open(path_str, 'rb') as in_file:
+                data = in_file.read()
+
+            if old in data and b'\0' not in data:
+                with open(path_str, 'wb') as out_file:
+                    out_file.write(data.replace(old, new))
+
+class BuildWorker:
+    """Builds the BuildSpecs it's sent, replying with a BuildResult.
+
+        Every build gets a temporary prefix of its own, where the
+            dependencies are installed, relocated from the coordinator's
+            prefix, and the lib is built for.  What the lib installs is
+            relocated to the coordinator's prefix before it's sent back.
+            Nothing is ever written to the coordinator's prefix on the
+            worker's host, which may well be the worker's own.
+
+        Arguments, required:
+            lib_builder: builder.LibBuilder whose repo_prefix the sources are
+                kept in.  Its prefix is ignored.
+            repos: registry.LibraryRegistry the libs are looked up in.
+
+        Arguments, optional:
+            tarballs: tarball.TarballFetcher RepoTool.CURL_TOOL libs are
+                fetched with.  They can't be built without one.
+    """
+
+    def __init__(self, lib_builder, repos, tarballs=None):
+        self.lib_builder = lib_builder
+        self.repos = repos
+        self.tarballs = tarballs
+        self.name = socket.gethostname()
+
+    def _fail(self, spec, msg):
+        logging.error("Building '%s': %s", spec.name, msg)
+        return BuildResult(spec.name, False, msg, b'', self.name)
+
+    def _run(self, commands, cwd):
+        for command_str in commands:
+            res = runner.run(command_str, cwd=cwd,
+                             tail=self.lib_builder.log_tail)
+            if not res.success:
+                return res
+
+        return None
+
+    def _checkout(self, lib, spec):
+        """Returns a failed RunResult, or None once the sources are at the
+            revision of spec.
+        """
+        src_path = self.lib_builder.source_dir(lib)
+        if lib.repo_tool == RepoTool.CURL_TOOL:
+            return self._fetch_tarball(lib, spec, src_path)
+
+        if not src_path.is_dir():
+            os.makedirs(src_path.parent, exist_ok=True)
+            failed = self._run(lib.get_download_commands(src_path),
+                               src_path.parent)
+            if failed:
+                return failed
+
+        if spec.revision is None:
+            return self._run(lib.get_update_commands(), src_path)
+
+        if lib.get_revision(src_path) == spec.revision:
+            return None
+
+        return self._run(lib.get_checkout_commands(spec.revision) or [],
+                         src_path)
+
+    def _fetch_tarball(self, lib, spec, src_path):
+        if self.tarballs is None:
+            return runner.RunResult(lib.repo_url, 1, 0.0,
+                                    'no tarball fetcher to fetch it with')
+
+        try:
+            if (not src_path.is_dir()
+                    or (spec.revision
+                        and lib.get_revision(src_path) != spec.revision)):
+                self.tarballs.fetch(lib.repo_url, src_path,
+                                    spec.revision or lib.sha256)
+            elif spec.revision is None:
+                self.tarballs.update(lib.repo_url, src_path, lib.sha256)
+        except (OSError, ChecksumError) as emsg:
+            return runner.RunResult(lib.repo_url, 1, 0.0, str(emsg))
+
+        return None
+
+    def build(self, spec, depends):
+        """Builds spec, with the archives of its depends installed first.
+
+            Returns a BuildResult.
+        """
+        if spec.name not in self.repos:
+            return self._fail(spec, f'{spec.name!r} is not a known library')
+
+        missing = [n for n in spec.depends if n not in depends]
+        if missing and PREFIX_BLOB not in depends:
+            return self._fail(spec, f"dependencies {', '.join(missing):s} "
+                                    'were not sent')
+
+        job_str = tempfile.mkdtemp(prefix=f'ffscript-{spec.name:s}-')
+        try:
+            lib_builder = copy.copy(self.lib_builder)
+            lib_builder.prefix = os.path.join(job_str, 'prefix')
+            return self._build(spec, depends, lib_builder,
+                               os.path.join(job_str, 'stage'))
+        finally:
+            shutil.rmtree(job_str, ignore_errors=True)
+
+    def _build(self, spec, depends, lib_builder, stage_str):
+        env = lib_builder.get_env()
+        if toolchain.toolchain_id(env) != spec.toolchain:
+            return self._fail(spec, 'toolchain differs from the coordinator '
+                                    f'({toolchain.compiler_identity(env):s})')
+
+        lib = self.repos[spec.name]
+        failed = self._checkout(lib, spec)
+        if failed:
+            return self._fail(spec, f'fetching sources failed:\n'
+                                    f'{failed.output:s}')
+
+        prefix_str = lib_builder.prefix
+        os.makedirs(prefix_str)
+        if PREFIX_BLOB in depends:
+            _unpack(depends[PREFIX_BLOB], prefix_str)
+
+        for name in spec.depends:
+            if name in depends:
+                _unpack(depends[name], prefix_str)
+
+        _relocate(prefix_str, spec.prefix, prefix_str)
+        logging.info("Building '%s' for the coordinator...", spec.name)
+        config_str = spec.config.replace(spec.prefix, prefix_str)
+        if not lib_builder.run_steps(
+                spec.name,
+                [BuildStep('configure', f'./{config_str:s}'),
+                 BuildStep('make', 'make'),
+                 BuildStep('install', f'make install DESTDIR={stage_str:s}')],
+                lib_builder.source_dir(lib)):
+            return self._fail(spec, 'build failed, see the worker log')
+
+        staged_str = os.path.join(stage_str, prefix_str.lstrip(os.sep))
+        if not os.path.isdir(staged_str):
+            return self._fail(spec, "didn't install anything")
+
+        _relocate(staged_str, prefix_str, spec.prefix)
+        return BuildResult(spec.name, True, '', _pack(staged_str), self.name)
+
+    def handle(self, message):
+        header, blobs = decode(message)
+        spec = BuildSpec(**header['spec'])
+        spec = spec._replace(depends=tuple(spec.depends))
+        res = self.build(spec, blobs)
+        return encode({'result': {'name': res.name,
+                                  'success': res.success,
+                                  'output': res.output,
+                                  'worker': res.worker}},
+                      {'archive': res.archive})
+
+    def serve(self, transport):
+        transport.serve(self.handle)
+
+class RemoteBuilder:
+    """Builds libs on workers instead of locally, then installs what they
+        return into the prefix of lib_builder.
+
+        Workers are sent the archives of every lib the lib depends on,
+            directly or not.  Those only exist for libs workers built in
+            this run; when a dependency was installed before, the whole
+            prefix is packed and sent along instead.  A lib depending on
+            one that isn't installed at all fails.
+
+        Arguments, required:
+            lib_builder: builder.LibBuilder that would otherwise build the
+                libs.
+            transport: Transport the workers are reached through.
+            repos: registry.LibraryRegistry the dependencies are looked up
+                in.
+    """
+
+    def __init__(self, lib_builder, transport, repos):
+        self.lib_builder = lib_builder
+        self.transport = transport
+        self.repos = repos
+        # Archives of the libs built so far, sent along to the libs that
+        #   depend on them.
+        self._archives = {}
+        # The prefix packed for PREFIX_BLOB, once needed.
+        self._prefix_archive = None
+        self._lock = threading.Lock()
+
+    def get_depends(self, lib):
+        """Returns the names of every lib lib depends on, directly or not,
+            dependencies first.
+        """
+        found = []
+
+        def visit(name):
+            if name in found:
+                return
+
+            for dep in self.repos.metadata(name).get('depends', ()):
+                visit(dep)
+
+            found.append(name)
+
+        for name in lib.depends:
+            visit(name)
+
+        return tuple(found)
+
+    def get_spec(self, lib):
+        src_path = self.lib_builder.source_dir(lib)
+        revision = None
+        if src_path.is_dir():
+            revision = lib.get_revision(src_path)
+
+        return BuildSpec(lib.name,
+                         revision,
+                         lib.get_config(prefix=self.lib_builder.prefix),
+                         toolchain.toolchain_id(self.lib_builder.get_env()),
+                         self.lib_builder.prefix,
+                         self.get_depends(lib))
+
+    def _pack_prefix(self):
+        with self._lock:
+            if self._prefix_archive is None:
+                logging.info('Packing %s for the workers...',
+                             self.lib_builder.prefix)
+                self._prefix_archive = _pack(self.lib_builder.prefix)
+
+            return self._prefix_archive
+
+    def build(self, lib):
+        """Builds lib on a worker and installs it, returning True on
+            success.
+        """
+        spec = self.get_spec(lib)
+        with self._lock:
+            depends = {n: self._archives[n]
+                       for n in spec.depends if n in self._archives}
+
+        missing = [n for n in spec.depends if n not in depends]
+        if missing:
+            installed = builder.read_provenance(self.lib_builder.prefix)
+            absent = [n for n in missing if n not in installed]
+            if absent:
+                logging.error("'%s' depends on %s, which isn't installed",
+                              lib.name, ', '.join(absent))
+                return False
+
+            depends[PREFIX_BLOB] = self._pack_prefix()
+
+        logging.info("Sending '%s' at %s to a worker...", lib.name,
+                     spec.revision or 'the latest revision')
+        try:
+            header, blobs = decode(self.transport.submit(
+                encode({'spec': spec._asdict()}, depends)))
+        except OSError as emsg:
+            logging.error("Couldn't reach a worker for '%s': %s",
+                          lib.name, emsg)
+            return False
+
+        res = BuildResult(archive=blobs['archive'], **header['result'])
+        if not res.success:
+            logging.error("'%s' failed on '%s': %s", lib.name, res.worker,
+                          res.output)
+            return False
+
+        _unpack(res.archive, self.lib_builder.prefix)
+        self.lib_builder.record_install(lib.name, spec.revision,
+                                        f'./{spec.config:s}',
+                                        worker=res.worker)
+        with self._lock:
+            self._archives[lib.name] = res.archive
+
+        logging.info("Installed '%s' built by '%s' (%d KiB)", lib.name,
+                     res.worker, len(res.archive) // 1024)
+        return True
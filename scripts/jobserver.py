@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""GNU Make Jobserver"""
+
+import fcntl
+import logging
+import os
+import select
+import sys
+import termios
+import threading
+
+def available_memory():
+    """Returns MemAvailable in bytes, or None if it can't be read."""
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    return None
+
+def cpu_count():
+    """Returns the number of CPUs we may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def allocate_jobs(max_jobs=None, job_memory=1 << 30, running=0):
+    """Returns how many jobs fit the idle CPUs and available memory.
+
+        Arguments, optional:
+            max_jobs: Upper limit, defaults to the number of CPUs.
+            job_memory: Bytes a single compile job is expected to need.
+            running: Jobs of ours already running.  Their load and memory
+                are ours to reuse, not pressure from other programs.
+    """
+    cpus = cpu_count()
+    jobs = cpus if max_jobs is None else max_jobs
+    try:
+        # CPUs other programs are keeping busy aren't ours to use.
+        jobs = min(jobs, cpus - max(0, int(os.getloadavg()[0]) - running))
+    except OSError:
+        pass
+
+    mem = available_memory()
+    if mem is not None and job_memory:
+        jobs = min(jobs, (mem + running * job_memory) // job_memory)
+
+    return max(1, jobs)
+
+class JobServer:
+    """Shares a pool of job slots between every make we run, and every make
+        they run, through the GNU make jobserver protocol.
+
+        A pipe is filled with one token per slot.  Every make is given
+            '-j' and the pipe in MAKEFLAGS, and reads a token before starting
+            a job besides its first, writing it back when the job is done.
+            That first job is a slot too, so a token is taken out of the
+            pipe for it before each top level make starts (See acquire()),
+            however many run at once.
+
+        While running, memory and load are checked every interval seconds.
+            When fewer jobs would fit than there are slots, tokens are taken
+            out of the pipe as they come back, and put back once the
+            pressure is gone.  Our own running jobs don't count as pressure,
+            and the pool moves by at most a quarter of the slots per check,
+            so it doesn't swing with the load it causes itself.
+
+        Arguments, required:
+            jobs: Number of job slots.
+
+        Arguments, optional:
+            job_memory: Bytes a single compile job is expected to need.
+            interval: Seconds between pressure checks, None to never throttle.
+    """
+
+    def __init__(self, jobs, job_memory=1 << 30, interval=2.0):
+        self.jobs = max(1, jobs)
+        self.job_memory = job_memory
+        self.interval = interval
+        self._read_fd, self._write_fd = os.pipe()
+        os.write(self._write_fd, b'+' * self.jobs)
+        # Tokens taken out of the pool because of memory or load pressure.
+        self._held = 0
+        # The pipe opened again, as a file of its own, for the monitor to
+        #   read tokens without blocking.  O_NONBLOCK on the read end, or a
+        #   dup of it, would be seen by every make sharing it too.
+        try:
+            self._poll_fd = os.open(f'/proc/self/fd/{self._read_fd:d}',
+                                    os.O_RDONLY | os.O_NONBLOCK)
+        except OSError:
+            logging.debug("Can't read the jobserver without blocking, not "
+                          'throttling')
+            self._poll_fd = None
+            self.interval = None
+
+        self._stop = threading.Event()
+        self._monitor = None
+
+    @property
+    def fds(self):
+        """File descriptors children need to inherit, see runner.run()."""
+        return (self._read_fd, self._write_fd)
+
+    @property
+    def held(self):
+        return self._held
+
+    def env(self, env):
+        """Returns a copy of env that makes make use this jobserver."""
+        env = dict(env)
+        # Older makes only understand --jobserver-fds.
+        env['MAKEFLAGS'] = (f'-j{self.jobs:d} '
+                            f'--jobserver-auth={self._read_fd:d},'
+                            f'{self._write_fd:d} '
+                            f'--jobserver-fds={self._read_fd:d},'
+                            f'{self._write_fd:d}')
+        return env
+
+    def acquire(self):
+        """Takes the token of the job a top level make runs without one,
+            waiting for a slot to be free.  Give it back with release() once
+            the make is done.
+        """
+        while True:
+            select.select([self._read_fd], [], [])
+            try:
+                if os.read(self._read_fd, 1):
+                    return
+            except BlockingIOError:
+                # Someone else got the token first.  make may also have
+                #   left the pipe non-blocking for everyone sharing it.
+                pass
+
+    def release(self):
+        os.write(self._write_fd, b'+')
+
+    def _take_token(self):
+        # Don't wait for a token that might never be handed back, the
+        #   pressure might be gone by the next check.
+        try:
+            return bool(os.read(self._poll_fd, 1))
+        except BlockingIOError:
+            return False
+
+    def running(self):
+        """Returns the number of our jobs running."""
+        free = fcntl.ioctl(self._read_fd, termios.FIONREAD, b'\0' * 4)
+        return max(0, self.jobs - self._held
+                   - int.from_bytes(free, sys.byteorder))
+
+    def adjust(self):
+        """Takes or returns tokens so the pool matches the current pressure.
+
+            Returns the number of slots currently available.
+        """
+        wanted = allocate_jobs(self.jobs, self.job_memory, self.running())
+        step = max(1, self.jobs // 4)
+        hold = min(max(self.jobs - wanted, self._held - step),
+                   self._held + step)
+        while self._held < hold and self._take_token():
+            self._held += 1
+
+        if self._held > hold:
+            os.write(self._write_fd, b'+' * (self._held - hold))
+            self._held = hold
+
+        return self.jobs - self._held
+
+    def _run_monitor(self):
+        slots = self.jobs
+        while not self._stop.wait(self.interval):
+            new_slots = self.adjust()
+            if new_slots != slots:
+                logging.info('Make job slots: %d of %d (memory and load)',
+                             new_slots, self.jobs)
+                slots = new_slots
+
+    def start(self):
+        if self.interval is not None and self._monitor is None:
+            self._monitor = threading.Thread(target=self._run_monitor,
+                                             name='jobserver',
+                                             daemon=True)
+            self._monitor.start()
+
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._monitor is not None:
+            self._monitor.join()
+            self._monitor = None
+
+        if self._poll_fd is not None:
+            os.close(self._poll_fd)
+
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -11,81 +11,99 @@ import os.path
 import sys
 
 #sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
-from repobase import RepoTool, RepoBase, Options
+from repobase import RepoTool, RepoBase
+
+# Read by registry.LibraryRegistry without importing this module, so this
+#   must stay a literal.
+LIBRARY = {
+    'name': 'libmp3lame',
+    'class': 'LibMP3Lame',
+    'description': 'MP3 encoding',
+    'switch': '--enable-libmp3lame',
+    'depends': (),
+    # FFmpeg features this lib enables, see resolver.FeatureResolver.
+    'provides': ('mp3-encode',),
+    'license': 'lgpl'
+}
 
 class LibMP3Lame(RepoBase):
+    autoconf = True
+    out_of_tree = True
     _KWARGS_DEFAULT = {'prefix': '/usr/local', 'exec-prefix': '/usr/local'}
 
     def __init__(self):
-        super().__init__('libmp3lame',
+        super().__init__(LIBRARY['name'],
                          'configure --enable-shared --disable-static '
                          '--enable-nasm --disable-rpath --disable-gtktest '
                          "--with-pic='pic' ",
                          RepoTool.SVN_TOOL,
                          'https://svn.code.sf.net/p/lame/svn/trunk/lame',
-                         '--enable-libmp3lame')
-        Options.add_option(
+                         LIBRARY['switch'],
+                         LIBRARY['depends'],
+                         LIBRARY['license'])
+        self.options.add_option(
             'help', aliases='h', values=(None, 'short', 'recursive'))
 
-        Options.add_option('version', aliases='V')
-        Options.add_option('quiet', aliases=('q', 'silent'))
-        Options.add_option('cache-file', kwarg=True)
-        Options.add_option('config-cache', aliases='C')
-        Options.add_option('no-create', aliases='n')
-        Options.add_option('srcdir', aliases='n', kwarg=True)
+        self.options.add_option('version', aliases='V')
+        self.options.add_option('quiet', aliases=('q', 'silent'))
+        self.options.add_option('cache-file', kwarg=True)
+        self.options.add_option('config-cache', aliases='C')
+        self.options.add_option('no-create', aliases='n')
+        self.options.add_option('srcdir', kwarg=True)
 
         for dirs in ('prefix', 'exec-prefix'):
-            Options.add_option(dirs, kwarg=True)
+            self.options.add_option(dirs, kwarg=True)
 
         for dirs in ('bindir', 'sbindir', 'libedxecdir', 'sysconfidir',
                      'sharedstatedir', 'localstatedir', 'libdir', 'includedir',
                      'oldincludedir', 'datarootdir', 'datadir', 'infodir',
                      'localdir', 'mandir', 'docdir', 'htmldir', 'dvidir',
                      'pdfdir', 'psdir'):
-            Options.add_option(dirs, kwarg=True)
+            self.options.add_option(dirs, kwarg=True)
 
         for name in ('program-prefix', 'program-suffix',
                      'program-transform-name'):
-            Options.add_option(name, kwarg=True)
+            self.options.add_option(name, kwarg=True)
 
-        Options.add_option('build', kwarg=True)
+        self.options.add_option('build', kwarg=True)
 
-        Options.add_option('host', kwarg=True, values=('x86_64-w64-mingw32-'))
-        Options.add_option('disable-option-checking')
+        self.options.add_option(
+            'host', kwarg=True, values=('x86_64-w64-mingw32-'))
+        self.options.add_option('disable-option-checking')
 
         for feat in ('silent-rules', 'maintainer-mode', 'dependency-tracking',
                      'shared', 'static', 'fast-install', 'libtool-lock',
                      'largefile', 'nasm', 'rpath', 'cpml', 'gtktest', 'efence',
                      'analyzer-hooks', 'decoder', 'frontend', 'mp3x', 'mp3rtp',
                      'dynamic-frontends'):
-            Options.add_option(f'disable-{feat:s}')
-            Options.add_option(f'enable-{feat:s}',
-                               kwarg=True,
-                               values=(None, 'yes', 'no'))
+            self.options.add_option(f'disable-{feat:s}')
+            self.options.add_option(f'enable-{feat:s}',
+                                    kwarg=True,
+                                    values=(None, 'yes', 'no'))
 
-        Options.add_option(
+        self.options.add_option(
             'enable-expopt', kwarg=True, values=('no', 'full', 'norm'))
-        Options.add_option(
+        self.options.add_option(
             'enable-debug', kwarg=True, values=('no', 'alot', 'norm'))
-        Options.add_option(
+        self.options.add_option(
             'with-pix', kwarg=True, values=('both', 'pic', 'non-pic'))
 
-        Options.add_option('with-aix-soname',
-                           kwarg=True,
-                           values=(None, 'aix', 'svr4', 'both'))
+        self.options.add_option('with-aix-soname',
+                                kwarg=True,
+                                values=(None, 'aix', 'svr4', 'both'))
 
-        Options.add_option(
+        self.options.add_option(
             'with-gnu-ld', kwarg=True, values=(None, 'yes', 'no'))
 
-        Options.add_option('without-gnu-ld')
-        Options.add_option('with-sysroot', kwarg=True)
-        Options.add_option('with-libiconv-prefix', kwarg=True)
-        Options.add_option('without-libiconv-prefix')
+        self.options.add_option('without-gnu-ld')
+        self.options.add_option('with-sysroot', kwarg=True)
+        self.options.add_option('with-libiconv-prefix', kwarg=True)
+        self.options.add_option('without-libiconv-prefix')
 
         for prfx in ('gtk', 'gtk-exec'):
-            Options.add_option(f'with-{prfx:s}-prefix', kwarg=True)
+            self.options.add_option(f'with-{prfx:s}-prefix', kwarg=True)
 
-        Options.add_option(
+        self.options.add_option(
             'with-fileio', kwarg=True, values=('lame', 'sndfile'))
 
     def get_repo_download(self):
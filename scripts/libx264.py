@@ -9,42 +9,59 @@ __status__ = "Development"
 import logging
 import sys
 
-from repobase import RepoTool, RepoBase, Options
+from repobase import RepoTool, RepoBase
+
+# Read by registry.LibraryRegistry without importing this module, so this
+#   must stay a literal.
+LIBRARY = {
+    'name': 'libx264',
+    'class': 'Libx264',
+    'description': 'H.264 encoding',
+    'switch': '--enable-libx264',
+    'depends': (),
+    # FFmpeg features this lib enables, see resolver.FeatureResolver.
+    'provides': ('h264-encode',),
+    'license': 'gpl'
+}
 
 class Libx264(RepoBase):
+    out_of_tree = True
 
     def __init__(self):
-        super().__init__('libx264',
+        super().__init__(LIBRARY['name'],
+                         'configure --enable-static --enable-pic ',
                          RepoTool.GIT_TOOL,
                          'https://git.videolan.org/git/x264.git',
-                         '--enable-libx264')
-        Options.add_option('help', aliases='h')
+                         LIBRARY['switch'],
+                         LIBRARY['depends'],
+                         LIBRARY['license'])
+        self.options.add_option('help', aliases='h')
         for dirs in ('', 'exec-'):
-            Options.add_option(f'{dirs:s}prefix', kwarg=True)
+            self.options.add_option(f'{dirs:s}prefix', kwarg=True)
 
-        for dirs in ('bin', 'lib', 'included'):
-            Options.add_option(f'{dirs:s}dir', kwarg=True)
+        for dirs in ('bin', 'lib', 'include'):
+            self.options.add_option(f'{dirs:s}dir', kwarg=True)
 
-        for flags in ('as', 'cf', 'ld', 'rc'):
-            Options.add_option(f'extra-{flags:s}flags', kwarg=True)
+        for flags in ('as', 'c', 'ld', 'rc'):
+            self.options.add_option(f'extra-{flags:s}flags', kwarg=True)
 
         for feat in ('cli', 'opencl', 'gpl', 'thread', 'win32thread',
                      'interlaced', 'asm', 'avs', 'swscale', 'lavf', 'ffms',
                      'gpac', 'lsmash'):
-            Options.add_option(f'disable-{feat}')
+            self.options.add_option(f'disable-{feat}')
 
         for feat in ('shared', 'static', 'lto', 'debug', 'gprof', 'strip',
                      'pic'):
-            Options.add_option(f'enable-{feat}')
+            self.options.add_option(f'enable-{feat}')
 
-        Options.add_option('system-libx264')
-        Options.add_option('bit-depth', kwarg=True, values=('all', 8, 10))
-        Options.add_option('chroma-format',
-                           kwarg=True,
-                           values=('all', 420, 422, 444))
+        self.options.add_option('system-libx264')
+        self.options.add_option('bit-depth', kwarg=True, values=('all', 8, 10))
+        self.options.add_option('chroma-format',
+                                kwarg=True,
+                                values=('all', 420, 422, 444))
 
         for v in ('host', 'cross-prefix', 'sysroot'):
-            Options.add_option(v, kwarg=True)
+            self.options.add_option(v, kwarg=True)
 
     def get_repo_download(self):
         pass
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Pinned Revision Lockfile"""
+
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import NamedTuple
+
+class LockEntry(NamedTuple):
+    # RepoTool value, e.g. 'git clone'.
+    tool: str
+    url: str
+    # Commit, svn revision, hg changeset or, for tarballs, SHA-256.
+    revision: str
+
+class Lockfile:
+    """Revision every lib is pinned to, kept as JSON in path.
+
+        Entries are only trusted for the repo_url they were pinned from, so
+            pointing a lib at another repo doesn't check out a revision that
+            doesn't exist there.
+
+        Arguments, required:
+            path: JSON file the revisions are kept in.  Doesn't need to exist
+                until save().
+    """
+
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        try:
+            with open(self.path) as lock_file:
+                data = json.load(lock_file)
+        except FileNotFoundError:
+            return
+
+        if data.get('version') != self.VERSION:
+            raise ValueError(f"'{self.path}' is lockfile version "
+                             f"{data.get('version')}, expected "
+                             f'{self.VERSION:d}')
+
+        self.entries = {name: LockEntry(**entry)
+                        for name, entry in data['repos'].items()}
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def revision(self, repo):
+        """Returns the revision repo is pinned to, or None if it isn't."""
+        entry = self.entries.get(repo.name)
+        if entry is None:
+            return None
+
+        if entry.url != repo.repo_url:
+            logging.warning("'%s' was pinned from '%s', not '%s'.  Ignoring "
+                            'its pin.', repo.name, entry.url, repo.repo_url)
+            return None
+
+        return entry.revision
+
+    def pin(self, repo, revision):
+        """Pins repo to revision, returning the revision it was pinned to
+            before, if any.
+        """
+        old = self.entries.get(repo.name)
+        self.entries[repo.name] = LockEntry(repo.repo_tool.value,
+                                            repo.repo_url,
+                                            revision)
+        return old.revision if old else None
+
+    def save(self):
+        data = {'version': self.VERSION,
+                'repos': {name: entry._asdict()
+                          for name, entry in sorted(self.entries.items())}}
+        os.makedirs(self.path.parent, exist_ok=True)
+        fd, tmp_str = tempfile.mkstemp(dir=self.path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'w') as lock_file:
+            json.dump(data, lock_file, indent=1)
+            lock_file.write('\n')
+
+        os.replace(tmp_str, self.path)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""Local VCS Mirror Store"""
+
+import hashlib
+import logging
+import os
+import shlex
+import threading
+from pathlib import Path
+
+import runner
+from repobase import RepoTool
+
+class MirrorStore:
+    """Keeps one local mirror per repo_url that checkouts can borrow from.
+
+        git repos are kept as bare '--mirror' clones, hg repos as clones
+            without a working directory.  svn has no local object store to
+            share, so svn repos are never mirrored.
+
+        Checkouts of any revision can be made from a mirror without copying
+            its objects (See worktree_commands()), as git worktrees and hg
+            shares.
+    """
+
+    _REPOTOOL_TO_MIRROR_CMD = {
+        RepoTool.GIT_TOOL: 'git clone --mirror {url} {path}',
+        RepoTool.HG_TOOL: 'hg clone --noupdate {url} {path}'
+    }
+
+    _REPOTOOL_TO_REFRESH_CMD = {
+        RepoTool.GIT_TOOL: 'git --git-dir={path} remote update --prune',
+        RepoTool.HG_TOOL: 'hg pull -R {path}'
+    }
+
+    # Commands exiting with 0 if the mirror has revision {rev}.
+    _REPOTOOL_TO_HAS_CMD = {
+        RepoTool.GIT_TOOL: 'git --git-dir={path} cat-file -e {rev}^{{commit}}',
+        RepoTool.HG_TOOL: 'hg -R {path} log --quiet -r {rev} --template .'
+    }
+
+    # Commands creating a checkout of {rev} in {dest} using the objects of
+    #   the mirror.  Worktrees whose directory was removed are forgotten
+    #   first, or git refuses to add them again.
+    _REPOTOOL_TO_WORKTREE_CMD = {
+        RepoTool.GIT_TOOL: ['git --git-dir={path} worktree prune',
+                            'git --git-dir={path} worktree add --quiet '
+                            '--detach --force {dest} {rev}'],
+        RepoTool.HG_TOOL: ['hg --config extensions.share= share --noupdate '
+                           '{path} {dest}',
+                           'hg -R {dest} update --quiet -r {rev}']
+    }
+
+    # Commands, run in a checkout made by worktree_commands(), moving it to
+    #   {rev}.  Nothing is fetched, the revision is already in the mirror.
+    _REPOTOOL_TO_SWITCH_CMD = {
+        RepoTool.GIT_TOOL: ['git checkout --quiet --detach {rev}'],
+        RepoTool.HG_TOOL: ['hg update --quiet -r {rev}']
+    }
+
+    # Commands, run in a checkout, bringing it up to date with the mirror
+    #   in {path}.  Only the mirror talks to upstream, see sync().
+    _REPOTOOL_TO_UPDATE_CMD = {
+        RepoTool.GIT_TOOL: ['git pull --quiet {path} HEAD'],
+        RepoTool.HG_TOOL: ['hg pull --quiet {path}', 'hg update']
+    }
+
+    # File that only exists in checkouts made by worktree_commands().
+    _REPOTOOL_TO_SHARED_MARKER = {
+        RepoTool.GIT_TOOL: '.git',
+        RepoTool.HG_TOOL: os.path.join('.hg', 'sharedpath')
+    }
+
+    def __init__(self, root, timeout=None):
+        self.root = Path(root)
+        self.timeout = timeout
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def has_mirror(self, repo):
+        return repo.repo_tool in self._REPOTOOL_TO_MIRROR_CMD
+
+    def mirror_path(self, repo):
+        url_hash = hashlib.sha1(repo.repo_url.encode()).hexdigest()[:12]
+        suffix = '.git' if repo.repo_tool == RepoTool.GIT_TOOL else '.hg'
+        return self.root / f'{repo.name:s}-{url_hash:s}{suffix:s}'
+
+    def _lock(self, path):
+        with self._locks_lock:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def sync(self, repo):
+        """Creates or refreshes the mirror of repo.
+
+            Returns the path of the mirror, or None if repo can't be
+                mirrored or syncing failed.
+        """
+        if not self.has_mirror(repo):
+            return None
+
+        path = self.mirror_path(repo)
+        with self._lock(path):
+            if path.is_dir():
+                logging.debug("Refreshing mirror of '%s'", repo.name)
+                command_str = self._REPOTOOL_TO_REFRESH_CMD[repo.repo_tool]
+            else:
+                logging.info("Creating mirror of '%s' in '%s'",
+                             repo.name, path)
+                os.makedirs(self.root, exist_ok=True)
+                command_str = self._REPOTOOL_TO_MIRROR_CMD[repo.repo_tool]
+
+            res = runner.run(command_str.format(
+                url=shlex.quote(repo.repo_url), path=shlex.quote(str(path))),
+                             timeout=self.timeout)
+
+        if not res.success:
+            logging.warning("Couldn't sync the mirror of '%s':\n%s",
+                            repo.name, res.output)
+            return None
+
+        return path
+
+    def has_revision(self, repo, revision):
+        """Returns True if the mirror of repo has revision."""
+        path = self.mirror_path(repo)
+        if not self.has_mirror(repo) or not path.is_dir():
+            return False
+
+        return runner.run(self._REPOTOOL_TO_HAS_CMD[repo.repo_tool].format(
+            path=shlex.quote(str(path)), rev=shlex.quote(revision))).success
+
+    def ensure(self, repo, revision):
+        """Returns the path of a mirror of repo having revision, syncing it
+            only if it doesn't yet.  None if there's no such mirror.
+        """
+        if self.has_revision(repo, revision):
+            return self.mirror_path(repo)
+
+        path = self.sync(repo)
+        if path is None or not self.has_revision(repo, revision):
+            return None
+
+        return path
+
+    def is_shared(self, repo, dest):
+        """Returns True if the checkout in dest was made by
+            worktree_commands().
+        """
+        marker = self._REPOTOOL_TO_SHARED_MARKER.get(repo.repo_tool)
+        # The '.git' of a git worktree is a file, not a directory.
+        return marker is not None and Path(dest, marker).is_file()
+
+    def worktree_commands(self, repo, dest, revision):
+        """Returns the commands checking revision of repo out in dest, from
+            the mirror (See ensure()).
+        """
+        return [c.format(path=shlex.quote(str(self.mirror_path(repo))),
+                         dest=shlex.quote(str(dest)),
+                         rev=shlex.quote(revision))
+                for c in self._REPOTOOL_TO_WORKTREE_CMD[repo.repo_tool]]
+
+    def update_commands(self, repo):
+        """Returns the commands, run in a checkout of repo, updating it from
+            its mirror (See sync()) instead of from upstream.
+        """
+        return [c.format(path=shlex.quote(str(self.mirror_path(repo))))
+                for c in self._REPOTOOL_TO_UPDATE_CMD[repo.repo_tool]]
+
+    def switch_commands(self, repo, revision):
+        """Returns the commands moving a checkout made by worktree_commands()
+            to revision.
+        """
+        return [c.format(rev=shlex.quote(revision))
+                for c in self._REPOTOOL_TO_SWITCH_CMD[repo.repo_tool]]
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""Profile Guided Optimization Build"""
+
+import glob
+import logging
+import os
+import shlex
+import shutil
+from pathlib import Path
+
+import runner
+import toolchain
+
+# FFmpeg arguments the training run and the timing runs go through, one
+#   command per entry.  {clip} is the generated source clip.
+DEFAULT_WORKLOAD = (
+    '-i {clip} -c:v libx264 -preset ultrafast -f null -',
+    '-i {clip} -c:v libx264 -preset medium -f null -',
+    '-i {clip} -c:v libx264 -preset slow -f null -',
+)
+
+def read_workload(path):
+    """Returns the workload in path, one FFmpeg command per line without
+        the 'ffmpeg' itself.  Blank lines and lines starting with '#' are
+        skipped.
+    """
+    with open(path) as workload_file:
+        workload = [line.strip() for line in workload_file]
+
+    return tuple(line for line in workload
+                 if line and not line.startswith('#'))
+
+def find_profdata(env=None):
+    """Returns the llvm-profdata clang's raw profiles are merged with, or
+        None if there isn't one.  LLVM_PROFDATA in env wins, then the
+        unversioned tool, then the newest versioned one.
+    """
+    env = os.environ if env is None else env
+    if env.get('LLVM_PROFDATA'):
+        return env['LLVM_PROFDATA']
+
+    if shutil.which('llvm-profdata', path=env.get('PATH')):
+        return 'llvm-profdata'
+
+    found = {}
+    for dir_str in env.get('PATH', os.defpath).split(os.pathsep):
+        for path_str in glob.glob(os.path.join(dir_str, 'llvm-profdata-*')):
+            version_str = path_str.rpartition('-')[2]
+            if version_str.isdigit() and os.access(path_str, os.X_OK):
+                found.setdefault(int(version_str), path_str)
+
+    return found[max(found)] if found else None
+
+class PgoBuild:
+    """Rebuilds libx264 and FFmpeg with profile guided optimization, then
+        times the result against the build they replace.
+
+        Everything has to be installed in the prefix of lib_builder already,
+            built without PGO; that ffmpeg is kept as the baseline.  The libs
+            taking extra-cflags/extra-ldflags and FFmpeg are then rebuilt
+            instrumented, the workload is run on a clip that FFmpeg
+            generates, and they are rebuilt once more with the profiles it
+            left.  The other libs are linked as they are.
+
+        Both rebuilds are clean ones in the same build directories, as gcc
+            finds the profile of an object by the object's path.  They're
+            installed into the prefix, so if training or either rebuild
+            fails, everything is rebuilt without PGO again, rather than
+            leaving binaries that write profiles whenever they run.
+
+        Arguments, required:
+            lib_builder: builder.LibBuilder whose prefix everything is in.
+                Shouldn't have an artifact cache, as it couldn't tell
+                profiles apart.
+            libs: RepoBases FFmpeg is built with.
+            ffmpeg_src: FFmpeg source directory.
+            work_dir: Where the profiles, clip and baseline ffmpeg are kept.
+
+        Arguments, optional:
+            workload: FFmpeg commands, see DEFAULT_WORKLOAD.
+            clip_size: Frame size of the clip, as WIDTHxHEIGHT.
+            clip_seconds: Length of the clip.
+            repeat: How many times every command is timed, the fastest
+                counts.
+    """
+
+    # (cflags, ldflags) of every stage, by compiler family.  {dir} is
+    #   where the profiles go.
+    _FAMILY_TO_FLAGS = {
+        'gcc': {
+            'instrumented': ('-fprofile-generate={dir} '
+                             '-fprofile-update=atomic',
+                             '-fprofile-generate={dir}'),
+            'optimized': ('-fprofile-use={dir} -fprofile-correction '
+                          '-Wno-missing-profile',
+                          '-fprofile-use={dir}'),
+        },
+        'clang': {
+            'instrumented': ('-fprofile-generate={dir}',
+                             '-fprofile-generate={dir}'),
+            'optimized': ('-fprofile-use={dir}/default.profdata '
+                          '-Wno-profile-instr-unprofiled '
+                          '-Wno-profile-instr-out-of-date',
+                          '-fprofile-use={dir}/default.profdata'),
+        },
+    }
+
+    # What configure leaves in the build directories of x264 and FFmpeg.
+    _CONFIG_FILES = ('config.mak', 'ffbuild/config.mak')
+
+    def __init__(self, lib_builder, libs, ffmpeg_src, work_dir,
+                 workload=DEFAULT_WORKLOAD, clip_size='1280x720',
+                 clip_seconds=3, repeat=3):
+        self.lib_builder = lib_builder
+        self.libs = list(libs)
+        self.ffmpeg_src = ffmpeg_src
+        self.work_dir = Path(work_dir)
+        self.profile_dir = self.work_dir / 'profiles'
+        self.clip = self.work_dir / 'clip.y4m'
+        self.workload = tuple(workload)
+        self.clip_size = clip_size
+        self.clip_seconds = clip_seconds
+        self.repeat = max(1, repeat)
+        # Libs rebuilt with PGO, the others are linked as they are.
+        self.pgo_libs = [lib for lib in self.libs
+                         if lib.options.has_option('extra-cflags')]
+
+    @property
+    def ffmpeg(self):
+        """The ffmpeg in the prefix."""
+        return Path(self.lib_builder.prefix, 'bin', 'ffmpeg')
+
+    def _clean(self, name, build_path):
+        # Nothing to clean, and nothing make clean would work with, until
+        #   configure ran.
+        if not any(Path(build_path, config_str).is_file()
+                   for config_str in self._CONFIG_FILES):
+            return
+
+        res = runner.run('make clean', cwd=build_path,
+                         env=self.lib_builder.get_env(),
+                         tail=self.lib_builder.log_tail)
+        if not res.success:
+            logging.warning("Couldn't clean '%s', some objects may be "
+                            'reused:\n%s', name, res.output)
+
+    def _flags(self, family, stage):
+        return tuple(flags_str.format(dir=self.profile_dir)
+                     for flags_str in self._FAMILY_TO_FLAGS[family][stage])
+
+    def _build(self, stage, flags):
+        """Rebuilds the PGO libs and FFmpeg from clean with flags, (cflags,
+            ldflags) or None for none, and installs them.
+        """
+        logging.info('Building the %s binaries...', stage)
+        self.lib_builder.extra_flags = flags
+        try:
+            for lib in self.pgo_libs:
+                self._clean(lib.name, self.lib_builder.build_dir(lib))
+                if not self.lib_builder.build(lib):
+                    return False
+
+            self._clean('ffmpeg', self.ffmpeg_src)
+            return self.lib_builder.build_ffmpeg(self.ffmpeg_src, self.libs)
+        finally:
+            self.lib_builder.extra_flags = None
+
+    def _ffmpeg_argv(self, ffmpeg, args_str):
+        args_str = args_str.format(clip=shlex.quote(str(self.clip)))
+        return [str(ffmpeg), '-hide_banner', '-nostdin', '-loglevel', 'error',
+                '-y', *shlex.split(args_str)]
+
+    def _run_ffmpeg(self, ffmpeg, args_str):
+        res = runner.run(self._ffmpeg_argv(ffmpeg, args_str),
+                         env=self.lib_builder.get_env(),
+                         tail=self.lib_builder.log_tail)
+        if not res.success:
+            logging.error("'%s %s' failed with exit code %d:\n%s",
+                          ffmpeg, args_str, res.returncode, res.output)
+
+        return res
+
+    def _train(self):
+        logging.info('Training on a %s clip of %ss...', self.clip_size,
+                     self.clip_seconds)
+        source_str = (f'-f lavfi -i testsrc2=size={self.clip_size:s}:'
+                      f'rate=30:duration={self.clip_seconds} '
+                      '-pix_fmt yuv420p {clip}')
+        if not self._run_ffmpeg(self.ffmpeg, source_str).success:
+            return False
+
+        return all(self._run_ffmpeg(self.ffmpeg, args_str).success
+                   for args_str in self.workload)
+
+    def _merge(self, family):
+        """Merges the raw profiles clang wrote, gcc's are used as they are."""
+        if family != 'clang':
+            return True
+
+        profdata = find_profdata(self.lib_builder.get_env())
+        raw = sorted(str(p) for p in self.profile_dir.glob('*.profraw'))
+        if not raw:
+            logging.error("The training run left no profiles in '%s'",
+                          self.profile_dir)
+            return False
+
+        res = runner.run([profdata, 'merge',
+                          f'-output={self.profile_dir}/default.profdata',
+                          *raw])
+        if not res.success:
+            logging.error('Merging the profiles failed:\n%s', res.output)
+
+        return res.success
+
+    def time(self, ffmpeg):
+        """Returns the fastest time of every command of the workload with
+            ffmpeg, or None if one failed.
+        """
+        times = []
+        for args_str in self.workload:
+            durations = []
+            for _ in range(self.repeat):
+                res = self._run_ffmpeg(ffmpeg, args_str)
+                if not res.success:
+                    return None
+
+                durations.append(res.duration)
+
+            times.append(min(durations))
+
+        return times
+
+    def run(self):
+        """Runs every stage, returning the speed-up of every command of the
+            workload as (command, baseline, pgo) seconds, or None if any
+            stage failed.
+        """
+        family = toolchain.compiler_family(self.lib_builder.get_env())
+        if family not in self._FAMILY_TO_FLAGS:
+            logging.error('PGO needs gcc or clang')
+            return None
+
+        if family == 'clang' and not find_profdata(
+                self.lib_builder.get_env()):
+            logging.error('PGO with clang needs llvm-profdata, set '
+                          'LLVM_PROFDATA to where it is')
+            return None
+
+        if not self.pgo_libs:
+            logging.warning('None of the libs can be built with PGO, only '
+                            'FFmpeg is')
+
+        if not self.ffmpeg.is_file():
+            logging.error("There is no '%s' to compare against", self.ffmpeg)
+            return None
+
+        os.makedirs(self.work_dir, exist_ok=True)
+        baseline = self.work_dir / 'ffmpeg-baseline'
+        shutil.copy2(self.ffmpeg, baseline)
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+        os.makedirs(self.profile_dir)
+        optimized = False
+        try:
+            optimized = (
+                self._build('instrumented',
+                            self._flags(family, 'instrumented'))
+                and self._train()
+                and self._merge(family)
+                and self._build('optimized', self._flags(family, 'optimized')))
+        finally:
+            if not optimized:
+                self._restore()
+
+        if not optimized:
+            return None
+
+        try:
+            logging.info('Timing the baseline and PGO builds, best of %d...',
+                         self.repeat)
+            before = self.time(baseline)
+            after = self.time(self.ffmpeg) if before else None
+            if after is None:
+                return None
+        finally:
+            if self.clip.exists():
+                self.clip.unlink()
+
+        return list(zip(self.workload, before, after))
+
+    def _restore(self):
+        logging.warning('PGO failed, rebuilding without it')
+        if not self._build('non-PGO', None):
+            logging.error("Couldn't rebuild without PGO, '%s' may write "
+                          "profiles to '%s' whenever it runs",
+                          self.lib_builder.prefix, self.profile_dir)
+
+    @staticmethod
+    def print(speedups):
+        width = max(len(c) for c, _, _ in speedups)
+        print(f"{'workload':<{width}s} {'baseline':>9s} {'pgo':>9s} "
+              f"{'speed-up':>9s}")
+        for command, before, after in speedups:
+            print(f'{command:<{width}s} {before:8.2f}s {after:8.2f}s '
+                  f'{before / after:8.2f}x')
+
+        before = sum(b for _, b, _ in speedups)
+        after = sum(a for _, _, a in speedups)
+        print(f"{'total':<{width}s} {before:8.2f}s {after:8.2f}s "
+              f'{before / after:8.2f}x')
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Build Plans"""
+
+from typing import NamedTuple
+
+import scheduler
+
+class PlannedStep(NamedTuple):
+    phase: str
+    command: str
+    # Seconds it's expected to take, None if it never ran before.
+    estimate: float
+    skipped: bool = False
+
+class PlannedAction(NamedTuple):
+    action: str
+    target: str
+    steps: list
+    note: str = ''
+
+    @property
+    def estimate(self):
+        return sum(s.estimate or 0.0 for s in self.steps if not s.skipped)
+
+class BuildPlan:
+    """What a run would do, and how long it would take, without doing any of
+        it.  Filled in by update_repos(), download_repos() and compile_libs()
+        when they are given one, then shown with print().
+
+        Arguments, optional:
+            history: buildhistory.BuildHistory the estimates come from.
+    """
+
+    def __init__(self, history=None):
+        self.history = history
+        self.actions = []
+        # (name, wall seconds, summary) of every stage, in order.
+        self.stages = []
+
+    def estimate(self, name, phase):
+        if self.history is None:
+            return None
+
+        return self.history.estimate(name, phase)
+
+    def step(self, name, phase, command, skipped=False):
+        return PlannedStep(phase, command, self.estimate(name, phase),
+                           skipped)
+
+    def add_repos(self, action, planned, max_workers):
+        """Adds a stage of downloads or updates running max_workers at once.
+
+            planned: list of (repo name, commands, note).  Repos without
+                commands have nothing to do.
+        """
+        graph = scheduler.BuildScheduler(max_workers)
+        durations = {}
+        for name, commands, note in planned:
+            step = self.step(name, action, '; '.join(commands),
+                             not commands)
+            planned_action = PlannedAction(action, name, [step], note)
+            self.actions.append(planned_action)
+            graph.add(name, None)
+            durations[name] = planned_action.estimate
+
+        if planned:
+            self.stages.append((f'{action:s}s',
+                                graph.estimate_wall(durations),
+                                f'{max_workers:d} at once'))
+
+    def add_builds(self, graph, plans):
+        """Adds the builds of graph.
+
+            plans: dict of node name to builder.LibPlan.
+        """
+        durations = {}
+        for name in graph.order():
+            lib_plan = plans[name]
+            steps = [self.step(name, s.phase, s.command,
+                               lib_plan.cached or s.phase in lib_plan.skip)
+                     for s in lib_plan.steps]
+            if lib_plan.cached:
+                action = PlannedAction('restore', name, steps,
+                                       'artifact cache hit')
+            else:
+                action = PlannedAction('build', name, steps)
+
+            self.actions.append(action)
+            durations[name] = action.estimate
+
+        if durations:
+            path, total = graph.critical_path(durations)
+            self.stages.append(('builds',
+                                graph.estimate_wall(durations),
+                                f'{graph.max_workers:d} at once, critical '
+                                f"path {' -> '.join(path):s} "
+                                f'({total:.1f}s)'))
+
+    @staticmethod
+    def _fmt_estimate(estimate):
+        return '?' if estimate is None else f'{estimate:.1f}s'
+
+    def print(self):
+        if not self.actions:
+            print('Nothing to do.')
+            return
+
+        unknown = 0
+        print('Plan:')
+        for num, action in enumerate(self.actions, 1):
+            print(f'{num:3d}  {action.action:<8s} {action.target:<12s} '
+                  f'{action.estimate:8.1f}s  {action.note:s}')
+            for step in action.steps:
+                if step.estimate is None and not step.skipped:
+                    unknown += 1
+
+                print(f"{'':5s}{step.phase:>12s} "
+                      f'{self._fmt_estimate(step.estimate):>8s}  '
+                      f"{'(skipped) ' if step.skipped else '':s}"
+                      f'{step.command:s}')
+
+        print()
+        for name, wall, summary in self.stages:
+            print(f'{name:<10s} {wall:8.1f}s  {summary:s}')
+
+        print(f"{'total':<10s} {sum(s[1] for s in self.stages):8.1f}s  "
+              'estimated wall time')
+        if unknown:
+            print(f'{unknown:d} step(s) never ran before and are counted as '
+                  '0s.')
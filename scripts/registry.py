@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Lazy Library Registry"""
+
+import ast
+import importlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+class LibraryRegistry:
+    """Finds library definitions by name without importing them.
+
+        Every lib*.py module in lib_dir that defines a module level
+            'LIBRARY' dict is a library.  'LIBRARY' must be a literal, so it
+            can be read with ast instead of importing the module.  It needs
+            at least:
+
+            name: Name of the repo, e.g. 'libx264'.
+            class: Name of the RepoBase subclass defined in the module.
+
+        Anything else in it (e.g. 'switch', 'depends') is available through
+            metadata() without importing.  The module is only imported, and
+            the class only instantiated, when get() is called.
+
+        What was read is kept in cache_path (lib_dir/__pycache__ by
+            default), and a module is only parsed again once its
+            modification time or size changes.
+    """
+
+    _METADATA_NAME = 'LIBRARY'
+
+    # Library modules, the other modules of lib_dir are never read.
+    _PATTERN = 'lib*.py'
+
+    def __init__(self, lib_dir, cache_path=None):
+        self.lib_dir = Path(lib_dir)
+        self.cache_path = Path(cache_path or
+                               self.lib_dir / '__pycache__' / 'registry.json')
+        self._metadata = None
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def _read_metadata(self, path):
+        try:
+            tree = ast.parse(path.read_text(), str(path))
+        except (OSError, SyntaxError) as emsg:
+            logging.warning("Couldn't read '%s': %s", path, emsg)
+            return None
+
+        for node in tree.body:
+            if (isinstance(node, ast.Assign)
+                    and any(isinstance(t, ast.Name)
+                            and t.id == self._METADATA_NAME
+                            for t in node.targets)):
+                try:
+                    metadata = ast.literal_eval(node.value)
+                except ValueError:
+                    logging.warning("'%s' in '%s' is not a literal",
+                                    self._METADATA_NAME, path)
+                    return None
+
+                return dict(metadata, module=path.stem)
+
+        return None
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path) as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self, cache):
+        tmp_str = f'{self.cache_path}.{os.getpid():d}'
+        try:
+            os.makedirs(self.cache_path.parent, exist_ok=True)
+            with open(tmp_str, 'w') as cache_file:
+                json.dump(cache, cache_file)
+
+            os.replace(tmp_str, self.cache_path)
+        except OSError as emsg:
+            logging.debug("Couldn't save the library cache: %s", emsg)
+
+    def _scan(self):
+        if self._metadata is None:
+            old_cache = self._load_cache()
+            cache = {}
+            metadata = {}
+            for path in sorted(self.lib_dir.glob(self._PATTERN)):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+
+                stamp = [stat.st_mtime_ns, stat.st_size]
+                cached = old_cache.get(path.name)
+                if cached is not None and cached['stamp'] == stamp:
+                    lib_meta = cached['metadata']
+                else:
+                    lib_meta = self._read_metadata(path)
+
+                # Modules without metadata are kept too, as None, so they
+                #   aren't parsed every time either.
+                cache[path.name] = {'stamp': stamp, 'metadata': lib_meta}
+                if lib_meta is not None:
+                    metadata[lib_meta['name'].lower()] = lib_meta
+
+            if cache != old_cache:
+                self._save_cache(cache)
+
+            self._metadata = metadata
+
+        return self._metadata
+
+    def names(self):
+        """Returns the names of every library, sorted."""
+        return sorted(self._scan())
+
+    def __contains__(self, name):
+        return name.lower() in self._scan()
+
+    def __iter__(self):
+        return iter(self.names())
+
+    def metadata(self, name):
+        """Returns the 'LIBRARY' dict of name, without importing it."""
+        return self._scan()[name.lower()]
+
+    def get(self, name):
+        """Returns the instance of library name, importing it if needed."""
+        name = name.lower()
+        with self._lock:
+            if name not in self._instances:
+                lib_meta = self.metadata(name)
+                logging.debug("Loading library '%s' from '%s'",
+                              name, lib_meta['module'])
+                module = importlib.import_module(lib_meta['module'])
+                self._instances[name] = getattr(module, lib_meta['class'])()
+
+            return self._instances[name]
+
+    def __getitem__(self, name):
+        return self.get(name)
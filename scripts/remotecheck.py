@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Remote Revision Pre-Check"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+class RemoteCheck:
+    """Tells whether a checkout is behind its upstream without pulling.
+
+        The revision upstream is at is asked for cheaply (See
+            RepoBase.get_remote_head()) and remembered in cache_path for ttl
+            seconds, so running again within ttl doesn't ask again.
+
+        Arguments, required:
+            cache_path: JSON file the upstream revisions are kept in.
+
+        Arguments, optional:
+            ttl: Seconds an upstream revision is trusted for, 0 to always ask.
+            timeout: Seconds before asking upstream is given up on.
+    """
+
+    def __init__(self, cache_path, ttl=300, timeout=None):
+        self.cache_path = Path(cache_path)
+        self.ttl = ttl
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        try:
+            with open(self.cache_path) as cache_file:
+                self._cache = json.load(cache_file)
+        except (FileNotFoundError, ValueError):
+            self._cache = {}
+
+    def _save(self):
+        os.makedirs(self.cache_path.parent, exist_ok=True)
+        fd, tmp_str = tempfile.mkstemp(dir=self.cache_path.parent,
+                                       suffix='.tmp')
+        with os.fdopen(fd, 'w') as cache_file:
+            json.dump(self._cache, cache_file, indent=1)
+
+        os.replace(tmp_str, self.cache_path)
+
+    def remote_head(self, repo, path):
+        """Returns the revision upstream of repo is at, or None."""
+        with self._lock:
+            entry = self._cache.get(repo.name)
+
+        if (entry
+                and entry['url'] == repo.repo_url
+                and time.time() - entry['checked'] < self.ttl):
+            return entry['head']
+
+        head = repo.get_remote_head(path, self.timeout)
+        if head is None:
+            return None
+
+        with self._lock:
+            self._cache[repo.name] = {'url': repo.repo_url,
+                                      'head': head,
+                                      'checked': time.time()}
+            self._save()
+
+        return head
+
+    def is_current(self, repo, path):
+        """Returns True if the checkout of repo in path is already at the
+            revision upstream is at.  False if it isn't, or that can't be
+            told, in which case it should be updated.
+        """
+        local = repo.get_local_head(path)
+        if local is None:
+            return False
+
+        remote = self.remote_head(repo, path)
+        if remote is None:
+            logging.debug("Couldn't get the upstream revision of '%s'",
+                          repo.name)
+            return False
+
+        return local == remote
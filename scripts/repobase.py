@@ -1,15 +1,29 @@
 #!/usr/bin/env python3
 """Repository Base"""
 
+import hashlib
+import json
 import logging
 import os
+import re
+import shlex
 import sys
 from enum import Enum
 from abc import ABC, abstractmethod
 from pathlib import Path
 from typing import NamedTuple
 
+import runner
+import tarball
+
 class Options:
+    """Configure options understood by a single repository.
+
+        Every repo has its own instance, so options with the same name in two
+            repos never overwrite each other.  Options are indexed by name,
+            key and aliases when they are added, so every lookup is a single
+            dict access.
+    """
 
     # Using a 'NamedTuple' instead of a regular class because I want these
     #   members to be constant.
@@ -19,20 +33,47 @@ class Options:
         kwarg: bool
         values: tuple
 
-    # TODO: Check for duplicates
-    _options = {}
-    _ALL_ADD_OPTION_KWARGS = {'aliases': '', 'kwarg': False, 'values': ''}
-    @classmethod
-    def add_option(cls, name, **kwargs):
-        opt_kwargs = {
-            'aliases': (cls._ALL_ADD_OPTION_KWARGS['aliases']),
-            'kwarg':  cls._ALL_ADD_OPTION_KWARGS['kwarg'],
-            'values': (cls._ALL_ADD_OPTION_KWARGS['values'])
-        }
+    _ALL_ADD_OPTION_KWARGS = {'aliases': (), 'kwarg': False, 'values': ()}
+
+    # Exit codes used when an invalid option, argument or keyword argument is
+    #   asked for.
+    _EXIT_OPTION = 10
+    _EXIT_ARG = 11
+    _EXIT_KWARG = 12
+
+    def __init__(self, repo_name=''):
+        self.repo_name = repo_name
+        self._options = {}
+        # Maps every key, name and alias to its '_Option'.
+        self._index = {}
+
+    @staticmethod
+    def _to_tuple(v):
+        if v is None or isinstance(v, (str, int)):
+            return (v,)
+
+        return tuple(v)
+
+    def add_option(self, name, **kwargs):
+        """Adds Option name.
+
+            Arguments, required:
+                name: Name of the option as it is used on the command line,
+                    without any leading dashes (-).
+
+            Arguments, optional:
+                aliases: Alias or tuple of aliases of the option.
+                kwarg: True if the option takes a value.
+                values: Value or tuple of values the option accepts.  Giving
+                    values implies kwarg.
+
+            Raises ValueError if name, or any of its aliases, is already used
+                by another option of this repo.
+        """
+        opt_kwargs = dict(self._ALL_ADD_OPTION_KWARGS)
 
-        # TODO: Check for duplicate keywords
         for k, v in kwargs.items():
-            if k not in cls._ALL_ADD_OPTION_KWARGS:
+            if k not in self._ALL_ADD_OPTION_KWARGS:
                 logging.debug('%-10s: %s', k, v)
                 logging.warning("'%s' is not a valid keyword.", k)
                 continue
@@ -63,41 +104,44 @@ class Options:
                 opt_kwargs[k] = v
                 continue
 
-            if not isinstance(v, tuple):
-                v = tuple(set(v))
-
-            opt_kwargs[k] = v
-
-        cls._options.update({
-            name.replace('-', '_'): cls._Option(name=name,
-                                                aliases=opt_kwargs['aliases'],
-                                                kwarg=(
-                                                    opt_kwargs['kwarg']
-                                                    or opt_kwargs['values']),
-                                                values=opt_kwargs['values'])})
-
-    @classmethod
-    def _is_opt(cls, option):
-        return (option.replace('-', '_') in cls._options
-                or (any(option in opt.aliases)
-                    for opt in cls._options.values()))
-
-    @classmethod
-    def _get_opt(cls, opt):
-        if cls._is_opt(opt):
-            for k, v in cls._options.items():
-                if opt.replace('-', '_') == k or opt in v.aliases:
-                    return cls._options[k]
-
-        logging.warning("'%s' is not a valid option!", opt)
-        return None
-
-    @classmethod
-    def get_option(cls, option):
+            # Keep the order values were given in, but drop duplicates.
+            opt_kwargs[k] = tuple(dict.fromkeys(self._to_tuple(v)))
+
+        key = name.replace('-', '_')
+        option = self._Option(name=name,
+                              aliases=opt_kwargs['aliases'],
+                              kwarg=bool(opt_kwargs['kwarg']
+                                         or opt_kwargs['values']),
+                              values=opt_kwargs['values'])
+
+        lookups = dict.fromkeys((key, name) + option.aliases)
+        for lookup in lookups:
+            if lookup in self._index:
+                raise ValueError(
+                    f'{self.repo_name:s}: {lookup!r} of option {name!r} is '
+                    f'already used by {self._index[lookup].name!r}')
+
+        self._options[key] = option
+        self._index.update(dict.fromkeys(lookups, option))
+
+    def __len__(self):
+        return len(self._options)
+
+    def _is_opt(self, option):
+        return option in self._index or option.replace('-', '_') in self._index
+
+    def _get_opt(self, opt):
+        option = self._index.get(opt) or self._index.get(opt.replace('-', '_'))
+        if option is None:
+            logging.warning("'%s' is not a valid option!", opt)
+
+        return option
+
+    def get_option(self, option):
         """Returns an instance of Option option
 
             Arguments, required:
-                option: Option that is present in dict cls._options.
+                option: Option that is present in dict self._options.
                     Do not include any leading dashes (-) or underscores (_).
 
                     Can either be the key (Name of option with '-' replaced
@@ -117,19 +161,22 @@ class Options:
             If opt is invalid, an error is thrown and script exits with error
                 code 10.
         """
-        option = cls._get_opt(option)
-        if option:
-            return option
+        tmp_opt = self._get_opt(option)
+        if tmp_opt:
+            return tmp_opt
 
         logging.error("'%s' is not a valid option!", option)
-        sys.exit(10)
+        sys.exit(self._EXIT_OPTION)
+
+    @staticmethod
+    def _takes_arg(option):
+        return not option.kwarg or None in option.values
 
-    @classmethod
-    def has_arg(cls, arg):
+    def has_arg(self, arg):
         """Checks for argument arg
 
             Arguments, required:
-                arg: argument that is present in dict cls._options.
+                arg: argument that is present in dict self._options.
                     Do not include any leading dashes (-) or underscores (_).
 
                     arg can only be the name of an Option (Or aliase) that is
@@ -138,15 +185,14 @@ class Options:
 
             Returns True if all conditions are met, otherwise False.
         """
-        tmp_opt = cls._get_opt(arg)
-        return tmp_opt and (not tmp_opt.kwarg or None in tmp_opt.values)
+        tmp_opt = self._get_opt(arg)
+        return bool(tmp_opt) and self._takes_arg(tmp_opt)
 
-    @classmethod
-    def get_arg(cls, arg):
+    def get_arg(self, arg):
         """Returns an instance of the Option based on arg.
 
             Arguments, required:
-                arg: argument that is present in dict cls._options.
+                arg: argument that is present in dict self._options.
                     Do no include any leading dashes (-) or underscores (_).
 
                     See has_arg()
@@ -154,19 +200,18 @@ class Options:
             If arg is invalid, an error is thrown and script exits with error
                 code 11.
         """
-        tmp_opt = None if not cls.has_arg(arg) else cls._get_opt(arg)
-        if tmp_opt:
+        tmp_opt = self._get_opt(arg)
+        if tmp_opt and self._takes_arg(tmp_opt):
             return tmp_opt
 
         logging.error("'%s' is not a valid argument!", arg)
-        sys.exit(11)
+        sys.exit(self._EXIT_ARG)
 
-    @classmethod
-    def has_kwarg(cls, kwarg):
+    def has_kwarg(self, kwarg):
         """Checks for keyword argument kwarg
 
             Arguments, required:
-                kwarg: keyword argument that is present in dict cls._options.
+                kwarg: keyword argument that is present in dict self._options.
                     Do not include any leading dashes (-) or underscores (_).
 
                     kwarg can only be the name of an Option (Or aliase) that is
@@ -174,15 +219,14 @@ class Options:
 
             Returns True if all conditions are met, otherwise False.
         """
-        tmp_opt = cls._get_opt(kwarg)
-        return tmp_opt and tmp_opt.kwarg
+        tmp_opt = self._get_opt(kwarg)
+        return bool(tmp_opt) and tmp_opt.kwarg
 
-    @classmethod
-    def get_kwarg(cls, kwarg):
+    def get_kwarg(self, kwarg):
         """Returns an instance of the Option based on karg.
 
             Arguments, required:
-                karg: keyword argument that is present in dict cls._options.
+                karg: keyword argument that is present in dict self._options.
                     Do no include any leading dashes (-) or underscores (_).
 
                     See has_kwarg()
@@ -190,19 +234,18 @@ class Options:
             If kwarg is invalid, an error is thrown and script exits with error
                 code 12.
         """
-        tmp_opt = None if not cls.has_kwarg(kwarg) else cls._get_opt(kwarg)
-        if tmp_opt:
+        tmp_opt = self._get_opt(kwarg)
+        if tmp_opt and tmp_opt.kwarg:
             return tmp_opt
 
         logging.error("'%s' is not a valid keyword argument!", kwarg)
-        sys.exit(12)
+        sys.exit(self._EXIT_KWARG)
 
-    @classmethod
-    def has_option(cls, option):
+    def has_option(self, option):
         """Checks for Option option
 
             Arguments, required:
-                option: Option that is present in dict cls._options.
+                option: Option that is present in dict self._options.
                     Do not include any leading dashes (-) or underscores (_).
 
                     Can either be the key (Name of option with '-' replaced
@@ -221,13 +264,55 @@ class Options:
 
             Returns True if all conditions are met, otherwise False.
         """
-        return cls._is_opt(option)
+        return self._is_opt(option)
 
-    @classmethod
-    def has_values(cls, kwarg):
+    def has_values(self, kwarg):
         """Checks if kwarg has any values."""
-        tmp_opt = cls._get_opt(kwarg)
-        return tmp_opt and tmp_opt.values
+        tmp_opt = self._get_opt(kwarg)
+        return bool(tmp_opt) and bool(tmp_opt.values)
+
+    def validate(self, args=(), kwargs=None):
+        """Checks a whole configure command in one pass.
+
+            Arguments, optional:
+                args: Arguments, see has_arg().
+                kwargs: dict of keyword arguments to their values, see
+                    has_kwarg().
+
+            Returns (options, errors).  options is a list of the options as
+                they would be given on the command line, errors is a list of
+                (exit code, message) for everything that was invalid.
+        """
+        options = []
+        errors = []
+        for arg in args:
+            tmp_opt = self._index.get(arg) or self._index.get(
+                arg.replace('-', '_'))
+            if tmp_opt is None or not self._takes_arg(tmp_opt):
+                errors.append((self._EXIT_ARG,
+                               f'{arg!r} is not a valid argument!'))
+                continue
+
+            options.append(f'--{tmp_opt.name:s}')
+
+        for k, v in (kwargs or {}).items():
+            tmp_opt = self._index.get(k) or self._index.get(
+                k.replace('-', '_'))
+            if tmp_opt is None or not tmp_opt.kwarg:
+                errors.append((self._EXIT_KWARG,
+                               f'{k!r} is not a valid keyword argument!'))
+                continue
+
+            if (tmp_opt.values
+                    and str(v) not in (str(i) for i in tmp_opt.values)):
+                errors.append((1,
+                               f'{v!r} is not a valid value for {k!r}.  '
+                               f'Valid values are: {tmp_opt.values}'))
+                continue
+
+            options.append(f'--{tmp_opt.name:s}={shlex.quote(str(v)):s}')
+
+        return options, errors
 
 class RepoTool(Enum):
     CURL_TOOL = 'curl'
@@ -236,8 +321,52 @@ class RepoTool(Enum):
     HG_TOOL = 'hg clone'
     UND = 'Undetermined'
 
+class FetchMode(Enum):
+    FULL = 'full'
+    # Only the latest revision, for build-only checkouts.
+    SHALLOW = 'shallow'
+    # Full history, but file contents are only fetched when checked out.
+    BLOBLESS = 'blobless'
+    # Latest revision without any VCS metadata.  Can't be updated.
+    EXPORT = 'export'
+
+class BuildStep(NamedTuple):
+    # One of 'configure', 'make' or 'install'.
+    phase: str
+    command: str
+
+# What FFmpeg has to be configured with to link against a lib of each
+#   license.
+LICENSE_TO_SWITCHES = {
+    'lgpl': (),
+    'gpl': ('--enable-gpl',),
+    'version3': ('--enable-version3',),
+    'gplv3': ('--enable-gpl', '--enable-version3'),
+    'nonfree': ('--enable-nonfree',)
+}
+
 class RepoBase(ABC):
 
+    # True if configure is generated by autoconf, and so understands
+    #   '--cache-file'.
+    autoconf = False
+
+    # True if configure can be run from another directory than the source,
+    #   building there.  Other repos are copied to be built out of tree.
+    out_of_tree = False
+
+    # (option, value) pairs this is configured with on top of whatever is
+    #   given to get_config(), see variants.LibVariant.
+    variant = ()
+
+    # Where this is installed, None for wherever everything else is.
+    install_prefix = None
+
+    # SHA-256 of the tarball at repo_url, for RepoTool.CURL_TOOL repos.  The
+    #   download is rejected if it doesn't match, and never repeated if it
+    #   does.
+    sha256 = None
+
     _DIR_KW = ('srcdir', 'prefix', 'execc-prefix', 'bindir', 'sbindir',
                'libexecdir', 'sysconfdir', 'sahredstatedir', 'localstatedir',
                'libdir', 'includedir', 'oldincludedir', 'datarootdir',
@@ -245,28 +374,117 @@ class RepoBase(ABC):
                'pdfdir', 'psdir', 'with-sysroot', 'with-libiconv-prefix')
 
 
-    # NOTE: This isn't exactly ideal on handling if the key is
-    #   'RepoTool.CURL_TOOL' or 'RepoTool.UND', but it's good enough for now.
+    # NOTE: This isn't exactly ideal on handling if the key is 'RepoTool.UND',
+    #   but it's good enough for now.  Tarballs aren't updated with commands,
+    #   see get_update_commands().
     _REPOTOOL_TO_UPDATE_CMD = {
-        RepoTool.CURL_TOOL: ["echo 'Update via \'curl\' not implemented!'"],
         RepoTool.GIT_TOOL: ['git pull'],
         RepoTool.SVN_TOOL: ['svn up'],
         RepoTool.HG_TOOL: ['hg pull', 'hg update'],
         RepoTool.UND: ["echo 'RepoTool undetermined...'"]
     }
 
+    # Commands, run in a checkout, that check out the revision given as {0}.
+    _REPOTOOL_TO_CHECKOUT_CMD = {
+        RepoTool.GIT_TOOL: ['git fetch --quiet origin',
+                            'git checkout --quiet --detach {0}'],
+        RepoTool.SVN_TOOL: ['svn update --quiet -r {0}'],
+        RepoTool.HG_TOOL: ['hg pull --quiet', 'hg update --quiet -r {0}']
+    }
+
+    _REPOTOOL_TO_REVISION_CMD = {
+        RepoTool.GIT_TOOL: 'git rev-parse HEAD',
+        RepoTool.SVN_TOOL: 'svn info --show-item revision',
+        RepoTool.HG_TOOL: 'hg identify --id'
+    }
+
+    # Commands that check out revision {1} of repo_url to {0}, when there's
+    #   no mirror to share objects with.
+    _REPOTOOL_TO_PINNED_CLONE_CMD = {
+        RepoTool.GIT_TOOL: ['git clone --quiet --no-checkout {2} {0}',
+                            'git -C {0} checkout --quiet --detach {1}'],
+        RepoTool.SVN_TOOL: ['svn checkout --quiet -r {1} {2} {0}'],
+        RepoTool.HG_TOOL: ['hg clone --noupdate {2} {0}',
+                           'hg -R {0} update --quiet -r {1}']
+    }
+
+    # Commands printing the revision repo_url is at, without a checkout.
+    #   Only the first word of their output is used.
+    _REPOTOOL_TO_URL_HEAD_CMD = {
+        RepoTool.GIT_TOOL: 'git ls-remote {0} HEAD',
+        RepoTool.SVN_TOOL: 'svn info --show-item last-changed-revision '
+                           '-r HEAD {0}',
+        RepoTool.HG_TOOL: 'hg identify --debug --id -r default {0}'
+    }
+
+    # Commands printing the revision upstream is at, and the one checked
+    #   out to compare it with.  Only the first word of their output is used.
+    _REPOTOOL_TO_HEAD_CMD = {
+        RepoTool.GIT_TOOL: ('git ls-remote origin HEAD', 'git rev-parse HEAD'),
+        RepoTool.SVN_TOOL: ('svn info --show-item last-changed-revision '
+                            '-r HEAD',
+                            'svn info --show-item last-changed-revision'),
+        RepoTool.HG_TOOL: ('hg identify --id -r default default',
+                           'hg identify --id -r .')
+    }
+
+    # Command listing locally modified files, and the column the file name
+    #   starts at in its output.
+    _REPOTOOL_TO_STATUS_CMD = {
+        RepoTool.GIT_TOOL: ('git status --porcelain --untracked-files=no', 3),
+        RepoTool.SVN_TOOL: ('svn status --quiet', 8),
+        RepoTool.HG_TOOL: ('hg status --modified --added --removed', 2)
+    }
+
+    # Arguments added to the RepoTool command for each FetchMode.  Modes
+    #   that aren't listed for a RepoTool fall back to a full download.
+    _REPOTOOL_TO_FETCH_ARGS = {
+        RepoTool.GIT_TOOL: {
+            FetchMode.SHALLOW: '--depth 1 --single-branch',
+            FetchMode.BLOBLESS: '--filter=blob:none',
+            FetchMode.EXPORT: '--depth 1 --single-branch'
+        },
+        RepoTool.HG_TOOL: {
+            FetchMode.EXPORT: '--noupdate'
+        }
+    }
+
+    _REPOTOOL_TO_EXPORT_CMD = {
+        RepoTool.GIT_TOOL: 'rm -rf {0}/.git',
+        RepoTool.SVN_TOOL: None,
+        RepoTool.HG_TOOL: ('hg archive -R {0} -r default -t files '
+                           '{0}.export && rm -rf {0} && mv {0}.export {0}')
+    }
+
     def __init__(self,
                  name,
                  config='',
                  repo_tool=RepoTool.UND,
                  repo_url='Not specified',
-                 switch='Not specified'):
+                 switch='Not specified',
+                 depends=(),
+                 license='lgpl'):
         super().__init__()
         self.name = name
         self.config = config
         self.repo_tool = repo_tool
         self.repo_url = repo_url
         self.switch = switch
+        self.options = Options(name)
+        # Names of other repos that must be built and installed first.
+        self.depends = tuple(depends)
+        # One of LICENSE_TO_SWITCHES.
+        self.license = license
+
+    @property
+    def source_name(self):
+        """Name of the directory the source is checked out to."""
+        return self.name
+
+    @property
+    def license_switches(self):
+        """FFmpeg configure switches the license of this repo requires."""
+        return LICENSE_TO_SWITCHES[self.license]
 
     @staticmethod
     def _to_abspath(path_str):
@@ -288,30 +506,264 @@ class RepoBase(ABC):
         return False
 
     def get_config(self, *args, **kwargs):
-        command_str = self.config
-        if args:
-            for arg in args:
-                logging.debug('%-3s: %s', 'arg', arg)
-                command_str += f'--{Options.get_arg(arg).name:s} '
+        """Returns the configure command with args and kwargs added.
+
+            Every argument is checked against self.options in one pass.  If
+                any are invalid, they are all logged and the script exits.
+        """
+        for arg in args:
+            logging.debug('%-3s: %s', 'arg', arg)
 
         if kwargs:
             fmt = f'%-{max(len(k) for k in kwargs):d}s: %s'
             for k, v in kwargs.items():
                 logging.debug(fmt, k, v)
-                tmp_kwarg = Options.get_kwarg(k)
-                if tmp_kwarg.values and v not in tmp_kwarg.values:
-                    logging.error("'%s' is not a valid value for '%s'", v, k)
-                    logging.error("Valid values are: %s", tmp_kwarg.values)
-                    sys.exit(1)
 
-                command_str += f'--{tmp_kwarg.name:s}={v:s} '
+        options, errors = self.options.validate(args, kwargs)
+        for _, msg in errors:
+            logging.error('%s: %s', self.name, msg)
 
-        return command_str
+        if errors:
+            sys.exit(errors[0][0])
+
+        return self.config + ''.join(f'{opt:s} ' for opt in options)
+
+    def get_download_commands(self,
+                              dest,
+                              fetch_mode=FetchMode.FULL,
+                              mirror=None):
+        """Returns the commands, in order, that download this repo to dest.
+
+            Arguments, required:
+                dest: Directory to download to.
+
+            Arguments, optional:
+                fetch_mode: A FetchMode.
+
+                mirror: Path of a local mirror (See mirror.MirrorStore) of
+                    repo_url.  Objects are borrowed from it instead of being
+                    downloaded again.
+        """
+        if (fetch_mode == FetchMode.EXPORT
+                and self.repo_tool == RepoTool.SVN_TOOL):
+            return [f'svn export -r head {self.repo_url:s} {dest}']
+
+        fetch_args = self._REPOTOOL_TO_FETCH_ARGS.get(
+            self.repo_tool, {}).get(fetch_mode)
+        if fetch_mode != FetchMode.FULL and fetch_args is None:
+            logging.info("'%s' doesn't support fetch mode '%s' for '%s'.  "
+                         'Doing a full download.',
+                         self.repo_tool.value, fetch_mode.value, self.name)
+
+        command_str = self.repo_tool.value
+        if fetch_args:
+            command_str += f' {fetch_args:s}'
+
+        commands = []
+        mirror_str = shlex.quote(str(mirror)) if mirror else None
+        if mirror and self.repo_tool == RepoTool.GIT_TOOL:
+            command_str += f' --reference-if-able {mirror_str:s}'
+        elif mirror and self.repo_tool == RepoTool.HG_TOOL:
+            # Local hg clones hardlink the store, so clone the mirror, then
+            #   point the clone back at the real upstream.
+            commands.append(f'{command_str:s} {mirror_str:s} {dest}')
+            commands.append(f"printf '[paths]\\ndefault = %s\\n' "
+                            f"'{self.repo_url:s}' > {dest}/.hg/hgrc")
+            command_str = None
+
+        if command_str:
+            commands.append(f'{command_str:s} {self.repo_url:s} {dest}')
+
+        export_cmd = self._REPOTOOL_TO_EXPORT_CMD.get(self.repo_tool)
+        if fetch_mode == FetchMode.EXPORT and export_cmd:
+            commands.append(export_cmd.format(dest))
+
+        return commands
+
+    def get_build_commands(self, *args, destdir=None, source_path=None,
+                           **kwargs):
+        """Returns the BuildSteps, in order, that configure, build and install
+            this repo.  Arguments are passed to get_config().
+
+            Arguments, optional:
+                destdir: Directory the install is staged in (DESTDIR).
+                source_path: Source directory, when building out of tree.
+        """
+        install_str = 'make install'
+        if destdir:
+            install_str += f' DESTDIR={destdir}'
+
+        config_str = self.get_config(*args, **kwargs)
+        return [BuildStep('configure', f'{source_path or "."}/{config_str:s}'),
+                BuildStep('make', 'make'),
+                BuildStep('install', install_str)]
 
     @abstractmethod
     def get_repo_download(self):
         raise NotImplementedError("'get_repo_download()' Not Implemented!")
 
     def get_update_commands(self):
-        logging.info("Updating repository '%s' ...", self.name)
-        return self._REPOTOOL_TO_UPDATE_CMD[self.repo_tool]
+        """Returns the commands, run in a checkout, that update it, or None
+            for RepoTool.CURL_TOOL repos, which are updated with a
+            conditional GET instead (See tarball.TarballFetcher.update()).
+        """
+        return self._REPOTOOL_TO_UPDATE_CMD.get(self.repo_tool)
+
+    def get_checkout_commands(self, revision):
+        """Returns the commands, run in a checkout, that check out revision,
+            or None if the RepoTool can't.
+        """
+        if self.repo_tool not in self._REPOTOOL_TO_CHECKOUT_CMD:
+            return None
+
+        return [c.format(shlex.quote(revision))
+                for c in self._REPOTOOL_TO_CHECKOUT_CMD[self.repo_tool]]
+
+    def get_pinned_download_commands(self, dest, revision):
+        """Returns the commands, in order, that download this repo to dest
+            with revision checked out, or None if it can't be pinned.
+        """
+        if self.repo_tool not in self._REPOTOOL_TO_PINNED_CLONE_CMD:
+            return None
+
+        return [c.format(shlex.quote(str(dest)), shlex.quote(revision),
+                         shlex.quote(self.repo_url))
+                for c in self._REPOTOOL_TO_PINNED_CLONE_CMD[self.repo_tool]]
+
+    def get_url_head(self, timeout=None):
+        """Returns the revision repo_url is at, without needing a checkout,
+            or None if it can't be determined.
+
+            The revision of a tarball is its SHA-256, if known.
+        """
+        if self.repo_tool == RepoTool.CURL_TOOL:
+            return self.sha256
+
+        if self.repo_tool not in self._REPOTOOL_TO_URL_HEAD_CMD:
+            return None
+
+        res = runner.run(self._REPOTOOL_TO_URL_HEAD_CMD[self.repo_tool].format(
+            shlex.quote(self.repo_url)), timeout=timeout)
+        words = res.output.split()
+        if not res.success or not words:
+            return None
+
+        return words[0]
+
+    # An abbreviated hash is at least this long, see same_revision().
+    _MIN_HASH_LENGTH = 7
+
+    def same_revision(self, revision, other):
+        """Returns True if revision and other name the same revision.
+
+            A hash may be abbreviated (e.g. short hg ids), so one that the
+                other starts with matches, as long as both are hex and at
+                least _MIN_HASH_LENGTH long.  svn revisions are numbers and
+                only match exactly, e.g. 'r12' isn't 'r123'.
+        """
+        if not revision or not other:
+            return False
+
+        revision = revision.rstrip('+').lower()
+        other = other.rstrip('+').lower()
+        if self.repo_tool == RepoTool.SVN_TOOL:
+            return revision.lstrip('r') == other.lstrip('r')
+
+        if revision == other:
+            return True
+
+        hex_re = re.compile(f'[0-9a-f]{{{self._MIN_HASH_LENGTH:d},}}')
+        return (bool(hex_re.fullmatch(revision) and hex_re.fullmatch(other))
+                and (revision.startswith(other)
+                     or other.startswith(revision)))
+
+    def get_revision(self, path_str):
+        """Returns the revision checked out in path_str, or None if it can't
+            be determined.
+
+            The revision of a tarball is its SHA-256.
+        """
+        if self.repo_tool == RepoTool.CURL_TOOL:
+            try:
+                with open(os.path.join(path_str, tarball.MARKER)) as marker:
+                    return json.load(marker)['sha256']
+            except (OSError, ValueError, KeyError):
+                logging.warning("Couldn't get the checksum of '%s'",
+                                self.name)
+                return None
+
+        if self.repo_tool not in self._REPOTOOL_TO_REVISION_CMD:
+            return None
+
+        res = runner.run(self._REPOTOOL_TO_REVISION_CMD[self.repo_tool],
+                         cwd=path_str)
+        if not res.success:
+            logging.warning("Couldn't get the revision of '%s'", self.name)
+            return None
+
+        return res.output.strip()
+
+    def _get_head(self, path_str, which, timeout=None):
+        if self.repo_tool not in self._REPOTOOL_TO_HEAD_CMD:
+            return None
+
+        res = runner.run(self._REPOTOOL_TO_HEAD_CMD[self.repo_tool][which],
+                         cwd=path_str, timeout=timeout)
+        words = res.output.split()
+        if not res.success or not words:
+            return None
+
+        return words[0]
+
+    def get_remote_head(self, path_str, timeout=None):
+        """Returns the revision upstream of the checkout in path_str is at,
+            without fetching anything, or None if it can't be determined.
+        """
+        return self._get_head(path_str, 0, timeout)
+
+    def get_local_head(self, path_str):
+        """Returns the revision checked out in path_str, in the same form as
+            get_remote_head(), or None if it can't be determined.
+        """
+        return self._get_head(path_str, 1)
+
+    def get_dirty_files(self, path_str):
+        """Returns the files in the checkout in path_str that have local
+            modifications, or None if they can't be determined.
+        """
+        if self.repo_tool not in self._REPOTOOL_TO_STATUS_CMD:
+            return None
+
+        command_str, column = self._REPOTOOL_TO_STATUS_CMD[self.repo_tool]
+        res = runner.run(command_str, cwd=path_str)
+        if not res.success:
+            logging.warning("Couldn't get the status of '%s'", self.name)
+            return None
+
+        # A renamed file shows up as 'old -> new' in git.
+        return sorted(line[column:].split(' -> ')[-1]
+                      for line in res.output.splitlines()
+                      if line.strip())
+
+    def get_fingerprint(self, path_str):
+        """Returns a hash of the revision checked out in path_str and the
+            modification times of its dirty files, or None if it can't be
+            determined.
+        """
+        revision = self.get_revision(path_str)
+        dirty = self.get_dirty_files(path_str)
+        if revision is None or dirty is None:
+            return None
+
+        fingerprint = hashlib.sha256(revision.encode())
+        for file_str in dirty:
+            try:
+                stat = os.stat(os.path.join(path_str, file_str))
+            except FileNotFoundError:
+                stat_str = 'deleted'
+            else:
+                stat_str = f'{stat.st_mtime_ns:d}:{stat.st_size:d}'
+
+            fingerprint.update(f'\0{file_str:s}\0{stat_str:s}'.encode())
+
+        return fingerprint.hexdigest()
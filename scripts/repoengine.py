@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""Concurrent Repository Download/Update Engine"""
+
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+
+import runner
+import tarball
+from repobase import FetchMode, RepoTool
+from utils_ import vlogger
+
+class RepoResult(NamedTuple):
+    name: str
+    action: str
+    success: bool
+    duration: float
+    revision: str
+    output: str
+    # True if an update moved the checkout to another revision.
+    changed: bool = False
+
+class RepoEngine:
+    """Downloads and updates many repositories at once.
+
+        Which commands are run is decided by each repo's RepoTool and
+            RepoBase._REPOTOOL_TO_UPDATE_CMD, this only decides when and
+            where.  RepoTool.CURL_TOOL repos are fetched with tarballs, a
+            tarball.TarballFetcher, instead.
+
+        Pinned revisions (See checkout()) are checked out from mirrors when
+            given, as worktrees sharing the mirror's objects, so switching
+            revisions or checking one out in another repo_prefix doesn't
+            clone anything.  Updates fetch into the mirror and then update
+            the checkout from it, so upstream is only asked once.
+    """
+
+    def __init__(self,
+                 repo_prefix,
+                 max_workers=8,
+                 timeout=None,
+                 fetch_mode=FetchMode.FULL,
+                 mirrors=None,
+                 history=None,
+                 tarballs=None,
+                 remote_check=None):
+        self.repo_prefix = repo_prefix
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self.fetch_mode = fetch_mode
+        # A mirror.MirrorStore, or None to always download from repo_url.
+        self.mirrors = mirrors
+        # A buildhistory.BuildHistory downloads and updates are recorded in.
+        self.history = history
+        self.tarballs = tarballs
+        # A remotecheck.RemoteCheck, or None to always update.
+        self.remote_check = remote_check
+
+    def repo_dir(self, repo):
+        return Path(self.repo_prefix, repo.name)
+
+    def _run_commands(self, repo, action, commands, cwd):
+        start = time.monotonic()
+        run_results = []
+        success = True
+        for command in commands:
+            remaining = None
+            if self.timeout is not None:
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    logging.error("%s of '%s' timed out",
+                                  action.capitalize(), repo.name)
+                    success = False
+                    break
+
+            res = runner.run(command, cwd=cwd, timeout=remaining)
+            run_results.append(res)
+            if not res.success:
+                logging.error("'%s' failed for '%s' with exit code %d",
+                              command, repo.name, res.returncode)
+                success = False
+                break
+
+        if self.history and run_results:
+            self.history.record(repo.name, action, run_results)
+
+        output = ''.join(res.output for res in run_results)
+        if not success:
+            return RepoResult(repo.name, action, False,
+                              time.monotonic() - start, None, output)
+
+        # Exported checkouts have no VCS metadata left to ask.
+        revision = (None
+                    if (action == 'download'
+                        and self.fetch_mode == FetchMode.EXPORT)
+                    else repo.get_revision(self.repo_dir(repo)))
+        return RepoResult(repo.name, action, True, time.monotonic() - start,
+                          revision, output)
+
+    def _sync_mirror(self, repo):
+        if self.mirrors is None:
+            return None
+
+        return self.mirrors.sync(repo)
+
+    def _fetch_tarball(self, repo, action, sha256=None, before=None):
+        start = time.monotonic()
+        if self.tarballs is None:
+            return RepoResult(repo.name, action, False, 0.0, None,
+                              'No tarball fetcher')
+
+        try:
+            if action in ('download', 'checkout'):
+                sha256 = self.tarballs.fetch(repo.repo_url,
+                                             self.repo_dir(repo),
+                                             sha256 or repo.sha256)
+            else:
+                sha256 = (self.tarballs.update(repo.repo_url,
+                                               self.repo_dir(repo),
+                                               repo.sha256)
+                          or before)
+        except (OSError, tarball.ChecksumError) as emsg:
+            logging.error("%s of '%s' failed: %s", action.capitalize(),
+                          repo.name, emsg)
+            return RepoResult(repo.name, action, False,
+                              time.monotonic() - start, None, str(emsg))
+
+        duration = time.monotonic() - start
+        if self.history:
+            self.history.record(repo.name, action,
+                                runner.RunResult(repo.repo_url, 0, duration,
+                                                 ''))
+
+        return RepoResult(repo.name, action, True, duration, sha256, '')
+
+    def _download(self, repo):
+        if repo.repo_tool == RepoTool.CURL_TOOL:
+            return self._fetch_tarball(repo, 'download')
+
+        os.makedirs(self.repo_prefix, exist_ok=True)
+        commands = repo.get_download_commands(self.repo_dir(repo),
+                                              self.fetch_mode,
+                                              self._sync_mirror(repo))
+        logging.info("Downloading repo '%s'...", repo.name)
+        return self._run_commands(
+            repo, 'download', commands, self.repo_prefix)
+
+    def _update(self, repo):
+        repo_path = self.repo_dir(repo)
+        if not repo_path.is_dir():
+            logging.warning("'%s' has not been downloaded to '%s'",
+                            repo.name, repo_path)
+            return RepoResult(
+                repo.name, 'update', False, 0.0, None, 'Not downloaded')
+
+        start = time.monotonic()
+        before = repo.get_revision(repo_path)
+        if repo.repo_tool == RepoTool.CURL_TOOL:
+            res = self._fetch_tarball(repo, 'update', before=before)
+        elif self.remote_check and self.remote_check.is_current(repo,
+                                                                repo_path):
+            logging.info("'%s' is up to date", repo.name)
+            return RepoResult(repo.name, 'update', True,
+                              time.monotonic() - start, before, 'Up to date')
+        else:
+            # The mirror is what fetches from upstream, the checkout is
+            #   updated from it locally.
+            if self._sync_mirror(repo):
+                commands = self.mirrors.update_commands(repo)
+            else:
+                commands = repo.get_update_commands()
+
+            logging.info("Updating repo '%s'...", repo.name)
+            res = self._run_commands(repo, 'update', commands, repo_path)
+
+        return res._replace(changed=res.success and res.revision != before)
+
+    def _checkout(self, repo, revision):
+        repo_path = self.repo_dir(repo)
+        if repo.repo_tool == RepoTool.CURL_TOOL:
+            before = (repo.get_revision(repo_path)
+                      if repo_path.is_dir()
+                      else None)
+            res = self._fetch_tarball(repo, 'checkout', revision)
+            return res._replace(changed=res.success and res.revision != before)
+
+        start = time.monotonic()
+        before = None
+        if repo_path.is_dir():
+            before = repo.get_revision(repo_path)
+            if repo.same_revision(before, revision):
+                logging.info("'%s' is already at %s", repo.name, revision)
+                return RepoResult(repo.name, 'checkout', True,
+                                  time.monotonic() - start, before,
+                                  'Up to date')
+
+        mirror = None
+        if self.mirrors is not None and self.mirrors.has_mirror(repo):
+            mirror = self.mirrors.ensure(repo, revision)
+            if mirror is None:
+                logging.warning("The mirror of '%s' doesn't have %s, "
+                                'checking out without it', repo.name,
+                                revision)
+
+        if repo_path.is_dir():
+            cwd = repo_path
+            if mirror and self.mirrors.is_shared(repo, repo_path):
+                commands = self.mirrors.switch_commands(repo, revision)
+            else:
+                commands = repo.get_checkout_commands(revision)
+        else:
+            os.makedirs(self.repo_prefix, exist_ok=True)
+            cwd = self.repo_prefix
+            if mirror:
+                commands = self.mirrors.worktree_commands(repo, repo_path,
+                                                          revision)
+            else:
+                commands = repo.get_pinned_download_commands(repo_path,
+                                                             revision)
+
+        if commands is None:
+            return RepoResult(repo.name, 'checkout', False, 0.0, None,
+                              f"'{repo.repo_tool.value}' can't be pinned")
+
+        logging.info("Checking out '%s' at %s...", repo.name, revision)
+        res = self._run_commands(repo, 'checkout', commands, cwd)
+        if res.success and not repo.same_revision(res.revision, revision):
+            logging.error("'%s' is at %s instead of %s", repo.name,
+                          res.revision, revision)
+            res = res._replace(success=False)
+
+        return res._replace(changed=res.success and res.revision != before)
+
+    def _map(self, func, repos, action):
+        def _call(repo):
+            with vlogger.log_context(repo.name, action):
+                return func(repo)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = list(pool.map(_call, repos))
+
+        for res in results:
+            logging.info("%s of '%s' %s in %.1fs%s",
+                         res.action.capitalize(),
+                         res.name,
+                         'finished' if res.success else 'FAILED',
+                         res.duration,
+                         f' (revision {res.revision})' if res.revision else '')
+
+        return results
+
+    def download(self, repos):
+        """Downloads every repo in repos, returning a list of RepoResult."""
+        return self._map(self._download, repos, 'download')
+
+    def update(self, repos):
+        """Updates every repo in repos, returning a list of RepoResult."""
+        return self._map(self._update, repos, 'update')
+
+    def checkout(self, repos, revisions):
+        """Checks every repo in repos out at its revision in revisions (dict
+            of repo name to revision), downloading it if needed.  Returns a
+            list of RepoResult.
+        """
+        return self._map(lambda repo: self._checkout(repo,
+                                                     revisions[repo.name]),
+                         repos,
+                         'checkout')
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""FFmpeg Feature Resolver"""
+
+import itertools
+import logging
+from typing import NamedTuple
+
+from repobase import LICENSE_TO_SWITCHES
+
+class Resolution(NamedTuple):
+    # Libs to fetch and build, every lib after the ones it depends on.
+    libs: tuple
+    # FFmpeg configure switches the licenses of libs require.
+    switches: tuple
+
+class FeatureResolver:
+    """Works out which libs to build for the FFmpeg features wanted.
+
+        Every lib says what it 'provides' (e.g. 'h264-encode') and under which
+            'license' in its LIBRARY metadata, so nothing is imported.
+
+        Arguments, required:
+            repos: registry.LibraryRegistry the libs are looked up in.
+    """
+
+    # Past this many combinations of providers, pick one per feature
+    #   greedily instead of trying them all.
+    _MAX_COMBINATIONS = 4096
+
+    def __init__(self, repos):
+        self.repos = repos
+
+    @staticmethod
+    def normalize(feature):
+        """Returns feature in the form used by 'provides', e.g.
+            'H264 encode' -> 'h264-encode'.
+        """
+        return '-'.join(feature.lower().replace('_', ' ').split())
+
+    def features(self):
+        """Returns {feature: [names of the libs providing it]}."""
+        features = {}
+        for name in self.repos:
+            for feature in self.repos.metadata(name).get('provides', ()):
+                features.setdefault(feature, []).append(name)
+
+        return features
+
+    def _license(self, name):
+        return self.repos.metadata(name).get('license', 'lgpl')
+
+    def _allowed(self, name, allow):
+        """Returns True if the license of name only needs switches in
+            allow.
+        """
+        return all(switch[len('--enable-'):] in allow
+                   for switch in LICENSE_TO_SWITCHES[self._license(name)])
+
+    def closure(self, names):
+        """Returns names and everything they depend on, every lib after its
+            dependencies.
+        """
+        ordered = []
+        visiting = set()
+
+        def _visit(name):
+            if name in ordered:
+                return
+
+            if name in visiting:
+                raise ValueError(f'{name!r} depends on itself')
+
+            visiting.add(name)
+            for dep in self.repos.metadata(name).get('depends', ()):
+                _visit(dep.lower())
+
+            visiting.discard(name)
+            ordered.append(name)
+
+        for name in names:
+            _visit(name)
+
+        return ordered
+
+    def _candidates(self, feature, features, allow):
+        if feature in self.repos:
+            if not self._allowed(feature, allow):
+                raise ValueError(f'{feature!r} is {self._license(feature)} '
+                                 'licensed, which is not allowed')
+
+            return [feature]
+
+        if feature not in features:
+            raise ValueError(f'No lib provides {feature!r}.  Known features: '
+                             f"{', '.join(sorted(features))}")
+
+        allowed = [n for n in features[feature] if self._allowed(n, allow)]
+        if not allowed:
+            needed = sorted({s for n in features[feature]
+                             for s in LICENSE_TO_SWITCHES[self._license(n)]})
+            raise ValueError(f'{feature!r} is only provided by '
+                             f"{', '.join(features[feature])}, which "
+                             f"need {' or '.join(needed)}")
+
+        return allowed
+
+    def _cost(self, names):
+        """Sort key preferring fewer libs, then fewer license switches."""
+        switches = {s for n in names
+                    for s in LICENSE_TO_SWITCHES[self._license(n)]}
+        return (len(names), len(switches), sorted(names))
+
+    def _pick(self, candidates, allow):
+        def _usable(names):
+            return all(self._allowed(n, allow) for n in names)
+
+        combinations = 1
+        for names in candidates:
+            combinations *= len(names)
+
+        if combinations <= self._MAX_COMBINATIONS:
+            closures = [self.closure(dict.fromkeys(c))
+                        for c in itertools.product(*candidates)]
+        else:
+            chosen = []
+            for names in candidates:
+                if any(n in chosen for n in names):
+                    continue
+
+                usable = [n for n in names
+                          if _usable(self.closure(chosen + [n]))]
+                chosen.append(min(usable or names,
+                                  key=lambda n: self._cost(
+                                      self.closure(chosen + [n]))))
+
+            closures = [self.closure(chosen)]
+
+        closures = [c for c in closures if _usable(c)]
+        if not closures:
+            raise ValueError('Every lib providing those features depends on '
+                             'a lib whose license is not allowed')
+
+        return min(closures, key=self._cost)
+
+    def resolve(self, features, allow=()):
+        """Returns the Resolution with the fewest libs providing every one of
+            features.
+
+            Arguments, required:
+                features: Features (See features()) or lib names.
+
+            Arguments, optional:
+                allow: Licenses FFmpeg may be switched to, any of 'gpl',
+                    'version3' and 'nonfree'.  Libs needing any other are
+                    never picked.
+
+            Raises ValueError if a feature can't be provided.
+        """
+        known = self.features()
+        candidates = [self._candidates(self.normalize(f), known, allow)
+                      for f in features]
+        libs = self._pick(candidates, allow) if candidates else []
+
+        switches = tuple(dict.fromkeys(
+            s for n in libs for s in LICENSE_TO_SWITCHES[self._license(n)]))
+        if '--enable-nonfree' in switches and '--enable-gpl' in switches:
+            logging.warning('FFmpeg built with both --enable-gpl and '
+                            '--enable-nonfree can not be redistributed')
+
+        return Resolution(tuple(libs), switches)
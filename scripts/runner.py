@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""Command Runner"""
+
+import collections
+import gzip
+import logging
+import os
+import shlex
+import signal
+import subprocess
+import threading
+import time
+from typing import NamedTuple
+
+# Characters that only mean something to a shell.  Commands without any are
+#   split and run directly, saving a /bin/sh per command.
+_SHELL_CHARS = frozenset('|&;<>()$`\\"\'*?[]#~{}!')
+
+class RunResult(NamedTuple):
+    command: str
+    returncode: int
+    duration: float
+    output: str
+    # CPU time and peak RSS (KiB) of the child and every descendant it
+    #   waited for.
+    user: float = 0.0
+    sys: float = 0.0
+    maxrss: int = 0
+
+    @property
+    def success(self):
+        return self.returncode == 0
+
+# Children run() is waiting for, in any thread, see kill_all().
+_RUNNING = set()
+_RUNNING_LOCK = threading.Lock()
+_INTERRUPTED = threading.Event()
+
+def kill_all():
+    """Kills every command run() is running, along with everything they
+        started, and makes run() refuse to start any more.
+
+        Children are in sessions of their own, so Ctrl-C never reaches them,
+            and threads waiting for them would otherwise wait for them to
+            finish on their own.
+    """
+    _INTERRUPTED.set()
+    with _RUNNING_LOCK:
+        for proc in _RUNNING:
+            _kill_group(proc)
+
+def _kill_group(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+def to_argv(command):
+    """Returns command as an argv list, or None if it needs a shell.
+
+        command can already be a list, which is returned as is.
+    """
+    if not isinstance(command, str):
+        return list(command)
+
+    if '\n' in command:
+        return None
+
+    try:
+        argv = shlex.split(command)
+    except ValueError:
+        return None
+
+    # Quoting is fine as long as what's left after unquoting, e.g. the
+    #   -I/prefix/include of --extra-cflags='-I/prefix/include', doesn't need
+    #   a shell either.  '=' is only special in the first word, where it's a
+    #   variable assignment.
+    if not argv or '=' in argv[0]:
+        return None
+
+    if any(_SHELL_CHARS.intersection(arg) for arg in argv):
+        return None
+
+    return argv
+
+def _open_log(log_path):
+    os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+    # Compiler output compresses well even at the fastest level, and a slow
+    #   level would hold up the child whenever the pipe fills.
+    return gzip.open(log_path, 'wt', compresslevel=1, errors='replace')
+
+def run(command, cwd=None, env=None, timeout=None, log_path=None, tail=None,
+        pass_fds=()):
+    """Runs command and waits for it to finish.
+
+        Arguments, required:
+            command: argv list, or command string to run.  Strings that
+                don't use any shell syntax are split and run without a shell.
+
+        Arguments, optional:
+            cwd: Directory to run command in.  Unlike os.chdir(), this is
+                safe to use from several threads at once.
+
+            env: Environment for the child, defaults to our own.
+
+            timeout: Seconds to wait before the child, and everything it
+                started, is killed.
+
+            log_path: gzip file the output, stdout and stderr interleaved, is
+                streamed to line by line.  Replaced if it exists.
+
+            tail: Only keep the last tail lines of output in memory, for
+                commands with a lot of output.  Everything is kept if None.
+
+            pass_fds: File descriptors the child inherits, e.g. those of a
+                jobserver.JobServer.
+
+        Returns a RunResult.  A command that timed out has a returncode of
+            -1.
+    """
+    argv = to_argv(command)
+    if not isinstance(command, str):
+        command = shlex.join(argv)
+
+    logging.debug('Running: %s', command)
+    start = time.monotonic()
+    if _INTERRUPTED.is_set():
+        return RunResult(command, -1, 0.0, 'Interrupted\n')
+
+    # A new session lets a timeout kill the whole process tree.
+    try:
+        proc = subprocess.Popen(command if argv is None else argv,
+                                shell=argv is None,
+                                cwd=cwd,
+                                env=env,
+                                stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                start_new_session=True,
+                                pass_fds=pass_fds)
+    except OSError as emsg:
+        # What the shell would have said, e.g. for a missing program.
+        return RunResult(command, 127, time.monotonic() - start, f'{emsg}\n')
+
+    with _RUNNING_LOCK:
+        _RUNNING.add(proc)
+
+    timed_out = threading.Event()
+
+    def _on_timeout():
+        timed_out.set()
+        _kill_group(proc)
+
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(max(0.0, timeout), _on_timeout)
+        timer.daemon = True
+        timer.start()
+
+    lines = collections.deque(maxlen=tail)
+    log_file = None
+    try:
+        if log_path is not None:
+            log_file = _open_log(log_path)
+
+        for line in proc.stdout:
+            line = line.decode(errors='replace')
+            lines.append(line)
+            if log_file:
+                log_file.write(line)
+    except BaseException:
+        # Don't wait for it to finish on its own, e.g. on Ctrl-C.
+        _kill_group(proc)
+        raise
+    finally:
+        proc.stdout.close()
+        if log_file:
+            log_file.close()
+
+        # wait4() instead of Popen.wait() to get the resource usage of this
+        #   child only, which getrusage() can't do with several running.
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = (-os.WTERMSIG(status)
+                           if os.WIFSIGNALED(status)
+                           else os.WEXITSTATUS(status))
+        if timer:
+            timer.cancel()
+
+        with _RUNNING_LOCK:
+            _RUNNING.discard(proc)
+
+    returncode = proc.returncode
+    if timed_out.is_set():
+        logging.warning("'%s' timed out after %ss", command, timeout)
+        returncode = -1
+
+    return RunResult(command,
+                     returncode,
+                     time.monotonic() - start,
+                     ''.join(lines),
+                     rusage.ru_utime,
+                     rusage.ru_stime,
+                     rusage.ru_maxrss)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Dependency Graph Build Scheduler"""
+
+import heapq
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import NamedTuple
+
+class NodeResult(NamedTuple):
+    name: str
+    success: bool
+    start: float
+    end: float
+    skipped: bool = False
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+class BuildScheduler:
+    """Runs jobs concurrently, never starting one before its dependencies.
+
+        Jobs are added with add() and every job becomes a node in a DAG.
+        Dependencies that aren't part of the graph are assumed to already be
+        satisfied (e.g. a library that was built by a previous run).
+    """
+
+    # Using a 'NamedTuple' instead of a regular class because I want these
+    #   members to be constant.
+    class _Node(NamedTuple):
+        name: str
+        func: object
+        depends: tuple
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._nodes = {}
+        self.results = {}
+
+    def add(self, name, func, depends=()):
+        """Adds job name to the graph.
+
+            Arguments, required:
+                name: Unique name of the node.
+                func: Callable taking no arguments.  The job is considered
+                    to have failed if it returns a false value or raises.
+
+            Arguments, optional:
+                depends: Names of nodes that must succeed before func is
+                    called.
+        """
+        if name in self._nodes:
+            raise ValueError(f'{name!r} was already added to the graph')
+
+        self._nodes[name] = self._Node(name, func, tuple(depends))
+
+    def _deps(self, name):
+        return tuple(dep for dep in self._nodes[name].depends
+                     if dep in self._nodes)
+
+    def order(self):
+        """Returns the node names in topological order.
+
+            Raises ValueError if the graph contains a cycle.
+        """
+        for name, node in self._nodes.items():
+            for dep in node.depends:
+                if dep not in self._nodes:
+                    logging.debug("'%s' depends on '%s' which is not being "
+                                  'built, assuming it is available.',
+                                  name, dep)
+
+        indegree = {name: len(self._deps(name)) for name in self._nodes}
+        ready = [name for name, deg in indegree.items() if not deg]
+        ordered = []
+        while ready:
+            name = ready.pop(0)
+            ordered.append(name)
+            for other in self._nodes:
+                if name in self._deps(other):
+                    indegree[other] -= 1
+                    if not indegree[other]:
+                        ready.append(other)
+
+        if len(ordered) != len(self._nodes):
+            cycle = sorted(set(self._nodes) - set(ordered))
+            raise ValueError(f'Dependency cycle between: {cycle}')
+
+        return ordered
+
+    def _call(self, node):
+        start = time.monotonic()
+        try:
+            success = bool(node.func())
+        except Exception:
+            logging.exception("Job '%s' raised an exception", node.name)
+            success = False
+
+        return NodeResult(node.name, success, start, time.monotonic())
+
+    def run(self):
+        """Runs every node, returning a dict of name to NodeResult.
+
+            Nodes whose dependencies failed are not run, and are recorded as
+            skipped and unsuccessful.
+        """
+        pending = self.order()
+        self.results = {}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                for name in list(pending):
+                    deps = self._deps(name)
+                    if any(dep in self.results
+                           and not self.results[dep].success
+                           for dep in deps):
+                        logging.warning("Skipping '%s', a dependency failed",
+                                        name)
+                        now = time.monotonic()
+                        self.results[name] = NodeResult(
+                            name, False, now, now, skipped=True)
+                        pending.remove(name)
+                    elif all(dep in self.results for dep in deps):
+                        logging.debug("Starting '%s'", name)
+                        running[pool.submit(self._call,
+                                            self._nodes[name])] = name
+                        pending.remove(name)
+
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    self.results[result.name] = result
+                    del running[future]
+                    logging.info("Finished '%s' in %.1fs (%s)",
+                                 result.name,
+                                 result.duration,
+                                 'ok' if result.success else 'failed')
+
+        return self.results
+
+    def critical_path(self, durations=None):
+        """Returns (path, seconds) of the longest chain through the graph.
+
+            Arguments, optional:
+                durations: dict of node name to seconds.  Defaults to the
+                    durations recorded by the last call to run().
+        """
+        if durations is None:
+            durations = {name: res.duration
+                         for name, res in self.results.items()}
+
+        finish = {}
+        prev = {}
+        for name in self.order():
+            deps = self._deps(name)
+            best = max(deps, key=lambda d: finish[d], default=None)
+            prev[name] = best
+            finish[name] = ((finish[best] if best else 0.0)
+                            + durations.get(name, 0.0))
+
+        if not finish:
+            return [], 0.0
+
+        name = max(finish, key=finish.get)
+        total = finish[name]
+        path = []
+        while name:
+            path.insert(0, name)
+            name = prev[name]
+
+        return path, total
+
+    def estimate_wall(self, durations, max_workers=None):
+        """Returns the seconds run() would take if every node took as long as
+            durations (dict of node name to seconds) says.
+
+            Arguments, optional:
+                max_workers: Jobs run at once, defaults to the scheduler's.
+        """
+        workers = max_workers or self.max_workers
+        pending = self.order()
+        done = set()
+        running = []
+        now = 0.0
+        while pending or running:
+            for name in list(pending):
+                if len(running) >= workers:
+                    break
+
+                if all(dep in done for dep in self._deps(name)):
+                    heapq.heappush(running,
+                                   (now + durations.get(name, 0.0), name))
+                    pending.remove(name)
+
+            now, name = heapq.heappop(running)
+            done.add(name)
+
+        return now
+
+    def report(self):
+        """Prints a summary of the last run, including the critical path."""
+        if not self.results:
+            return
+
+        width = max(len(n) for n in self.results)
+        for name in self.order():
+            res = self.results[name]
+            status_str = ('skipped' if res.skipped
+                          else ('ok' if res.success else 'FAILED'))
+            print(f'{name:<{width}s} {res.duration:7.1f}s {status_str:s}')
+
+        path, total = self.critical_path()
+        wall = (max(r.end for r in self.results.values())
+                - min(r.start for r in self.results.values()))
+        print(f'Critical path ({total:.1f}s of {wall:.1f}s wall): '
+              f"{' -> '.join(path):s}")
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""Release Tarball Fetcher"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Written into every extracted tarball, see RepoBase.get_revision().
+MARKER = '.ffscript-tarball.json'
+
+class ChecksumError(Exception):
+    pass
+
+def _inside(root_str, path_str):
+    return os.path.commonpath([root_str, path_str]) == root_str
+
+def extract_all(tar, dest_str):
+    """Extracts every member of tar, which may be a stream, into dest_str.
+
+        Members that would end up outside of dest_str, through absolute
+            paths, '..' or links, and device files are refused with a
+            tarfile.TarError, as archives may come from anywhere.
+    """
+    if hasattr(tarfile, 'data_filter'):
+        tar.extractall(dest_str, filter='data')
+        return
+
+    root_str = os.path.realpath(dest_str)
+    for member in tar:
+        path_str = os.path.realpath(os.path.join(root_str, member.name))
+        link_str = None
+        if member.issym():
+            link_str = os.path.realpath(os.path.join(
+                os.path.dirname(path_str), member.linkname))
+        elif member.islnk():
+            link_str = os.path.realpath(os.path.join(root_str,
+                                                     member.linkname))
+
+        if (not _inside(root_str, path_str)
+                or (link_str and not _inside(root_str, link_str))
+                or member.isdev()):
+            raise tarfile.TarError(f'{member.name!r} would be extracted '
+                                   f'outside of {dest_str!r}')
+
+        tar.extract(member, root_str)
+
+class _ChunkReader:
+    """File-like view of a file that is being downloaded in chunks, in any
+        order.  read() waits until the bytes it returns have arrived, so the
+        file can be extracted and hashed while it is still downloading.
+
+        size is infinite until finished() if it isn't known up front.
+    """
+
+    def __init__(self, path, size, chunk_size, done=()):
+        self.size = size
+        self.chunk_size = chunk_size
+        self.sha256 = hashlib.sha256()
+        self._fd = os.open(path, os.O_RDONLY)
+        self._pos = 0
+        self._done = set(done)
+        # Bytes from the start of the file that have all arrived.
+        self._ready = 0
+        self._error = None
+        self._cond = threading.Condition()
+        self._advance()
+
+    def _advance(self):
+        while (self._ready < self.size
+               and self._ready // self.chunk_size in self._done):
+            self._ready = min(self.size, self._ready + self.chunk_size)
+
+    def chunk_done(self, index):
+        with self._cond:
+            self._done.add(index)
+            self._advance()
+            self._cond.notify_all()
+
+    def grew(self, ready):
+        """Marks the first ready bytes as arrived, for files that are
+            downloaded in order rather than in chunks.
+        """
+        with self._cond:
+            self._ready = ready
+            self._cond.notify_all()
+
+    def finished(self, size):
+        with self._cond:
+            self.size = size
+            self._cond.notify_all()
+
+    def fail(self, error):
+        with self._cond:
+            self._error = error
+            self._cond.notify_all()
+
+    def read(self, size=-1):
+        with self._cond:
+            while self._ready <= self._pos < self.size and not self._error:
+                self._cond.wait()
+
+            if self._error:
+                raise self._error
+
+            end = self._ready if size < 0 else min(self._ready,
+                                                   self._pos + size)
+
+        data = os.pread(self._fd, end - self._pos, self._pos)
+        self._pos += len(data)
+        self.sha256.update(data)
+        return data
+
+    def drain(self):
+        """Reads, and hashes, whatever extracting didn't need."""
+        while self.read(1 << 20):
+            pass
+
+    def close(self):
+        os.close(self._fd)
+
+class TarballFetcher:
+    """Downloads and extracts release tarballs.
+
+        Tarballs are downloaded over several connections at once with HTTP
+            range requests, into a partial file that lets an interrupted
+            download resume where it stopped.  They are extracted, and hashed,
+            while downloading.
+
+        Every tarball is kept in cache_dir by its SHA-256, so a lib that
+            declares its checksum is never downloaded twice.  The ETag and
+            Last-Modified of each URL are kept as well, so that updating only
+            downloads a tarball again if the server says it changed.
+
+        Arguments, required:
+            cache_dir: Directory tarballs and partial downloads are kept in.
+
+        Arguments, optional:
+            connections: Connections used per tarball.
+            chunk_size: Bytes fetched by each range request.
+            timeout: Seconds before a stalled connection is given up on.
+    """
+
+    def __init__(self, cache_dir, connections=4, chunk_size=4 << 20,
+                 timeout=60):
+        self.cache_dir = Path(cache_dir)
+        self.connections = max(1, connections)
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+    @staticmethod
+    def _url_id(url):
+        return hashlib.sha1(url.encode()).hexdigest()
+
+    def _object_path(self, sha256):
+        return self.cache_dir / 'objects' / sha256
+
+    def _meta_path(self, url):
+        return self.cache_dir / 'urls' / f'{self._url_id(url):s}.json'
+
+    def _part_paths(self, url):
+        part_dir = self.cache_dir / 'partial'
+        return (part_dir / f'{self._url_id(url):s}.part',
+                part_dir / f'{self._url_id(url):s}.json')
+
+    @staticmethod
+    def _load_json(path):
+        try:
+            with open(path) as json_file:
+                return json.load(json_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    @staticmethod
+    def _save_json(path, data):
+        os.makedirs(path.parent, exist_ok=True)
+        fd, tmp_str = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'w') as json_file:
+            json.dump(data, json_file)
+
+        os.replace(tmp_str, path)
+
+    def _open(self, url, method='GET', headers=None):
+        # urllib.request brings in http.client, ssl and email, which
+        #   everything importing this module (e.g. for MARKER) would pay for
+        #   otherwise.
+        import urllib.request
+        request = urllib.request.Request(url, method=method,
+                                         headers=headers or {})
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def _open_if_changed(self, url, meta=None, method='GET'):
+        """Returns the response to a request for url, or None if meta (What
+            was saved the last time url was fetched) is still current.
+        """
+        headers = {}
+        if meta and meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta and meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+        try:
+            return self._open(url, method, headers)
+        except urllib.error.HTTPError as emsg:
+            if emsg.code == 304:
+                return None
+
+            raise
+
+    def _head(self, url):
+        with self._open_if_changed(url, method='HEAD') as resp:
+            return resp.headers
+
+    def _fetch_chunk(self, url, part_fd, index, size, reader):
+        start = index * self.chunk_size
+        end = min(size, start + self.chunk_size) - 1
+        with self._open(url,
+                        headers={'Range': f'bytes={start:d}-{end:d}'}) as resp:
+            if resp.status != 206:
+                raise OSError(f'{url:s} ignored a range request')
+
+            offset = start
+            while True:
+                data = resp.read(1 << 16)
+                if not data:
+                    break
+
+                offset += os.pwrite(part_fd, data, offset)
+
+        if offset != end + 1:
+            raise OSError(f'{url:s} sent {offset - start:d} bytes of a '
+                          f'{end + 1 - start:d} byte range')
+
+        reader.chunk_done(index)
+        return index
+
+    def _fetch_stream(self, url, part_fd, reader, resp=None):
+        with resp or self._open(url) as resp:
+            offset = 0
+            while True:
+                data = resp.read(1 << 16)
+                if not data:
+                    break
+
+                offset += os.pwrite(part_fd, data, offset)
+                reader.grew(offset)
+
+        reader.finished(offset)
+
+    def _download(self, url, resp, part_path, state_path, reader, state):
+        lock = threading.Lock()
+        with open(part_path, 'r+b') as part_file:
+            part_fd = part_file.fileno()
+            if not state['ranges']:
+                self._fetch_stream(url, part_fd, reader, resp)
+                return
+
+            def _fetch(index):
+                self._fetch_chunk(url, part_fd, index, state['size'], reader)
+                with lock:
+                    state['done'].append(index)
+                    self._save_json(state_path, state)
+
+            todo = [i for i in range(-(-state['size'] // self.chunk_size))
+                    if i not in state['done']]
+            if len(todo) != -(-state['size'] // self.chunk_size):
+                logging.info('Resuming download of %s, %d of %d chunks left',
+                             url, len(todo),
+                             -(-state['size'] // self.chunk_size))
+
+            with ThreadPoolExecutor(self.connections) as pool:
+                for future in [pool.submit(_fetch, i) for i in todo]:
+                    future.result()
+
+    @staticmethod
+    def _install(extract_str, dest):
+        """Moves what was extracted into dest, dropping the usual single top
+            level directory, e.g. 'lame-3.100/'.
+        """
+        entries = os.listdir(extract_str)
+        src_str = extract_str
+        if (len(entries) == 1
+                and os.path.isdir(os.path.join(extract_str, entries[0]))):
+            src_str = os.path.join(extract_str, entries[0])
+
+        if os.path.lexists(dest):
+            shutil.rmtree(dest)
+
+        os.replace(src_str, dest)
+
+    def _extract_cached(self, sha256, dest):
+        extract_str = tempfile.mkdtemp(dir=Path(dest).parent,
+                                       prefix='.extract-')
+        try:
+            with tarfile.open(self._object_path(sha256)) as tar:
+                extract_all(tar, extract_str)
+
+            self._install(extract_str, dest)
+        finally:
+            shutil.rmtree(extract_str, ignore_errors=True)
+
+    def _write_marker(self, dest, url, sha256, headers):
+        with open(Path(dest, MARKER), 'w') as marker_file:
+            json.dump({'url': url,
+                       'sha256': sha256,
+                       'etag': headers.get('ETag') if headers else None},
+                      marker_file)
+
+    def fetch(self, url, dest, sha256=None, resp=None):
+        """Downloads the tarball at url and extracts it to dest, replacing
+            whatever is there.
+
+            Arguments, required:
+                url: URL of the tarball.
+                dest: Directory the contents of the tarball end up in.
+
+            Arguments, optional:
+                sha256: Expected checksum.  Nothing is extracted to dest if it
+                    doesn't match.
+                resp: Response to a GET of url already made.  Its body is
+                    used unless the tarball is fetched in ranges.
+
+            Returns the SHA-256 of the tarball.  Raises ChecksumError or
+                OSError on failure.
+        """
+        os.makedirs(Path(dest).parent, exist_ok=True)
+        if sha256 and self._object_path(sha256).is_file():
+            if resp:
+                resp.close()
+
+            logging.info('Extracting %s from the tarball cache', url)
+            self._extract_cached(sha256, dest)
+            self._write_marker(dest, url, sha256, None)
+            return sha256
+
+        headers = resp.headers if resp else self._head(url)
+        size = int(headers.get('Content-Length') or 0)
+        ranges = (headers.get('Accept-Ranges') == 'bytes' and size > 0)
+        if ranges and resp:
+            resp.close()
+            resp = None
+        part_path, state_path = self._part_paths(url)
+        state = self._load_state(state_path, part_path, headers, size)
+        state['ranges'] = ranges
+        if not part_path.exists():
+            os.makedirs(part_path.parent, exist_ok=True)
+            with open(part_path, 'wb') as part_file:
+                part_file.truncate(size)
+
+        self._save_json(state_path, state)
+        reader = _ChunkReader(part_path, size if ranges else float('inf'),
+                              self.chunk_size,
+                              state['done'] if ranges else ())
+        extract_str = tempfile.mkdtemp(dir=Path(dest).parent,
+                                       prefix='.extract-')
+        try:
+            actual = self._fetch_and_extract(url, resp, part_path,
+                                             state_path, reader, state,
+                                             extract_str)
+            if sha256 and actual != sha256:
+                os.remove(part_path)
+                os.remove(state_path)
+                raise ChecksumError(f'{url:s} has SHA-256 {actual:s}, '
+                                    f'expected {sha256:s}')
+
+            self._install(extract_str, dest)
+        finally:
+            if resp:
+                resp.close()
+
+            reader.close()
+            shutil.rmtree(extract_str, ignore_errors=True)
+
+        self._write_marker(dest, url, actual, headers)
+        os.makedirs(self._object_path(actual).parent, exist_ok=True)
+        os.replace(part_path, self._object_path(actual))
+        os.remove(state_path)
+        self._save_json(self._meta_path(url),
+                        {'sha256': actual,
+                         'etag': headers.get('ETag'),
+                         'last_modified': headers.get('Last-Modified')})
+        return actual
+
+    @staticmethod
+    def _load_state(state_path, part_path, headers, size):
+        """Returns what was downloaded of url so far, if it's of the same
+            file as headers describe.
+        """
+        state = TarballFetcher._load_json(state_path)
+        if (state
+                and state.get('size') == size
+                and state.get('etag') == headers.get('ETag')
+                and state.get('last_modified') == headers.get('Last-Modified')
+                and state.get('ranges')
+                and part_path.exists()):
+            return state
+
+        if part_path.exists():
+            os.remove(part_path)
+
+        return {'size': size,
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'done': []}
+
+    def _fetch_and_extract(self, url, resp, part_path, state_path, reader,
+                           state, extract_str):
+        with ThreadPoolExecutor(1) as pool:
+            download = pool.submit(self._download, url, resp, part_path,
+                                   state_path, reader, state)
+            download.add_done_callback(
+                lambda f: f.exception() and reader.fail(f.exception()))
+            try:
+                with tarfile.open(fileobj=reader, mode='r|*') as tar:
+                    extract_all(tar, extract_str)
+
+                reader.drain()
+            except tarfile.TarError as emsg:
+                # Most likely not a tarball at all, but the download should
+                #   still finish so the checksum tells what it was.
+                download.result()
+                raise ChecksumError(f"{url:s} couldn't be extracted: {emsg}")
+
+            download.result()
+
+        return reader.sha256.hexdigest()
+
+    def update(self, url, dest, sha256=None):
+        """Fetches url to dest again if it changed since it was last fetched.
+
+            A single conditional GET is made: the server answers 304 if the
+                tarball is unchanged, or sends it, which is what's extracted
+                unless it can be fetched in ranges.
+
+            Returns the SHA-256 of the tarball, or None if it didn't change.
+        """
+        meta = self._load_json(self._meta_path(url))
+        marker = self._load_json(Path(dest, MARKER))
+        current = marker.get('sha256') if marker else None
+        if sha256 and sha256 == current:
+            logging.info('%s is already at its pinned checksum', url)
+            return None
+
+        resp = self._open_if_changed(url, meta if current and meta
+                                     and meta.get('sha256') == current
+                                     else None)
+        if resp is None:
+            logging.info('%s is unchanged', url)
+            return None
+
+        if (not sha256 and current and meta
+                and resp.headers.get('ETag')
+                and resp.headers.get('ETag') == meta.get('etag')):
+            # The server ignored the condition, but said enough to tell.
+            resp.close()
+            logging.info('%s is unchanged', url)
+            return None
+
+        return self.fetch(url, dest, sha256, resp)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Toolchain Identity"""
+
+import hashlib
+import json
+import logging
+import os
+import shlex
+from functools import lru_cache
+
+import runner
+
+# Environment variables that change what a build produces.
+ENV_FLAGS = ('CC', 'CXX', 'AS', 'CFLAGS', 'CXXFLAGS', 'CPPFLAGS', 'ASFLAGS',
+             'LDFLAGS', 'LIBS')
+
+# Compiler wrappers that never change what a build produces.
+WRAPPERS = ('ccache', 'sccache')
+
+def strip_wrappers(command_str):
+    """Returns command_str without any leading compiler WRAPPERS."""
+    words = shlex.split(command_str)
+    while words and os.path.basename(words[0]) in WRAPPERS:
+        words.pop(0)
+
+    return ' '.join(words)
+
+@lru_cache(maxsize=None)
+def _version_of(cc_str):
+    res = runner.run(f'{cc_str:s} --version')
+    if not res.success:
+        logging.warning("Couldn't get the version of '%s'", cc_str)
+        return cc_str
+
+    return res.output.strip().splitlines()[0]
+
+@lru_cache(maxsize=None)
+def _machine_of(cc_str):
+    res = runner.run(f'{cc_str:s} -dumpmachine')
+    return res.output.strip() if res.success else 'unknown'
+
+def compiler_identity(env=None):
+    """Returns a string identifying the C compiler env would use.
+
+        Only the compiler itself is used, wrappers such as ccache are
+            ignored so they don't change the identity.
+    """
+    env = os.environ if env is None else env
+    cc_str = strip_wrappers(env.get('CC', 'cc')) or 'cc'
+    return f'{_version_of(cc_str):s} ({_machine_of(cc_str):s})'
+
+def compiler_family(env=None):
+    """Returns 'clang' or 'gcc', whichever the C compiler env would use is,
+        or None if it's neither, going by the macros it predefines so
+        compilers installed as 'cc' are recognized too.
+    """
+    env = os.environ if env is None else env
+    return _family_of(strip_wrappers(env.get('CC', 'cc')) or 'cc')
+
+@lru_cache(maxsize=None)
+def _family_of(cc_str):
+    res = runner.run(f'{cc_str:s} -dM -E -x c /dev/null')
+    if not res.success:
+        logging.warning("Couldn't get the macros of '%s'", cc_str)
+        return None
+
+    macros = {line.split()[1] for line in res.output.splitlines()
+              if line.startswith('#define ')}
+    if '__clang__' in macros:
+        return 'clang'
+
+    return 'gcc' if '__GNUC__' in macros else None
+
+def env_flags(env=None):
+    """Returns a dict of the ENV_FLAGS that are set in env."""
+    env = os.environ if env is None else env
+    flags = {k: env[k] for k in ENV_FLAGS if env.get(k)}
+    for k in ('CC', 'CXX'):
+        if k in flags:
+            flags[k] = strip_wrappers(flags[k])
+
+    return flags
+
+def toolchain_id(env=None):
+    """Returns a short hash of the compiler identity and env_flags()."""
+    blob = json.dumps([compiler_identity(env), env_flags(env)],
+                      sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()[:16]
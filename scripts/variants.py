@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Library Build Variants"""
+
+def parse_options(lib, options_str):
+    """Returns the variant of lib options_str asks for, as a tuple of
+        (option, value) sorted by option, e.g.
+        'chroma-format=420,bit-depth=10' ->
+        (('bit-depth', '10'), ('chroma-format', '420')).
+
+        Options are given by name, key or alias, so the same variant always
+            comes out the same however it was written.
+
+        Raises ValueError if an option isn't a keyword argument of lib, or
+            the value isn't one it accepts.
+    """
+    options = {}
+    for option_str in filter(None, (o.strip()
+                                    for o in options_str.split(','))):
+        key, sep, value = option_str.partition('=')
+        if not sep or not lib.options.has_kwarg(key.strip()):
+            raise ValueError(f'{lib.name:s}: {option_str!r} is not a '
+                             'valid option=value')
+
+        name = lib.options.get_kwarg(key.strip()).name
+        _, errors = lib.options.validate((), {name: value.strip()})
+        if errors:
+            raise ValueError(f'{lib.name:s}: {errors[0][1]:s}')
+
+        options[name] = value.strip()
+
+    return tuple(sorted(options.items()))
+
+def variant_name(name, options):
+    """Returns the name of the variant of lib name configured with options,
+        e.g. 'libx264@bit-depth=10'.  Just name without options.
+    """
+    if not options:
+        return name
+
+    return f"{name:s}@{','.join(f'{k:s}={v:s}' for k, v in options):s}"
+
+class LibVariant:
+    """A lib configured with options on top of its own, e.g. libx264 with
+        bit-depth=10, built from the same checkout as the lib.
+
+        Anything not overridden here is the lib's.  Its name tells the
+            variants of a lib apart, so each has its own logs, incremental
+            state, artifact cache entries and build directory.
+
+        Arguments, required:
+            lib: RepoBase configured.
+            options: (option, value) pairs, see parse_options().
+
+        Arguments, optional:
+            install_prefix: Where the variant is installed, None for wherever
+                everything else is.
+    """
+
+    def __init__(self, lib, options, install_prefix=None):
+        self.lib = lib
+        self.variant = tuple(options)
+        self.install_prefix = install_prefix
+        self.name = variant_name(lib.name, self.variant)
+
+    def __getattr__(self, attr):
+        return getattr(self.lib, attr)
+
+    def get_config(self, *args, **kwargs):
+        return self.lib.get_config(*args, **{**dict(self.variant), **kwargs})
+
+    def get_build_commands(self, *args, **kwargs):
+        return self.lib.get_build_commands(*args,
+                                           **{**dict(self.variant),
+                                              **kwargs})
@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+"""Watch Mode Rebuild Daemon"""
+
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import json
+import logging
+import os
+import select
+import socket
+import struct
+import threading
+import time
+from pathlib import Path
+
+import scheduler
+from builder import FFmpegSource
+
+# What FFmpeg's sources are made of, as opposed to what building it in
+#   tree leaves next to them, see _source_fingerprint().
+_SOURCE_SUFFIXES = frozenset(('.c', '.h', '.S', '.asm', '.inc', '.m', '.cpp',
+                              '.cl', '.cu', '.comp', '.metal', '.v', '.mak',
+                              '.texi', '.sh', '.pl'))
+_SOURCE_NAMES = frozenset(('Makefile', 'configure', 'VERSION', 'RELEASE'))
+
+def _skip_dir(name):
+    # VCS metadata, and whatever else hides in dot dirs, is never a source.
+    return name.startswith('.')
+
+class InotifyWatcher:
+    """Reports the files changed under a set of roots, using inotify through
+        libc, so nothing is scanned.
+
+        Raises OSError if inotify isn't available, or a root has more
+            directories than inotify is allowed to watch.
+    """
+
+    _IN_NONBLOCK = 0o4000
+    _IN_CLOEXEC = 0o2000000
+
+    _IN_MODIFY = 0x002
+    _IN_ATTRIB = 0x004
+    _IN_CLOSE_WRITE = 0x008
+    _IN_MOVED_FROM = 0x040
+    _IN_MOVED_TO = 0x080
+    _IN_CREATE = 0x100
+    _IN_DELETE = 0x200
+    _IN_Q_OVERFLOW = 0x4000
+    _IN_IGNORED = 0x8000
+    _IN_ISDIR = 0x40000000
+
+    _MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM
+             | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE)
+
+    # struct inotify_event without its name.
+    _EVENT = struct.Struct('iIII')
+
+    name = 'inotify'
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        try:
+            self._add_watch = libc.inotify_add_watch
+            init = libc.inotify_init1
+        except AttributeError as emsg:
+            raise OSError(errno.ENOSYS, 'inotify is not available') from emsg
+
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p,
+                                    ctypes.c_uint32)
+        self._fd = init(self._IN_NONBLOCK | self._IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        # Watch descriptor to the directory it watches.
+        self._dirs = {}
+        self.roots = []
+
+    def _watch_dir(self, dir_str):
+        wd = self._add_watch(self._fd, os.fsencode(dir_str), self._MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"Can't watch '{dir_str}': "
+                               f'{os.strerror(err)}')
+
+        self._dirs[wd] = dir_str
+
+    def _watch_tree(self, root_str):
+        for dir_str, dirs, _ in os.walk(root_str):
+            dirs[:] = [d for d in dirs if not _skip_dir(d)]
+            self._watch_dir(dir_str)
+
+    def add(self, root):
+        self.roots.append(str(root))
+        self._watch_tree(str(root))
+
+    def wait(self, timeout):
+        """Returns the paths changed within timeout seconds, an empty set if
+            none were.
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self._EVENT.unpack_from(data, offset)
+                offset += self._EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & self._IN_Q_OVERFLOW:
+                    # Events were lost, so anything may have changed.
+                    logging.warning('inotify queue overflowed')
+                    changed.update(self.roots)
+                    continue
+
+                dir_str = self._dirs.get(wd)
+                if mask & self._IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    continue
+
+                if dir_str is None:
+                    continue
+
+                path_str = os.path.join(dir_str, os.fsdecode(name))
+                if mask & self._IN_ISDIR:
+                    if _skip_dir(os.fsdecode(name)):
+                        continue
+
+                    if mask & (self._IN_CREATE | self._IN_MOVED_TO):
+                        try:
+                            self._watch_tree(path_str)
+                        except OSError as emsg:
+                            logging.warning('%s', emsg)
+
+                changed.add(path_str)
+
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+class PollWatcher:
+    """Reports the files changed under a set of roots by comparing their
+        modification times every interval seconds.  Used where inotify
+        isn't available.
+    """
+
+    name = 'poll'
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.roots = []
+        self._snapshot = {}
+
+    @staticmethod
+    def _scan(root_str):
+        snapshot = {}
+        for dir_str, dirs, files in os.walk(root_str):
+            dirs[:] = [d for d in dirs if not _skip_dir(d)]
+            for name in files:
+                path_str = os.path.join(dir_str, name)
+                try:
+                    stat = os.stat(path_str)
+                except FileNotFoundError:
+                    continue
+
+                snapshot[path_str] = (stat.st_mtime_ns, stat.st_size)
+
+        return snapshot
+
+    def add(self, root):
+        self.roots.append(str(root))
+        self._snapshot.update(self._scan(str(root)))
+
+    def wait(self, timeout):
+        time.sleep(min(self.interval, timeout))
+        snapshot = {}
+        for root_str in self.roots:
+            snapshot.update(self._scan(root_str))
+
+        changed = {p for p in snapshot.keys() | self._snapshot.keys()
+                   if snapshot.get(p) != self._snapshot.get(p)}
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+def _source_fingerprint(root):
+    """Returns a hash of the modification times of the sources under root,
+        for trees that aren't checkouts to ask.  Build outputs, e.g. objects
+        and programs, are left out so building doesn't change it.
+    """
+    fingerprint = hashlib.sha256()
+    for path_str, (mtime, size) in sorted(
+            PollWatcher._scan(str(root)).items()):
+        name = os.path.basename(path_str)
+        if (name in _SOURCE_NAMES
+                or os.path.splitext(name)[1] in _SOURCE_SUFFIXES):
+            fingerprint.update(f'{path_str:s}\0{mtime:d}:{size:d}\0'
+                               .encode())
+
+    return fingerprint.hexdigest()
+
+def get_watcher(poll=False, interval=1.0):
+    """Returns an InotifyWatcher, or a PollWatcher if poll is set or inotify
+        isn't available.
+    """
+    if not poll:
+        try:
+            return InotifyWatcher()
+        except OSError as emsg:
+            logging.warning('%s, polling for changes instead', emsg)
+
+    return PollWatcher(interval)
+
+class WatchDaemon:
+    """Rebuilds libs as their sources change, then relinks FFmpeg.
+
+        Changes are collected until none happened for debounce seconds, so
+            a checkout or a save of many files starts a single rebuild.  Only
+            the libs changed and the libs depending on them are rebuilt, with
+            lib_builder, which should be incremental (See
+            LibBuilder.state_dir) to only rerun make.
+
+        Changes to a tree that don't change its fingerprint (See
+            RepoBase.get_fingerprint()), e.g. build outputs, don't rebuild
+            it.  Trees are fingerprinted as their builds start, so sources
+            saved while building are rebuilt right after.  FFmpeg sources
+            that aren't a git checkout are fingerprinted by the modification
+            times of their source files (See _SOURCE_SUFFIXES).
+
+        The status of the daemon is sent as JSON to whatever connects to
+            socket_path.  Sending 'stop' stops the daemon.
+
+        Arguments, required:
+            lib_builder: builder.LibBuilder building the libs and FFmpeg.
+            libs: Libs to watch, from repo_prefix.
+            socket_path: Unix socket the status is served on.
+
+        Arguments, optional:
+            ffmpeg_src: FFmpeg source to watch and relink, None to only build
+                the libs.
+            watcher: InotifyWatcher or PollWatcher, defaults to get_watcher().
+            debounce: Seconds without changes before rebuilding.
+            max_workers: Libs built at once.
+    """
+
+    def __init__(self,
+                 lib_builder,
+                 libs,
+                 socket_path,
+                 ffmpeg_src=None,
+                 watcher=None,
+                 debounce=1.0,
+                 max_workers=None):
+        self.lib_builder = lib_builder
+        self.libs = {lib.name: lib for lib in libs}
+        self.socket_path = Path(socket_path)
+        self.ffmpeg_src = ffmpeg_src
+        self.watcher = watcher or get_watcher()
+        self.debounce = debounce
+        self.max_workers = max_workers
+        self._roots = {name: self.lib_builder.source_dir(lib)
+                       for name, lib in self.libs.items()}
+        if ffmpeg_src is not None:
+            self._roots['ffmpeg'] = Path(ffmpeg_src)
+
+        self._ffmpeg_source = None
+        if ffmpeg_src is not None and Path(ffmpeg_src, '.git').exists():
+            self._ffmpeg_source = FFmpegSource()
+
+        # Fingerprint of every tree as of its last build.
+        self._fingerprints = {}
+        # Trees that changed while they were being built.
+        self._pending = set()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._status = {'state': 'starting',
+                        'watcher': self.watcher.name,
+                        'watching': sorted(self._roots),
+                        'pending': [],
+                        'building': [],
+                        'builds': 0,
+                        'failures': 0,
+                        'last': None}
+
+    def _set_status(self, **kwargs):
+        with self._lock:
+            self._status.update(kwargs)
+
+    def status(self):
+        with self._lock:
+            return dict(self._status)
+
+    def _owner(self, path_str):
+        """Returns the name of the tree path_str is in, or None."""
+        path = Path(path_str)
+        for name, root in self._roots.items():
+            if path == root or root in path.parents:
+                return name
+
+        return None
+
+    def _fingerprint(self, name):
+        if name == 'ffmpeg':
+            return (self._ffmpeg_source.get_fingerprint(self._roots[name])
+                    if self._ffmpeg_source
+                    else _source_fingerprint(self._roots[name]))
+
+        return self.libs[name].get_fingerprint(self._roots[name])
+
+    def dependents(self, names):
+        """Returns names and every watched lib depending on them, directly or
+            not.
+        """
+        affected = set(names)
+        grew = True
+        while grew:
+            grew = False
+            for name, lib in self.libs.items():
+                if name not in affected and affected & set(lib.depends):
+                    affected.add(name)
+                    grew = True
+
+        return affected
+
+    def _changed(self, paths):
+        """Returns the names of the trees whose sources changed in paths."""
+        names = set()
+        for path_str in paths:
+            name = self._owner(path_str)
+            if name is not None:
+                names.add(name)
+
+        for name in sorted(names):
+            fingerprint = self._fingerprint(name)
+            if (fingerprint is not None
+                    and fingerprint == self._fingerprints.get(name)):
+                logging.debug("'%s' changed, but not its sources", name)
+                names.discard(name)
+
+        return names
+
+    def _collect(self):
+        """Blocks until sources changed and then stayed unchanged for
+            debounce seconds, returning the names of the trees changed.
+        """
+        changed, self._pending = self._pending, set()
+        while not self._stop.is_set():
+            paths = self.watcher.wait(self.debounce if changed else 1.0)
+            if paths:
+                changed.update(self._changed(paths))
+                self._set_status(pending=sorted(changed))
+            elif changed:
+                return changed
+
+        return changed
+
+    def rebuild(self, names):
+        """Rebuilds the libs in names and their dependents, then relinks
+            FFmpeg, returning True if everything built.
+        """
+        libs = self.dependents(names - {'ffmpeg'})
+        start = time.time()
+        building = libs | ({'ffmpeg'} if self.ffmpeg_src else set())
+        self._set_status(state='building', pending=[],
+                         building=sorted(building))
+        logging.info('Rebuilding: %s', ', '.join(sorted(building)))
+        built = {name: self._fingerprint(name) for name in building}
+        graph = scheduler.BuildScheduler(self.max_workers)
+        for name in libs:
+            graph.add(name,
+                      lambda lib=self.libs[name]: self.lib_builder.build(lib),
+                      self.libs[name].depends)
+
+        if self.ffmpeg_src is not None:
+            # FFmpeg's make doesn't know about the libs, so only relinks
+            #   when told to.
+            build_ffmpeg = (self.lib_builder.relink_ffmpeg
+                            if libs
+                            else self.lib_builder.build_ffmpeg)
+            graph.add('ffmpeg',
+                      lambda: build_ffmpeg(self.ffmpeg_src,
+                                           list(self.libs.values())),
+                      libs)
+
+        try:
+            results = graph.run()
+        finally:
+            # Drop the changes the builds made before watching again, the
+            #   sources changed meanwhile are found by their fingerprints.
+            self.watcher.wait(0)
+
+        for name in building:
+            if results[name].success:
+                self._fingerprints[name] = built[name]
+
+            if (built[name] is not None
+                    and self._fingerprint(name) != built[name]):
+                self._pending.add(name)
+
+        if self._pending:
+            logging.info('Changed while rebuilding: %s',
+                         ', '.join(sorted(self._pending)))
+            self._set_status(pending=sorted(self._pending))
+
+        success = all(res.success for res in results.values())
+        with self._lock:
+            self._status.update(
+                state='idle',
+                building=[],
+                builds=self._status['builds'] + 1,
+                failures=self._status['failures'] + (not success),
+                last={'started': start,
+                      'duration': time.time() - start,
+                      'changed': sorted(names),
+                      'results': {n: r.success for n, r in results.items()},
+                      'success': success})
+
+        logging.info('Rebuild %s in %.1fs',
+                     'succeeded' if success else 'FAILED',
+                     time.time() - start)
+        return success
+
+    def _serve(self, server):
+        while not self._stop.is_set():
+            ready, _, _ = select.select([server], [], [], 0.5)
+            if not ready:
+                continue
+
+            conn, _ = server.accept()
+            with conn:
+                conn.settimeout(0.5)
+                try:
+                    request = conn.recv(64).decode(errors='replace').strip()
+                except OSError:
+                    request = ''
+
+                if request == 'stop':
+                    logging.info('Stop requested')
+                    self._stop.set()
+
+                try:
+                    conn.sendall(json.dumps(self.status()).encode() + b'\n')
+                except OSError:
+                    pass
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        """Watches and rebuilds until stop() is called, 'stop' is sent to the
+            socket, or interrupted.
+        """
+        for name, root in self._roots.items():
+            self.watcher.add(root)
+            self._fingerprints[name] = self._fingerprint(name)
+
+        os.makedirs(self.socket_path.parent, exist_ok=True)
+        self.socket_path.unlink(missing_ok=True)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(str(self.socket_path))
+        server.listen()
+        serving = threading.Thread(target=self._serve, args=(server,),
+                                   daemon=True)
+        serving.start()
+        logging.info("Watching %s with %s, status on '%s'",
+                     ', '.join(sorted(self._roots)), self.watcher.name,
+                     self.socket_path)
+        self._set_status(state='idle')
+        try:
+            while not self._stop.is_set():
+                changed = self._collect()
+                if changed:
+                    self.rebuild(changed)
+        finally:
+            self._stop.set()
+            serving.join()
+            server.close()
+            self.socket_path.unlink(missing_ok=True)
+            self.watcher.close()
+
+def query(socket_path, request='status', timeout=5.0):
+    """Returns the status of the WatchDaemon serving on socket_path, after
+        sending it request.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.settimeout(timeout)
+        conn.connect(str(socket_path))
+        conn.sendall(request.encode() + b'\n')
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = conn.recv(4096)
+            if not chunk:
+                break
+
+            data += chunk
+
+    return json.loads(data)
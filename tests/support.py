@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# vim: se fenc=utf8 :
+"""Helpers shared by the tests.  Nothing here touches the network."""
+
+import os
+import subprocess
+import sys
+import textwrap
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _ROOT)
+sys.path.insert(0, os.path.join(_ROOT, 'scripts'))
+
+# git refuses to commit without an identity.
+GIT_ENV = {'GIT_AUTHOR_NAME': 'test',
+           'GIT_AUTHOR_EMAIL': 'test@localhost',
+           'GIT_COMMITTER_NAME': 'test',
+           'GIT_COMMITTER_EMAIL': 'test@localhost'}
+
+# A library module for registry.LibraryRegistry, see write_lib().
+_LIB_MODULE = '''
+from repobase import RepoBase, RepoTool
+
+LIBRARY = {{
+    'name': {name!r},
+    'class': 'TestLib',
+    'switch': '--enable-{name}',
+    'depends': {depends!r}
+}}
+
+class TestLib(RepoBase):
+
+    def __init__(self):
+        super().__init__(LIBRARY['name'],
+                         'configure ',
+                         RepoTool.GIT_TOOL,
+                         {url!r},
+                         LIBRARY['switch'],
+                         LIBRARY['depends'])
+        self.options.add_option('prefix', kwarg=True)
+
+    def get_repo_download(self):
+        pass
+'''
+
+# Sources of the libraries from make_lib_repo().  make compiles a single
+#   file, and fails unless the pkg-config file of every dependency is in
+#   the prefix and points at it.  install puts one for the library itself
+#   there.
+_CONFIGURE = '''#!/bin/sh
+for arg; do
+    case $arg in --prefix=*) echo "PREFIX = ${arg#--prefix=}" > config.mak;;
+    esac
+done
+'''
+
+_MAKEFILE = '''include config.mak
+
+all:
+\t$(CC) -c -x c /dev/null -o null.o
+\tfor d in {depends}; do \\
+\t    grep -qx "prefix=$(PREFIX)" $(PREFIX)/lib/pkgconfig/$$d.pc || exit 1; \\
+\tdone
+
+install:
+\tmkdir -p $(DESTDIR)$(PREFIX)/lib/pkgconfig
+\techo "prefix=$(PREFIX)" > $(DESTDIR)$(PREFIX)/lib/pkgconfig/{name}.pc
+'''
+
+def run(command_str, cwd=None):
+    """Runs command_str, raising if it fails."""
+    subprocess.run(command_str, shell=True, cwd=cwd, check=True,
+                   env=dict(os.environ, **GIT_ENV),
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def make_git_repo(path_str, files):
+    """Creates a git repository in path_str holding files, a dict of
+        relative path to contents, returning its URL.  Files starting with
+        '#!' are made executable.
+    """
+    for rel_str, contents in files.items():
+        file_str = os.path.join(path_str, rel_str)
+        os.makedirs(os.path.dirname(file_str), exist_ok=True)
+        with open(file_str, 'w') as out_file:
+            out_file.write(contents)
+
+        if contents.startswith('#!'):
+            os.chmod(file_str, 0o755)
+
+    run('git init -q && git add -A && git commit -qm init', path_str)
+    return f'file://{path_str:s}'
+
+def make_lib_repo(path_str, name, depends=()):
+    """Creates the git repository of a library checking that depends are
+        installed, see _MAKEFILE, returning its URL.
+    """
+    return make_git_repo(path_str, {
+        'configure': _CONFIGURE,
+        'Makefile': _MAKEFILE.format(name=name, depends=' '.join(depends))})
+
+def write_lib(lib_dir, name, url, depends=()):
+    """Writes the module of library name, fetched from url, to lib_dir."""
+    os.makedirs(lib_dir, exist_ok=True)
+    with open(os.path.join(lib_dir, f'{name:s}.py'), 'w') as mod:
+        mod.write(textwrap.dedent(_LIB_MODULE).format(name=name,
+                                                      depends=tuple(depends),
+                                                      url=url))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# vim: se fenc=utf8 :
+"""Compiler cache statistics of libs built at the same time."""
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import support
+
+import builder
+import compilercache
+import registry
+
+# Stands in for ccache: a compile is a hit if the same one was made in the
+#   same directory before.  Results go to the totals in $CCACHE_DIR/log,
+#   and to $CCACHE_STATSLOG the way ccache logs them.  Compiles take a
+#   while, so libs built at the same time overlap.
+_CCACHE = '''#!/bin/sh
+mkdir -p "$CCACHE_DIR"
+touch "$CCACHE_DIR/log"
+if [ "$1" = --print-stats ]; then
+    awk '{n[$1]++} END {for (k in n) printf "%s\\t%d\\n", k, n[k]}' \\
+        "$CCACHE_DIR/log"
+    exit 0
+fi
+key=$(echo "$PWD $*" | cksum | cut -d' ' -f1)
+if [ -e "$CCACHE_DIR/$key" ]; then
+    result=direct_cache_hit
+else
+    result=cache_miss
+    touch "$CCACHE_DIR/$key"
+fi
+sleep 0.3
+echo $result >> "$CCACHE_DIR/log"
+if [ -n "$CCACHE_STATSLOG" ]; then
+    printf '# %s\\n%s\\n' "$PWD" $result >> "$CCACHE_STATSLOG"
+fi
+exec "$@"
+'''
+
+_LIBS = ('libcca', 'libccb')
+
+class CompilerStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='ffscript-test-')
+        self.addCleanup(shutil.rmtree, self.root, True)
+        bin_dir = os.path.join(self.root, 'bin')
+        os.makedirs(bin_dir)
+        with open(os.path.join(bin_dir, 'ccache'), 'w') as ccache:
+            ccache.write(_CCACHE)
+
+        os.chmod(os.path.join(bin_dir, 'ccache'), 0o755)
+        env = mock.patch.dict(os.environ, {
+            'PATH': os.pathsep.join((bin_dir, os.environ['PATH']))})
+        env.start()
+        self.addCleanup(env.stop)
+
+        lib_dir = os.path.join(self.root, 'libs')
+        for name in _LIBS:
+            url = support.make_lib_repo(
+                os.path.join(self.root, 'repos', name), name)
+            support.write_lib(lib_dir, name, url)
+            self.addCleanup(sys.modules.pop, name, None)
+
+        sys.path.insert(0, lib_dir)
+        self.addCleanup(sys.path.remove, lib_dir)
+        self.repos = registry.LibraryRegistry(lib_dir)
+        self.lib_builder = builder.LibBuilder(
+            os.path.join(self.root, 'repos'),
+            os.path.join(self.root, 'prefix'),
+            compiler_cache=compilercache.CompilerCache(
+                'ccache', os.path.join(self.root, 'ccache')))
+
+    def _build_all(self):
+        threads = [threading.Thread(target=self.lib_builder.build,
+                                    args=(self.repos[name],))
+                   for name in _LIBS]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+    def _report(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.lib_builder.report()
+
+        return {line.split()[0]: line.split()[1:4:2]
+                for line in out.getvalue().splitlines()[1:]}
+
+    def test_parallel_builds(self):
+        self._build_all()
+        for name in _LIBS:
+            self.assertEqual(self.lib_builder.compiler_stats[name],
+                             {'hits': 0, 'misses': 1})
+
+        self._build_all()
+        for name in _LIBS:
+            self.assertEqual(self.lib_builder.compiler_stats[name],
+                             {'hits': 1, 'misses': 0})
+
+        self.assertEqual(self._report()['total'], ['2', '2'])
+
+    def test_totals_only(self):
+        with mock.patch.object(compilercache.CompilerCache, 'logs_stats',
+                               False):
+            self._build_all()
+            self.assertEqual(self.lib_builder.compiler_stats, {})
+            self.assertEqual(self._report(), {'total': ['0', '2']})
+
+if __name__ == '__main__':
+    unittest.main()
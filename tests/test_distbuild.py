@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# vim: se fenc=utf8 :
+"""Distributed builds, with a worker on the loopback interface."""
+
+import io
+import os
+import shutil
+import socket
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+
+import support
+
+import builder
+import distbuild
+import registry
+
+# libdistc depends on libdistb, which depends on libdista.
+_CHAIN = (('libdista', ()),
+          ('libdistb', ('libdista',)),
+          ('libdistc', ('libdistb',)))
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _wait_listening(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1.0).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+
+            time.sleep(0.05)
+
+class LoopbackBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='ffscript-test-')
+        self.addCleanup(shutil.rmtree, self.root, True)
+        lib_dir = os.path.join(self.root, 'libs')
+        os.makedirs(os.path.join(self.root, 'repos'))
+        needs = []
+        for name, depends in _CHAIN:
+            url = support.make_lib_repo(
+                os.path.join(self.root, 'upstream', name), name, needs)
+            support.write_lib(lib_dir, name, url, depends)
+            support.run(f'git clone -q {url:s} {name:s}',
+                        os.path.join(self.root, 'repos'))
+            needs = needs + [name]
+
+        sys.path.insert(0, lib_dir)
+        self.addCleanup(sys.path.remove, lib_dir)
+        # Each test writes its own modules, with URLs of its own.
+        for name, _ in _CHAIN:
+            self.addCleanup(sys.modules.pop, name, None)
+
+        self.repos = registry.LibraryRegistry(lib_dir)
+        self.prefix = os.path.join(self.root, 'prefix')
+        self.worker = distbuild.BuildWorker(
+            builder.LibBuilder(os.path.join(self.root, 'worker'), None),
+            self.repos)
+        self.coordinator = builder.LibBuilder(
+            os.path.join(self.root, 'repos'), self.prefix)
+
+    def _pc_prefix(self, prefix_str, name):
+        with open(os.path.join(prefix_str, 'lib', 'pkgconfig',
+                               f'{name:s}.pc')) as pc_file:
+            return pc_file.read().strip()
+
+    def test_transitive_depends(self):
+        remote = distbuild.RemoteBuilder(self.coordinator, None, self.repos)
+        self.assertEqual(remote.get_depends(self.repos['libdistc']),
+                         ('libdista', 'libdistb'))
+
+    def test_loopback_worker(self):
+        remote = distbuild.RemoteBuilder(self.coordinator, self._serve(),
+                                         self.repos)
+        for name, _ in _CHAIN:
+            self.assertTrue(remote.build(self.repos[name]), name)
+            self.assertEqual(self._pc_prefix(self.prefix, name),
+                             f'prefix={self.prefix:s}')
+
+        self.assertEqual(builder.read_provenance(self.prefix)['libdistc']
+                         ['worker'], socket.gethostname())
+
+    def _serve(self):
+        port = _free_port()
+        transport = distbuild.SocketTransport([f'127.0.0.1:{port:d}'])
+        threading.Thread(target=self.worker.serve, args=(transport,),
+                         daemon=True).start()
+        _wait_listening(port)
+        return transport
+
+    def test_installed_depends_send_the_prefix(self):
+        self.assertTrue(self.coordinator.build(self.repos['libdista']))
+        remote = distbuild.RemoteBuilder(self.coordinator, self._serve(),
+                                         self.repos)
+        self.assertTrue(remote.build(self.repos['libdistb']))
+        self.assertEqual(self._pc_prefix(self.prefix, 'libdistb'),
+                         f'prefix={self.prefix:s}')
+
+    def test_absent_depends_fail(self):
+        remote = distbuild.RemoteBuilder(self.coordinator, self._serve(),
+                                         self.repos)
+        self.assertFalse(remote.build(self.repos['libdistb']))
+        self.assertFalse(os.path.exists(self.prefix))
+
+    def test_worker_never_writes_the_prefix(self):
+        spec = distbuild.RemoteBuilder(self.coordinator, None,
+                                       self.repos).get_spec(
+                                           self.repos['libdista'])
+        res = self.worker.build(spec, {})
+        self.assertTrue(res.success, res.output)
+        self.assertFalse(os.path.exists(self.prefix))
+        with tarfile.open(fileobj=io.BytesIO(res.archive)) as tar:
+            pc_file = tar.extractfile('lib/pkgconfig/libdista.pc')
+            self.assertEqual(pc_file.read().decode().strip(),
+                             f'prefix={self.prefix:s}')
+
+    def test_missing_depends_fail(self):
+        spec = distbuild.RemoteBuilder(self.coordinator, None,
+                                       self.repos).get_spec(
+                                           self.repos['libdistb'])
+        res = self.worker.build(spec, {})
+        self.assertFalse(res.success)
+        self.assertIn('libdista', res.output)
+
+if __name__ == '__main__':
+    unittest.main()
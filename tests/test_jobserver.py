@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# vim: se fenc=utf8 :
+"""Job slots shared by makes running at the same time."""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import support  # Puts scripts/ on sys.path.
+
+import builder
+import jobserver
+from repobase import BuildStep
+
+_JOBS = 2
+_MAKES = 3
+
+# Four jobs that can all run at once, logging when they start and end.
+_MAKEFILE = '''all: t1 t2 t3 t4
+
+t%:
+\t@echo "$$(date +%s%N) 1" >> {log}
+\t@sleep 0.3
+\t@echo "$$(date +%s%N) -1" >> {log}
+'''
+
+class JobServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='ffscript-test-')
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.log = os.path.join(self.root, 'jobs.log')
+
+    def _most_at_once(self):
+        with open(self.log) as log_file:
+            events = sorted(tuple(map(int, line.split()))
+                            for line in log_file)
+
+        running = most = 0
+        for _, change in events:
+            running += change
+            most = max(most, running)
+
+        return most
+
+    def test_slots_are_shared(self):
+        server = jobserver.JobServer(_JOBS, interval=None)
+        self.addCleanup(server.close)
+        lib_builder = builder.LibBuilder(self.root,
+                                         os.path.join(self.root, 'prefix'),
+                                         jobserver=server)
+        threads = []
+        for i in range(_MAKES):
+            cwd = os.path.join(self.root, f'make{i:d}')
+            os.makedirs(cwd)
+            with open(os.path.join(cwd, 'Makefile'), 'w') as makefile:
+                makefile.write(_MAKEFILE.format(log=self.log))
+
+            threads.append(threading.Thread(
+                target=lib_builder.run_steps,
+                args=(f'make{i:d}', [BuildStep('make', 'make')], cwd)))
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        with open(self.log) as log_file:
+            self.assertEqual(len(log_file.readlines()), _MAKES * 4 * 2)
+
+        self.assertLessEqual(self._most_at_once(), _JOBS)
+        # Every token made it back to the pipe.
+        self.assertEqual(server.running(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
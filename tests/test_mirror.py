@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# vim: se fenc=utf8 :
+"""Mirrors and the repo engine, against local file:// repositories."""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import support
+
+import mirror
+import repoengine
+from repobase import RepoBase, RepoTool
+
+class _Repo(RepoBase):
+
+    def __init__(self, url):
+        super().__init__('libmirror', 'configure ', RepoTool.GIT_TOOL, url)
+
+    def get_repo_download(self):
+        pass
+
+def _git(cwd, *args):
+    return subprocess.run(('git',) + args, cwd=cwd, check=True,
+                          capture_output=True, text=True).stdout.strip()
+
+class MirrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='ffscript-test-')
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.upstream = os.path.join(self.root, 'upstream')
+        self.repo = _Repo(support.make_git_repo(self.upstream,
+                                                {'README': 'one\n'}))
+        # Paths with spaces have to be quoted in the commands.
+        self.mirrors = mirror.MirrorStore(os.path.join(self.root,
+                                                       'mirror store'))
+        self.engine = repoengine.RepoEngine(os.path.join(self.root, 'repos'),
+                                            mirrors=self.mirrors)
+        self.checkout = os.path.join(self.root, 'repos', 'libmirror')
+
+    def _commit(self, contents):
+        with open(os.path.join(self.upstream, 'README'), 'w') as readme:
+            readme.write(contents)
+
+        support.run('git commit -qam change', self.upstream)
+        return _git(self.upstream, 'rev-parse', 'HEAD')
+
+    def test_download_borrows_objects(self):
+        res, = self.engine.download([self.repo])
+        self.assertTrue(res.success, res.output)
+        self.assertTrue(self.mirrors.mirror_path(self.repo).is_dir())
+        alternates = os.path.join(self.checkout, '.git', 'objects', 'info',
+                                  'alternates')
+        with open(alternates) as alt_file:
+            self.assertEqual(alt_file.read().strip(),
+                             os.path.join(self.mirrors.mirror_path(self.repo),
+                                          'objects'))
+
+    def test_update_from_the_mirror(self):
+        self.engine.download([self.repo])
+        head = self._commit('two\n')
+        # Only the mirror may reach upstream.
+        _git(self.checkout, 'remote', 'set-url', 'origin',
+             os.path.join(self.root, 'nowhere'))
+
+        res, = self.engine.update([self.repo])
+        self.assertTrue(res.success, res.output)
+        self.assertTrue(res.changed)
+        self.assertEqual(res.revision, head)
+        self.assertTrue(self.mirrors.has_revision(self.repo, head))
+
+    def test_checkout_worktree(self):
+        first = _git(self.upstream, 'rev-parse', 'HEAD')
+        head = self._commit('two\n')
+
+        res, = self.engine.checkout([self.repo], {'libmirror': first})
+        self.assertTrue(res.success, res.output)
+        self.assertTrue(self.mirrors.is_shared(self.repo, self.checkout))
+        self.assertEqual(res.revision, first)
+
+        res, = self.engine.checkout([self.repo], {'libmirror': head[:10]})
+        self.assertTrue(res.success, res.output)
+        self.assertEqual(res.revision, head)
+        with open(os.path.join(self.checkout, 'README')) as readme:
+            self.assertEqual(readme.read(), 'two\n')
+
+if __name__ == '__main__':
+    unittest.main()
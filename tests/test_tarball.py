@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# vim: se fenc=utf8 :
+"""Release tarballs, against a local HTTP server."""
+
+import hashlib
+import http.server
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+
+import support  # Puts scripts/ on sys.path.
+
+import tarball
+
+_CHUNK_SIZE = 4096
+
+def _make_tarball(version):
+    """Returns a tarball of 'pkg-{version}/', big enough for several
+        chunks.
+    """
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as tar:
+        for name, data in (('VERSION', version.encode()),
+                           ('data.bin', os.urandom(6 * _CHUNK_SIZE))):
+            info = tarfile.TarInfo(f'pkg-{version:s}/{name:s}')
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    return buf.getvalue()
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Serves server.data, with ranges if server.ranges, and ETags."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._reply(False)
+
+    def do_GET(self):
+        self._reply(True)
+
+    def _reply(self, body):
+        server = self.server
+        range_str = self.headers.get('Range')
+        server.requests.append((self.command, range_str,
+                                self.headers.get('If-None-Match')))
+        if self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        data = server.data
+        if range_str and server.ranges:
+            start, end = map(int, range_str[len('bytes='):].split('-'))
+            if start >= server.fail_from:
+                self.send_error(500)
+                return
+
+            data = data[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             f'bytes {start:d}-{end:d}/{len(server.data):d}')
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', server.etag)
+        if server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+class TarballTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='ffscript-test-')
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      _Handler)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self._serve('1.0')
+        self.server.ranges = True
+        self.server.fail_from = float('inf')
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+
+        self.url = (f'http://127.0.0.1:{self.server.server_address[1]:d}'
+                    '/pkg.tar')
+        self.dest = os.path.join(self.root, 'src', 'pkg')
+        self.fetcher = tarball.TarballFetcher(os.path.join(self.root,
+                                                           'cache'),
+                                              connections=1,
+                                              chunk_size=_CHUNK_SIZE,
+                                              timeout=10)
+
+    def _serve(self, version):
+        self.server.data = _make_tarball(version)
+        self.server.etag = f'"{version:s}"'
+        self.server.requests = []
+
+    def _version(self):
+        with open(os.path.join(self.dest, 'VERSION')) as version:
+            return version.read()
+
+    def _ranges(self):
+        return [r for _, r, _ in self.server.requests if r]
+
+    def test_fetch(self):
+        sha256 = self.fetcher.fetch(self.url, self.dest)
+        self.assertEqual(sha256, hashlib.sha256(self.server.data).hexdigest())
+        self.assertEqual(self._version(), '1.0')
+        with open(os.path.join(self.dest, tarball.MARKER)) as marker:
+            self.assertEqual(json.load(marker)['sha256'], sha256)
+
+    def test_resume(self):
+        self.server.fail_from = 3 * _CHUNK_SIZE
+        with self.assertRaises(OSError):
+            self.fetcher.fetch(self.url, self.dest)
+
+        done = self._ranges()
+        self.server.fail_from = float('inf')
+        self.server.requests = []
+        sha256 = self.fetcher.fetch(self.url, self.dest)
+        self.assertEqual(sha256, hashlib.sha256(self.server.data).hexdigest())
+        self.assertEqual(self._version(), '1.0')
+        # Only the chunks that failed are asked for again.
+        self.assertEqual(self._ranges()[0],
+                         f'bytes={3 * _CHUNK_SIZE:d}-{4 * _CHUNK_SIZE - 1:d}')
+        self.assertFalse(set(done[:3]) & set(self._ranges()))
+
+    def test_update_not_modified(self):
+        self.fetcher.fetch(self.url, self.dest)
+        self.server.requests = []
+        self.assertIsNone(self.fetcher.update(self.url, self.dest))
+        self.assertEqual(self.server.requests, [('GET', None, '"1.0"')])
+
+    def test_update_modified(self):
+        self.fetcher.fetch(self.url, self.dest)
+        self._serve('2.0')
+        sha256 = self.fetcher.update(self.url, self.dest)
+        self.assertEqual(sha256, hashlib.sha256(self.server.data).hexdigest())
+        self.assertEqual(self._version(), '2.0')
+        self.assertNotIn('HEAD', [m for m, _, _ in self.server.requests])
+
+    def test_update_without_ranges(self):
+        self.server.ranges = False
+        self.fetcher.fetch(self.url, self.dest)
+        self._serve('2.0')
+        self.fetcher.update(self.url, self.dest)
+        self.assertEqual(self._version(), '2.0')
+        # The body of the conditional GET is what gets extracted.
+        self.assertEqual(self.server.requests, [('GET', None, '"1.0"')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# vim: se fenc=utf8 :
+"""Rebuilds of an FFmpeg tree that isn't a git checkout."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import support  # Puts scripts/ on sys.path.
+
+import builder
+import watcher
+
+class _Builder(builder.LibBuilder):
+    """Builds FFmpeg by leaving outputs in its tree, and saving edit, if
+        any, as it does.
+    """
+
+    edit = None
+
+    def build_ffmpeg(self, ffmpeg_src, libs):
+        for name in ('ffmpeg_g', os.path.join('libavutil', 'log.o')):
+            with open(os.path.join(ffmpeg_src, name), 'a') as out:
+                out.write('built\n')
+
+        if self.edit:
+            with open(os.path.join(ffmpeg_src, self.edit), 'a') as src:
+                src.write('/* edited */\n')
+
+        return True
+
+class WatchDaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='ffscript-test-')
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.ffmpeg_src = os.path.join(self.root, 'ffmpeg')
+        os.makedirs(os.path.join(self.ffmpeg_src, 'libavutil'))
+        with open(os.path.join(self.ffmpeg_src, 'libavutil', 'log.c'),
+                  'w') as src:
+            src.write('int av_log_level;\n')
+
+        self.lib_builder = _Builder(self.root,
+                                    os.path.join(self.root, 'prefix'))
+        self.daemon = watcher.WatchDaemon(
+            self.lib_builder, [], os.path.join(self.root, 'watch.sock'),
+            self.ffmpeg_src, watcher.PollWatcher())
+
+    def test_outputs_are_not_changes(self):
+        self.assertTrue(self.daemon.rebuild({'ffmpeg'}))
+        self.assertEqual(self.daemon.status()['pending'], [])
+
+    def test_edits_while_rebuilding(self):
+        self.lib_builder.edit = os.path.join('libavutil', 'log.c')
+        self.assertTrue(self.daemon.rebuild({'ffmpeg'}))
+        self.assertEqual(self.daemon.status()['pending'], ['ffmpeg'])
+
+if __name__ == '__main__':
+    unittest.main()
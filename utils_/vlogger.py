@@ -1,6 +1,16 @@
 # vim: se fenc=utf8 :
 
+import atexit
+import contextlib
+import contextvars
+import copy
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
 from enum import Enum
 
 __author__ = "Francesco Magliocco (aka Cmptr)"
@@ -22,7 +32,7 @@ class VColors(Enum):
 
     @classmethod
     def has_name(cls, name):
-        return any(name == item.name for item in cls)
+        return name in cls.__members__
 
 _LEVEL_TO_FMT = {
     VColors.CRITICAL.name:
@@ -42,32 +52,213 @@ _LEVEL_TO_FMT = {
                                                      VColors.NORMAL.value)
 }
 
+# Shown instead of the colors of VColors when colors are off.
+_LEVEL_TO_PLAIN = {
+    'CRITICAL': '[CRITICAL]\t',
+    'ERROR': '[ERROR  ]\t',
+    'WARNING': '[WARNING]\t',
+    'INFO': '',
+    'DEBUG': '[DEBUG  ]\t'
+}
+
+def use_color(stream):
+    """Returns True if stream should be written colors to.
+
+        NO_COLOR turns colors off and FORCE_COLOR on, whatever stream is.
+            Otherwise only terminals get colors.
+    """
+    if os.environ.get('NO_COLOR'):
+        return False
+
+    if os.environ.get('FORCE_COLOR'):
+        return True
+
+    isatty = getattr(stream, 'isatty', None)
+    return (bool(isatty and isatty())
+            and os.environ.get('TERM', '') != 'dumb')
+
 # https://stackoverflow.com/a/384125
 class VFormatter(logging.Formatter):
+    """Formats records with the colors of VColors.
+
+        The format of every level is worked out once, here, so formatting a
+            record is a single dict lookup, and the record is never changed.
+            Other handlers (e.g. JsonLinesFormatter) see it as it was logged.
+    """
+
     def __init__(self, msg, use_color=True):
         logging.Formatter.__init__(self, msg)
         self.use_color = use_color
+        self._level_to_formatter = {
+            logging.getLevelName(name): logging.Formatter(
+                self._level_format(msg, name))
+            for name in _LEVEL_TO_PLAIN}
+
+    def _level_format(self, msg, name):
+        if self.use_color:
+            prefix = VColors[name].value
+        else:
+            prefix = _LEVEL_TO_PLAIN[name]
+            msg = msg.replace(VColors.NORMAL.value, '')
+
+        # The module was never shown, see the history of this file.
+        return (msg.replace('%(levelname)s', prefix.replace('%', '%%'))
+                .replace('%(module)s', ''))
 
     def format(self, record):
-        levelname = record.levelname
-#        levelno = record.levelno
-        module = record.module
-
-        if self.use_color and VColors.has_name(levelname):
-            record.levelname = VColors[levelname].value
-
-#            if record.levelno >= logging.ERROR:
-#                module = record.module
-#                lineno = record.lineno
-#                record.lineno = VColors.GREEN.value + str(lineno)
-#                record.module = (VColors.WARNING.value
-#                                 + module
-#                                 + VColors.GREEN.value)
-#            else:
-            record.lineno = 0
-            record.module = ""
-
-        return logging.Formatter.format(self, record)
+        formatter = self._level_to_formatter.get(record.levelno)
+        if formatter is None:
+            return logging.Formatter.format(self, record)
+
+        return formatter.format(record)
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formats records as single line JSON objects, with the lib and phase
+        they were logged for (See log_context()).
+    """
+
+    def format(self, record):
+        entry = {'time': record.created,
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'module': record.module,
+                 'thread': record.threadName,
+                 'lib': getattr(record, 'lib', None),
+                 'phase': getattr(record, 'phase', None),
+                 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(entry)
+
+_CONTEXT = contextvars.ContextVar('vlogger_context', default=(None, None))
+
+@contextlib.contextmanager
+def log_context(lib=None, phase=None):
+    """Tags everything logged in the with block, by this thread, with lib
+        and phase.
+    """
+    token = _CONTEXT.set((lib, phase))
+    try:
+        yield
+    finally:
+        _CONTEXT.reset(token)
+
+class _ContextRecordFactory:
+    """Creates records with the lib and phase of log_context() set, so they
+        never have to be added to a record later on.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def __call__(self, *args, **kwargs):
+        record = self.factory(*args, **kwargs)
+        record.lib, record.phase = _CONTEXT.get()
+        return record
+
+class _QueueHandler(logging.handlers.QueueHandler):
+
+    def prepare(self, record):
+        # The message is merged here, so its arguments can't change before
+        #   the listener gets to it, on a copy so the record stays as it was
+        #   logged.  Everything else is left to the listener.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+class LogPipeline:
+    """Hands every record to a thread that formats and writes it, so logging
+        never waits on formatting, I/O or handler locks.
+
+        The root logger is set to level and given a single handler putting
+            records on a queue.  Records are taken off it and handed to the
+            handlers of this pipeline by a logging.handlers.QueueListener.
+            stop() (Called at exit) writes out whatever is still queued.
+
+        Anything else writing to the stream of the console, e.g. print(),
+            should flush() first, or its output ends up in the middle of
+            records still queued.
+
+        Arguments, required:
+            level: Level of the console, see set_level().
+            formatter: Formatter of the console.
+
+        Arguments, optional:
+            stream: Where the console writes to.
+    """
+
+    def __init__(self, level, formatter, stream=sys.stdout):
+        # A Queue, not a SimpleQueue, so flush() can join() it.
+        self._queue = queue.Queue()
+        self.console = logging.StreamHandler(stream)
+        self.console.setLevel(level)
+        self.console.setFormatter(formatter)
+        self.handlers = [self.console]
+        self._listener = None
+        self._lock = threading.Lock()
+
+        factory = logging.getLogRecordFactory()
+        if not isinstance(factory, _ContextRecordFactory):
+            logging.setLogRecordFactory(_ContextRecordFactory(factory))
+
+        logging.basicConfig(level=level,
+                            handlers=[_QueueHandler(self._queue)],
+                            force=True)
+        self.start()
+        atexit.register(self.stop)
+
+    def start(self):
+        with self._lock:
+            if self._listener is None:
+                self._listener = logging.handlers.QueueListener(
+                    self._queue, *self.handlers, respect_handler_level=True)
+                self._listener.start()
+
+    def stop(self):
+        with self._lock:
+            if self._listener is not None:
+                self._listener.stop()
+                self._listener = None
+
+            for handler in self.handlers:
+                handler.flush()
+
+    def flush(self):
+        """Waits until every record logged so far has been written out."""
+        with self._lock:
+            if self._listener is not None:
+                self._queue.join()
+
+            for handler in self.handlers:
+                handler.flush()
+
+    def _update_root_level(self):
+        # Records no handler wants aren't even queued.
+        logging.getLogger().setLevel(min(h.level for h in self.handlers))
+
+    def set_level(self, level):
+        """Shows records of at least level on the console."""
+        self.console.setLevel(level)
+        self._update_root_level()
+
+    def add_handler(self, handler):
+        """Starts handing records to handler too."""
+        self.stop()
+        self.handlers.append(handler)
+        self._update_root_level()
+        self.start()
+
+    def add_json_sink(self, path_str, level=logging.DEBUG):
+        """Appends every record of at least level to path_str as a line of
+            JSON (See JsonLinesFormatter).
+        """
+        handler = logging.FileHandler(path_str, encoding='utf-8')
+        handler.setLevel(level)
+        handler.setFormatter(JsonLinesFormatter())
+        self.add_handler(handler)
+        return handler
 
 # https://stackoverflow.com/a/384125
 #class VLogger(logging.Logger):